@@ -0,0 +1,223 @@
+"""
+Admission control and per-client rate limiting of the synchronous transform routes.
+
+Every transform request is given a cost before any pixel is decoded:
+`inference_cost` units when its workflow runs background removal, plus
+`megapixel_cost` units per megapixel of the photo (read from its header)
+for decoding, compositing and encoding. A worker process admits requests
+while the cost in flight stays within `capacity` units (times
+offload.processes when the workflows are offloaded); beyond it requests
+are answered at once with 429 and a Retry-After estimated from the
+measured seconds per cost unit, instead of queuing behind the worker's
+other photos into the gunicorn timeout.
+
+Each client, identified by its `key_header` (an API key) or else its
+address, also draws the cost of its requests from a token bucket of
+`burst` units refilled at `rate` units per second. The buckets live in a
+SQLite file shared by all workers on the host, so a client gets the same
+rate whichever worker serves it. Decisions are counted by route in
+pixel_admission_decisions_total.
+"""
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+
+from PIL import Image
+
+from app.image_processing.offload import process_offload
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MEGAPIXEL = 1000 * 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class Overloaded(Exception):
+    """Raised by AdmissionControl.admit for requests that are not admitted, answered with 429."""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        # over_capacity or rate_limited, the decision label of the metrics
+        self.reason = reason
+
+
+class AdmissionControl:
+    """Per-worker in-flight cost limit and host-wide per-client token buckets."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0.0
+        self._initialized = False
+        self._last_expiry = 0.0
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `admission` section of the app config.
+
+        :param settings: dict with optional keys enabled, capacity, inference_cost, megapixel_cost,
+                         rate and burst (0 rate disables the buckets), key_header and db_path
+        """
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled", True))
+        self.capacity = float(settings.get("capacity", 4))
+        self.inference_cost = float(settings.get("inference_cost", 1))
+        self.megapixel_cost = float(settings.get("megapixel_cost", 0.05))
+        self.rate = float(settings.get("rate", 0))
+        self.burst = float(settings.get("burst", 0)) or max(self.capacity, self.rate)
+        self.key_header = settings.get("key_header", "X-API-Key")
+        self.db_path = settings.get("db_path", "/tmp/pixel-showroom/rate-limits.sqlite3")
+        # Seconds a cost unit keeps the worker busy, measured on admitted requests
+        self._seconds_per_cost = 1.0
+        self._initialized = False
+
+    def max_cost(self):
+        """Cost this worker admits at the same time."""
+        return self.capacity * (process_offload.processes if process_offload.enabled else 1)
+
+    def in_flight(self):
+        return self._in_flight
+
+    def cost(self, pixels, inference=True):
+        """Estimated cost of processing a photo of `pixels` pixels, with or without background removal."""
+        return (self.inference_cost if inference else 0.0) + pixels / MEGAPIXEL * self.megapixel_cost
+
+    def client_key(self, request):
+        """
+        The rate limiting key of a Flask request: its API key, hashed, or the client address
+        (from X-Forwarded-For behind the `proxy.x_for` trusted proxies, see app.py).
+        """
+        api_key = request.headers.get(self.key_header) if self.key_header else None
+        if api_key:
+            return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+        return f"addr:{request.remote_addr}"
+
+    @contextmanager
+    def admit(self, cost, key, route, hold=None):
+        """
+        Hold `hold` (by default `cost`) units of the worker's capacity while the block runs,
+        after drawing `cost` units from the client's bucket.
+
+        :raises Overloaded: When the worker is at capacity or the client's bucket is empty
+        """
+        if not self.enabled:
+            yield
+            return
+        hold = cost if hold is None else hold
+        try:
+            self._reserve(hold)
+            try:
+                self._take(key, cost)
+            except Overloaded:
+                self._release(hold)
+                raise
+        except Overloaded as e:
+            metrics.inc("pixel_admission_decisions_total", route=route, decision=e.reason)
+            raise
+        metrics.inc("pixel_admission_decisions_total", route=route, decision="admitted")
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(hold, time.perf_counter() - started)
+
+    def _reserve(self, cost):
+        with self._lock:
+            max_cost = self.max_cost()
+            # A request larger than the whole capacity still runs, alone
+            if self._in_flight > 0 and self._in_flight + cost > max_cost:
+                excess = self._in_flight + cost - max_cost
+                raise Overloaded(f"Server is at capacity ({self._in_flight:g} of {max_cost:g} cost units "
+                                 f"in flight), retry later", _seconds(excess * self._seconds_per_cost),
+                                 "over_capacity")
+            self._in_flight += cost
+
+    def _release(self, cost, seconds=None):
+        with self._lock:
+            self._in_flight = max(0.0, self._in_flight - cost)
+            if seconds is not None and cost > 0:
+                self._seconds_per_cost = 0.8 * self._seconds_per_cost + 0.2 * seconds / cost
+
+    def _take(self, key, cost):
+        """Draw `cost` units from the key's bucket, refilled at `rate` since it was last drawn from."""
+        if self.rate <= 0:
+            return
+        # A request costing more than the whole bucket is admitted when the bucket is full
+        cost = min(cost, self.burst)
+        now = time.time()
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            # Rate limiting must not take the service down with it
+            logger.warning("Could not open the rate limit database %s: %s", self.db_path, e)
+            return
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            if tokens < cost:
+                conn.execute("ROLLBACK")
+                raise Overloaded(f"Rate limit of {self.rate:g} cost units per second exceeded, retry later",
+                                 _seconds((cost - tokens) / self.rate), "rate_limited")
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                         (key, tokens - cost, now))
+            if now - self._last_expiry > 60:
+                # Buckets that have refilled completely are the same as no bucket
+                self._last_expiry = now
+                conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.burst / self.rate,))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning("Could not update the rate limit of %s: %s", key, e)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+
+def image_pixels(source):
+    """Pixel count of an image from its header, 0 when it cannot be read."""
+    if not source:
+        return 0
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            source = BytesIO(source)
+        position = source.tell()
+        try:
+            with Image.open(source) as image:
+                return image.width * image.height
+        finally:
+            source.seek(position)
+    except Exception:
+        return 0
+
+
+def _seconds(seconds):
+    """Retry-After value: whole seconds, at least 1."""
+    return max(1, math.ceil(seconds))
+
+
+# One admission controller per worker process, configured from the `admission` section
+admission_control = AdmissionControl()
@@ -1,7 +1,23 @@
 import yaml
 import os
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app.admission import admission_control
 from app.config.swagger_config import create_api
+from app.image_processing.asset_store import asset_store
+from app.image_processing.batching import inference_engine
+from app.image_processing.compositor import mask_edges
+from app.image_processing.encoders import output_encoder
+from app.image_processing.ingestion import image_ingestion
+from app.image_processing.mask_cache import mask_cache
+from app.image_processing.mask_upsampler import mask_upsampler
+from app.image_processing.response_cache import response_cache
+from app.image_processing.scratch import scratch_buffers
+from app.jobs.job_queue import job_manager
+from app.image_processing.session_pool import session_pool
+from app.image_processing.tiling import tiled_compositor
+from app.metrics import metrics
+from app.profiling import profiler
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -29,6 +45,57 @@ def load_env_config():
 
 load_env_config()
 
+# The client address of requests behind the load balancer and CDN (rate limiting keys on it) is taken
+# from the X-Forwarded-For entries appended by the `x_for` trusted proxies, not from the proxy's address
+trusted_proxies = int((app.config.get('proxy') or {}).get('x_for', 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+# Requests above request_max_size are answered with 413 before their body is read
+app.config['MAX_CONTENT_LENGTH'] = int(float(app.config.get('request_max_size', 200)) * 1024 * 1024)
+# Upload checks done from the image header: size per file, format, pixel count
+image_ingestion.configure(app.config.get('ingestion'), max_file_mb=app.config.get('image_max_size'))
+# Uploads spooled in memory, then on tmpfs, instead of temp files on the root disk
+scratch_buffers.configure(app.config.get('scratch'))
+scratch_buffers.init_app(app)
+# One rembg session per worker, built from the `rembg` config section
+session_pool.configure(app.config.get('rembg'))
+# Micro-batching of concurrent background removal requests
+inference_engine.configure(app.config.get('batching'))
+# Cache of background removal masks, keyed by upload digest and model
+mask_cache.configure(app.config.get('mask_cache'))
+# Inference on a downsampled copy of large photos, mask upsampled to full size
+mask_upsampler.configure(app.config.get('mask_upsampling'))
+# Optional refining and feathering of mask edges before the cutout is made
+mask_edges.configure(app.config.get('mask_edges'))
+# Output formats, qualities and resized delivery variants
+output_encoder.configure(app.config.get('output'))
+# Asynchronous job queue shared by all workers
+job_manager.configure(app.config.get('jobs'))
+# Registered logos and backgrounds with cached resized variants
+asset_store.configure(app.config.get('assets'))
+# Large photos composited onto backgrounds and encoded in bands of rows, to bound their memory
+tiled_compositor.configure(app.config.get('tiling'))
+# Transform results by ETag; the ETag covers the settings that change the output pixels
+response_cache.configure(app.config.get('response_cache'),
+                         {section: app.config.get(section)
+                          for section in ('rembg', 'mask_upsampling', 'mask_edges', 'output', 'tiling')})
+# In-flight cost limit per worker and per-client token buckets of the transform routes
+admission_control.configure(app.config.get('admission'))
+
+# Per-route and per-stage latency, gauges and counters, merged across workers on /metrics
+metrics.configure(app.config.get('metrics'))
+metrics.init_app(app)
+metrics.register_gauge('pixel_inference_queue_depth', inference_engine.queue_depth)
+metrics.register_gauge('pixel_admission_cost_in_flight', admission_control.in_flight)
+metrics.register_gauge('pixel_admission_capacity', admission_control.max_cost)
+metrics.register_gauge('pixel_jobs', lambda: {(('status', status),): count
+                                              for status, count in job_manager.stats().items()},
+                       per_worker=False)
+
+# Admin-only stack sampling, per-request cProfile and tracemalloc snapshots, off unless enabled
+profiler.configure(app.config.get('profiling'))
+profiler.init_app(app)
+
 # Create and configure the API
 api = create_api(app)
 
@@ -0,0 +1,116 @@
+"""
+ASGI serving mode:
+
+    uvicorn app.asgi:app --host 0.0.0.0 --port 5000
+
+The same Flask app, routes and parsers behind an asyncio front end. The
+event loop receives uploads into scratch buffers (see scratch.py) and
+sends responses chunk by chunk, so slow clients hold no thread. Complete
+requests are handed to `offload.threads` threads running the Flask views,
+which offload the transform workflows to the process pool (offload.py),
+always enabled in this mode. One uvicorn process per host is enough: the
+CPU bound work runs in its `offload.processes` worker processes.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import AsyncToSync, sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+from app.app import app as flask_app
+from app.image_processing.offload import process_offload
+from app.image_processing.scratch import ScratchFull, scratch_buffers
+
+
+class AsgiApp:
+    """ASGI application running a WSGI app on a thread pool, with the offload pool's lifespan."""
+
+    def __init__(self, wsgi_app, threads=16):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await _Request(self.wsgi_app)(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                process_offload.configure({**(flask_app.config.get('offload') or {}), 'enabled': True})
+                loop.set_default_executor(ThreadPoolExecutor(self.threads, thread_name_prefix='asgi'))
+                try:
+                    # Spawns the worker processes and waits for their model warm-up
+                    await loop.run_in_executor(None, process_offload.start)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await loop.run_in_executor(None, process_offload.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class _Request(WsgiToAsgiInstance):
+    """One HTTP request: body received on the event loop, WSGI app run on a pool thread."""
+
+    async def __call__(self, scope, receive, send):
+        self.scope = scope
+        max_length = self.wsgi_application.config.get('MAX_CONTENT_LENGTH')
+        length = dict(scope.get('headers', [])).get(b'content-length')
+        if max_length and length and length.isdigit() and int(length) > max_length:
+            # Refused before the body is received
+            await _send_error(send, 413, f"Request is larger than {max_length // 2 ** 20}MB")
+            return
+        try:
+            with scratch_buffers.spooled() as body:
+                while True:
+                    message = await receive()
+                    if message['type'] == 'http.disconnect':
+                        return
+                    body.write(message.get('body', b''))
+                    if not message.get('more_body'):
+                        break
+                body.seek(0)
+                self.sync_send = AsyncToSync(send)
+                # Not thread sensitive: requests run in parallel on the loop's thread pool
+                await sync_to_async(self._run, thread_sensitive=False)(body)
+        except ScratchFull as e:
+            if not getattr(self, 'response_started', False):
+                await _send_error(send, e.status, str(e))
+
+    def _run(self, body):
+        """Run the WSGI app, sending every chunk of its response as it is produced."""
+        output = self.wsgi_application(self.build_environ(self.scope, body), self.start_response)
+        try:
+            for chunk in output:
+                if not chunk:
+                    continue
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            # Tears down the request context of streamed responses
+            if hasattr(output, 'close'):
+                output.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+async def _send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'error': message}).encode()})
+
+
+app = AsgiApp(flask_app, threads=int((flask_app.config.get('offload') or {}).get('threads', 16)))
@@ -0,0 +1,194 @@
+"""
+Offline batch runner of the transform workflows over whole directories.
+
+    python -m app.batch INPUT OUTPUT [--operation process-car-image] [--background bg.jpg] [--logo logo.png]
+                                     [--logo-position top-right] [--format png] [--quality 85] [--variant web]
+                                     [--processes 4] [--prefetch 8] [--overwrite]
+
+INPUT is a directory, walked recursively for JPEG, PNG, WebP and AVIF
+photos, or a manifest: a text file of photo paths (relative to it), one
+per line, # starts a comment. Each photo is written to the same relative
+path under OUTPUT with the extension of its output format.
+
+Photos run on the offload process pool (offload.py): `processes` worker
+processes, each with one warm model session. `prefetch` more photos than
+there are processes are read and decoded into shared frames ahead of
+inference, so the workers never wait for the disk or the decoder. The logo
+and background are registered in the asset store once, every worker then
+fits them once per photo size.
+
+Interrupted runs resume where they stopped: photos whose output exists are
+skipped (outputs are written to a temporary file and renamed, so a partial
+file is never taken for a finished one), unless --overwrite is given.
+Progress and the final count report images/s; the exit status is 1 when a
+photo failed.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.image_processing.encoders import FORMATS
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".avif")
+
+# --operation -> (workflow name, asset kinds it takes)
+OPERATIONS = {
+    "remove-background": ("remove_background", ()),
+    "add-logo": ("add_logo", ("logo",)),
+    "apply-background": ("apply_background", ("background",)),
+    "process-car-image": ("process_car_image", ("logo", "background")),
+}
+
+
+def list_photos(source):
+    """
+    (absolute path, output name) of every photo of a directory or manifest, sorted.
+    The output name is the path relative to the input without its extension, or with
+    it when photos differ only by their extension (car.jpg and car.webp).
+    """
+    if os.path.isdir(source):
+        base = source
+        paths = []
+        for directory, _directories, names in os.walk(source):
+            paths += [os.path.join(directory, name) for name in names if name.lower().endswith(EXTENSIONS)]
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        paths = []
+        with open(source) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    paths.append(os.path.join(base, line))
+    relative_paths = [os.path.relpath(path, base) for path in sorted(paths)]
+    stems = [os.path.splitext(relative)[0] for relative in relative_paths]
+    return [(os.path.join(base, relative), stem if stems.count(stem) == 1 else relative)
+            for relative, stem in zip(relative_paths, stems)]
+
+
+def output_path(output_dir, name, format):
+    return os.path.join(output_dir, name + FORMATS[format][2])
+
+
+def run(photos, output_dir, operation="process-car-image", logo=None, background=None, logo_position="top-right",
+        format="png", quality=None, variant=None, processes=2, prefetch=4, overwrite=False, report_every=10.0):
+    """
+    Process every photo and write the results under output_dir.
+
+    :param photos: List of (path, output name) pairs, see list_photos()
+    :param logo: Path of the logo image, for the add-logo and process-car-image operations
+    :param background: Path of the background image, for the apply-background and process-car-image operations
+    :param processes: Worker processes, each with a warm model session
+    :param prefetch: Photos read and decoded ahead, in addition to one per process
+    :return: dict of processed, skipped and failed counts, seconds and images_per_second
+    """
+    from app.app import app
+    from app.image_processing import workflows
+    from app.image_processing.asset_store import asset_store
+    from app.image_processing.offload import ProcessOffload
+
+    workflow_name, asset_kinds = OPERATIONS[operation]
+    workflow = getattr(workflows, workflow_name)
+    assets = {"logo": logo, "background": background}
+    params = {}
+    for kind in asset_kinds:
+        if assets[kind]:
+            with open(assets[kind], "rb") as f:
+                params[f"{kind}_id"] = asset_store.register(kind, f.read())["asset_id"]
+    if operation in ("add-logo", "process-car-image"):
+        params["position" if operation == "add-logo" else "logo_position"] = logo_position
+    output = {"format": format, "quality": quality, "variant": variant, "accept": []}
+
+    pending = [(path, relative) for path, relative in photos
+               if overwrite or not os.path.exists(output_path(output_dir, relative, format))]
+    counts = {"processed": 0, "skipped": len(photos) - len(pending), "failed": 0}
+
+    offload = ProcessOffload()
+    offload.configure({**(app.config.get("offload") or {}), "enabled": True, "processes": processes,
+                       "frames": processes + prefetch})
+    offload.start()
+
+    def process(path, relative):
+        with open(path, "rb") as f:
+            data = f.read()
+        encoded = offload.run(workflow, data, output=output, **params)
+        target = output_path(output_dir, relative, format)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Renamed once complete: an interrupted run never leaves a partial output behind
+        with open(target + ".part", "wb") as f:
+            f.write(encoded.data)
+        os.replace(target + ".part", target)
+
+    started = last_report = time.perf_counter()
+    try:
+        # Threads only read files and wait, each holds one photo in flight
+        with ThreadPoolExecutor(processes + prefetch, thread_name_prefix="batch") as executor:
+            in_flight = {}
+            photos_left = iter(pending)
+            while True:
+                for path, relative in photos_left:
+                    in_flight[executor.submit(process, path, relative)] = relative
+                    if len(in_flight) >= processes + prefetch:
+                        break
+                if not in_flight:
+                    break
+                done, _not_done = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    relative = in_flight.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        counts["processed"] += 1
+                    else:
+                        counts["failed"] += 1
+                        logger.error("%s failed: %s", relative, error)
+                if time.perf_counter() - last_report >= report_every:
+                    last_report = time.perf_counter()
+                    logger.info("%d/%d photos, %.2f images/s", counts["processed"] + counts["failed"],
+                                len(pending), counts["processed"] / (last_report - started))
+    finally:
+        offload.shutdown()
+
+    seconds = time.perf_counter() - started
+    return {**counts, "seconds": round(seconds, 3),
+            "images_per_second": round(counts["processed"] / seconds, 3) if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Directory of photos, or a manifest file listing them")
+    parser.add_argument("output", help="Directory the results are written to")
+    parser.add_argument("--operation", choices=list(OPERATIONS), default="process-car-image")
+    parser.add_argument("--background", help="Background image applied to every photo")
+    parser.add_argument("--logo", help="Logo image added to every photo")
+    parser.add_argument("--logo-position", default="top-right",
+                        choices=["top-left", "top-right", "bottom-left", "bottom-right"])
+    parser.add_argument("--format", choices=list(FORMATS), default="png", help="Output format")
+    parser.add_argument("--quality", type=int, help="Quality of lossy output formats, 1-100")
+    parser.add_argument("--variant", help="Resized delivery variant (see the output.variants config)")
+    parser.add_argument("--processes", type=int,
+                        help="Worker processes, each with a warm model session; "
+                             "by default one per rembg.intra_op_threads cores, as gunicorn workers")
+    parser.add_argument("--prefetch", type=int, default=4, help="Photos read and decoded ahead of the workers")
+    parser.add_argument("--overwrite", action="store_true", help="Process photos whose output already exists")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    from app.app import app
+    from app.startup import inference_cores, inference_workers
+
+    processes = args.processes or inference_workers(
+        inference_cores(), int((app.config.get("rembg") or {}).get("intra_op_threads") or 0))
+    report = run(list_photos(args.input), args.output, args.operation, args.logo, args.background,
+                 args.logo_position, args.format, args.quality, args.variant, processes, args.prefetch,
+                 args.overwrite)
+    print(f"{report['processed']} processed, {report['skipped']} skipped, {report['failed']} failed "
+          f"in {report['seconds']:.1f}s, {report['images_per_second']:.2f} images/s")
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Synthetic image corpus shared by the micro and load benchmarks.
+
+Photos are generated from fixed seeds, so every run (and the stored
+baseline it is compared against) sees the same pixels and the same
+encoded bytes for a given Pillow version.
+"""
+from app.benchmarks.compositor_bench import synthetic_background, synthetic_cutout
+from app.benchmarks.mask_upsampling_bench import synthetic_photo
+from app.image_processing.image_io import encode_image
+
+# Name -> (width, height) of the corpus photos: a web upload, then camera sizes
+SIZES = {
+    "800x600": (800, 600),
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+    "12MP": (4000, 3000),
+}
+
+# Upload formats -> Pillow save parameters
+FORMATS = {
+    "jpeg": ("JPEG", {"quality": 90}),
+    "png": ("PNG", {"compress_level": 1}),
+    "webp": ("WEBP", {"quality": 90}),
+}
+
+# Logos are small whatever the photo size
+LOGO_SIZE = (400, 400)
+
+
+def build_corpus(sizes=None, formats=None):
+    """
+    Encoded car photos at every size and format.
+
+    :param sizes: Names of SIZES, default all
+    :param formats: Names of FORMATS, default all
+    :return: List of dicts with name ("<size>/<format>"), size, format and data (bytes)
+    """
+    corpus = []
+    for size_name in sizes or SIZES:
+        photo = synthetic_photo(SIZES[size_name])
+        for format in formats or FORMATS:
+            pil_format, params = FORMATS[format]
+            corpus.append({
+                "name": f"{size_name}/{format}",
+                "size": size_name,
+                "format": format,
+                "data": encode_image(photo, pil_format, **params),
+            })
+    return corpus
+
+
+def cutout(size_name):
+    """RGBA car cutout of a corpus size, the input of apply-background."""
+    return synthetic_cutout(SIZES[size_name])
+
+
+def background(size_name):
+    """Opaque background of a corpus size."""
+    return synthetic_background(SIZES[size_name])
+
+
+def logo():
+    """RGBA logo, a cutout at logo size."""
+    return synthetic_cutout(LOGO_SIZE, seed=2)
+
+
+def png_bytes(image):
+    return encode_image(image, "PNG", compress_level=1)
@@ -0,0 +1,72 @@
+"""
+Encode time and response size of the output formats against the previous default PNG.
+
+    python -m app.benchmarks.encoder_bench [--repeat 5] [--cutout car.png] [--background bg.jpg]
+
+Encodes a car cutout (alpha) and the same cutout on a background (opaque
+composite), each at full size and as every configured delivery variant,
+with PIL's default PNG (zlib level 6, what every route sent before) and
+with each output format of the encoder.
+"""
+import argparse
+import os
+
+from PIL import Image
+
+from app.benchmarks.compositor_bench import timed
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.encoders import output_encoder
+from app.image_processing.image_io import encode_image
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "tests", "test_data")
+VARIANTS = {"full": None, "web": 1600, "thumbnail": 400}
+
+
+def scaled(image, max_size):
+    if not max_size or max(image.size) <= max_size:
+        return image
+    scale = max_size / max(image.size)
+    return image.resize((round(image.width * scale), round(image.height * scale)), Image.Resampling.LANCZOS)
+
+
+def run(cutout, background, repeat=5):
+    """Benchmark every image and variant, returns a list of result dicts (times in ms, sizes in bytes)."""
+    composite = BackgroundApplier().apply(cutout, BackgroundApplier.fit_background(background, cutout.size))
+    results = []
+    for kind, image in (("cutout", cutout), ("composite", composite)):
+        for variant, max_size in VARIANTS.items():
+            image_variant = scaled(image, max_size)
+            baseline = encode_image(image_variant)
+            baseline_ms = timed(lambda: encode_image(image_variant), repeat)
+            for format in output_encoder.available_formats():
+                if format == "jpeg" and kind == "cutout":
+                    continue
+                results.append({
+                    "image": kind, "variant": variant, "format": format,
+                    "baseline_ms": baseline_ms, "baseline_bytes": len(baseline),
+                    "ms": timed(lambda: output_encoder.encode(image_variant, format), repeat),
+                    "bytes": len(output_encoder.encode(image_variant, format)),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the median is reported")
+    parser.add_argument("--cutout", default=os.path.join(TEST_DATA, "bg_removed_car", "car1.png"),
+                        help="RGBA car cutout")
+    parser.add_argument("--background", default=os.path.join(TEST_DATA, "background", "bg2.jpg"),
+                        help="Background the cutout is composited on")
+    args = parser.parse_args()
+
+    cutout = Image.open(args.cutout).convert("RGBA")
+    background = Image.open(args.background).convert("RGB")
+    print(f"{'image':<11}{'variant':<11}{'format':<8}{'PNG-6 ms':>10}{'ms':>8}{'PNG-6 KB':>10}{'KB':>8}")
+    for result in run(cutout, background, args.repeat):
+        print(f"{result['image']:<11}{result['variant']:<11}{result['format']:<8}"
+              f"{result['baseline_ms']:>10.1f}{result['ms']:>8.1f}"
+              f"{result['baseline_bytes'] / 1024:>10.0f}{result['bytes'] / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Import time of a module and everything it pulls in, measured with python -X importtime.
+
+    python -m app.benchmarks.import_bench [--module app.app] [--top 15]
+
+Runs the import in a fresh interpreter and prints its total time and the
+slowest top-level packages. The test suite uses import_times() to check
+that importing the app does not load the ML stack.
+"""
+import argparse
+import subprocess
+import sys
+
+# Packages that belong behind the backends registry, not on the import path of the app
+HEAVY_PACKAGES = ("rembg", "onnxruntime", "scipy", "skimage", "numba", "pymatting", "cv2")
+
+
+def import_times(module="app.app"):
+    """
+    Import `module` in a fresh interpreter.
+
+    :return: dict of imported module name -> cumulative import time in seconds
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def heavy_imports(times):
+    """Modules of HEAVY_PACKAGES in an import_times() result."""
+    return sorted(name for name in times if name.split(".")[0] in HEAVY_PACKAGES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.app", help="Module to import")
+    parser.add_argument("--top", type=int, default=15, help="Number of top-level packages to list")
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    # Top-level packages only: their cumulative time includes their submodules
+    packages = {name: seconds for name, seconds in times.items() if "." not in name}
+    print(f"import {args.module}: {times[args.module] * 1000:.0f}ms, {len(times)} modules")
+    for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<30}{seconds * 1000:>8.0f}ms")
+    heavy = heavy_imports(times)
+    if heavy:
+        print(f"ML stack imported: {len(heavy)} modules, e.g. {', '.join(heavy[:5])}")
+
+
+if __name__ == "__main__":
+    main()
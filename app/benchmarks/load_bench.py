@@ -0,0 +1,211 @@
+"""
+HTTP load generator for the image-processing routes, against gunicorn started locally.
+
+    python -m app.benchmarks.load_bench [--routes add-logo apply-background] [--sizes 1080p]
+                                        [--concurrency 1 4 16] [--requests 50] [--workers 2]
+                                        [--url http://host:port] [--output load.json]
+                                        [--baseline baseline.json] [--tolerance 0.15]
+
+Starts gunicorn with gunicorn_config.py on a free local port (unless --url
+points to a running server), then sends `requests` uploads of the
+synthetic corpus to every route at every concurrency level. For each it
+reports p50/p90/p99 latency, successful requests per second, errors and
+the RSS of the gunicorn process tree, and writes them as JSON. Every
+upload carries a request counter after the image data, so the mask cache
+does not turn inference routes into cache lookups (--repeat-uploads
+sends identical bytes instead). With --baseline, the run exits with
+status 1 on regressions.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.benchmarks import corpus, results
+from app.benchmarks.micro_bench import PAGE_MB
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+URL_PREFIX = "/api/v1"
+
+
+def route_uploads(size, format="jpeg"):
+    """Route -> multipart fields (name -> (filename, bytes)) for photos of `size`."""
+    photo = corpus.build_corpus([size], [format])[0]["data"]
+    cutout = corpus.png_bytes(corpus.cutout(size))
+    background = corpus.build_corpus([size], ["jpeg"])[0]["data"]
+    logo = corpus.png_bytes(corpus.logo())
+    photo_name = f"car.{format}"
+    return {
+        "remove-background": {"image": (photo_name, photo)},
+        "add-logo": {"image": (photo_name, photo), "logo": ("logo.png", logo)},
+        "apply-background": {"image": ("car.png", cutout), "background": ("background.jpg", background)},
+        "process-car-image": {"car_image": (photo_name, photo), "logo": ("logo.png", logo),
+                              "background": ("background.jpg", background)},
+    }
+
+
+ROUTES = ("remove-background", "add-logo", "apply-background", "process-car-image")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers=None, timeout=120):
+    """Start gunicorn on a free port and wait until it answers, returns (process, base url)."""
+    port = free_port()
+    env = dict(os.environ)
+    if workers:
+        env["WEB_CONCURRENCY"] = str(workers)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_config.py", "--bind", f"127.0.0.1:{port}",
+         "app.app:app"], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            if requests.get(f"{url}{URL_PREFIX}/test", timeout=5).ok:
+                return process, url
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"gunicorn did not answer within {timeout}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def tree_rss_mb(pid):
+    """RSS of a process and all its descendants in MB (Linux only, None elsewhere)."""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * PAGE_MB
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        return None if not total else round(total, 1)
+    return round(total, 1)
+
+
+def load(url, route, fields, concurrency, total_requests, unique=True):
+    """
+    Send `total_requests` uploads to `route` from `concurrency` threads.
+
+    :param fields: Multipart fields, name -> (filename, bytes)
+    :param unique: Append a request counter after every file's image data
+    :return: dict with latency percentiles, throughput, errors and status code counts
+    """
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+    local = threading.local()
+    seconds, statuses = [], {}
+
+    def send(n):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        files = {name: (filename, data + (f"\n#{n}".encode() if unique else b""))
+                 for name, (filename, data) in fields.items()}
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{url}{URL_PREFIX}/{route}", files=files, timeout=300)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            seconds.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def client():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            send(n)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    wall = time.perf_counter() - started
+    succeeded = statuses.get("200", 0)
+    return results.summarize(seconds, throughput_per_s=round(succeeded / wall, 3),
+                             errors=total_requests - succeeded, statuses=statuses)
+
+
+def run(url, routes=ROUTES, sizes=("1080p",), format="jpeg", concurrency=(1, 4, 16), total_requests=50,
+        unique=True, server_pid=None):
+    """Load every route at every size and concurrency level, returns a list of result dicts."""
+    report = []
+    for size in sizes:
+        uploads = route_uploads(size, format)
+        for route in routes:
+            for level in concurrency:
+                result = load(url, route, uploads[route], level, total_requests, unique)
+                result["id"] = f"http/{route}/{size}/c{level}"
+                result["server_rss_mb"] = tree_rss_mb(server_pid) if server_pid else None
+                report.append(result)
+    return report
+
+
+def print_results(report):
+    print(f"{'case':<42}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>8}{'errors':>8}{'RSS MB':>9}")
+    for result in report:
+        rss = result.get("server_rss_mb")
+        print(f"{result['id']:<42}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+              f"{result['throughput_per_s']:>8.1f}{result['errors']:>8}{'' if rss is None else rss:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server, default: start gunicorn locally")
+    parser.add_argument("--workers", type=int, help="gunicorn workers (WEB_CONCURRENCY), default from the config")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--sizes", nargs="+", choices=list(corpus.SIZES), default=["1080p"])
+    parser.add_argument("--format", choices=list(corpus.FORMATS), default="jpeg", help="Upload format of photos")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16], help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per route, size and concurrency")
+    parser.add_argument("--repeat-uploads", action="store_true", help="Send identical bytes (mask cache hits)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    process, url = (None, args.url) if args.url else start_server(args.workers)
+    try:
+        report = run(url, args.routes, args.sizes, args.format, args.concurrency, args.requests,
+                     not args.repeat_uploads, process.pid if process else None)
+    finally:
+        if process:
+            stop_server(process)
+    print_results(report)
+    if args.output:
+        results.write(args.output, "load", report)
+    if args.baseline:
+        raise SystemExit(results.report(results.compare(report, results.load(args.baseline), args.tolerance)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Mask quality and speed of inference variants against the fp32 model.
+
+    python -m app.benchmarks.mask_quality [--candidate precision=int8] [--candidate model=u2netp]
+                                          [--candidate providers=OpenVINOExecutionProvider]
+                                          [--images dir] [--min-iou 0.95] [--output quality.json]
+
+Builds a session of the configured `rembg` model (config/app-base.yml) in
+fp32 as the baseline, and one per candidate: the same settings with the
+given keys overridden (precision, model, graph_optimization, providers,
+optimized_model_dir). Every photo of the test corpus (app/tests/test_data/car,
+or --images) goes through each, and the candidate masks are compared with
+the baseline ones: IoU of the masks thresholded at 50% and mean absolute
+difference in 0-255 levels, next to the inference time. Exits with status
+1 when a candidate's worst IoU is below --min-iou, so a quantized model
+is not deployed on speed alone.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import yaml
+from PIL import Image, ImageOps
+
+from app.benchmarks import results
+from app.image_processing.session_pool import SessionPool
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+TEST_CORPUS = os.path.join(ROOT, "app", "tests", "test_data", "car")
+
+
+def mask_iou(mask, reference, threshold=128):
+    """Intersection over union of two "L" masks (or uint8 arrays) thresholded at `threshold`."""
+    a = np.asarray(mask) >= threshold
+    b = np.asarray(reference) >= threshold
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def mean_abs_difference(mask, reference):
+    return float(np.abs(np.asarray(mask, dtype=np.int16) - np.asarray(reference, dtype=np.int16)).mean())
+
+
+def load_photos(directory=TEST_CORPUS):
+    photos = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with Image.open(os.path.join(directory, name)) as image:
+                photos[name] = ImageOps.exif_transpose(image).convert("RGB")
+    return photos
+
+
+def masks_of(settings, photos):
+    """Masks of every photo predicted by a session built from `settings`, and the inference times."""
+    pool = SessionPool()
+    pool.configure(settings)
+    session = pool.get_session()
+    masks, seconds = {}, []
+    for name, photo in photos.items():
+        started = time.perf_counter()
+        masks[name] = session.predict(photo)[0]
+        seconds.append(time.perf_counter() - started)
+    return masks, seconds
+
+
+def run(base_settings, candidates, photos):
+    """
+    Compare every candidate with the fp32 baseline.
+
+    :param base_settings: The `rembg` config section
+    :param candidates: List of dicts of settings overriding base_settings
+    :return: List of result dicts, the baseline first
+    """
+    baseline_settings = {**base_settings, "precision": "fp32"}
+    baseline, seconds = masks_of(baseline_settings, photos)
+    report = [results.summarize(seconds, id="fp32", settings=baseline_settings, min_iou=1.0)]
+    for overrides in candidates:
+        settings = {**base_settings, **overrides}
+        masks, seconds = masks_of(settings, photos)
+        ious = {name: round(mask_iou(masks[name], baseline[name]), 4) for name in photos}
+        report.append(results.summarize(
+            seconds, id=",".join(f"{key}={value}" for key, value in overrides.items()), settings=settings,
+            min_iou=min(ious.values()), ious=ious,
+            mean_abs_difference=round(np.mean([mean_abs_difference(masks[name], baseline[name])
+                                               for name in photos]), 3)))
+    return report
+
+
+def parse_candidate(text):
+    """"precision=int8,model=u2netp" -> settings dict; providers take a list separated by '+'."""
+    overrides = {}
+    for item in text.split(","):
+        key, _, value = item.partition("=")
+        overrides[key.strip()] = value.split("+") if key.strip() == "providers" else value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidate", action="append", type=parse_candidate,
+                        help="Settings overriding the configured ones, e.g. precision=int8 (repeatable)")
+    parser.add_argument("--images", default=TEST_CORPUS, help="Directory of photos")
+    parser.add_argument("--min-iou", type=float, default=0.95, help="Lowest acceptable IoU with the fp32 masks")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "config", "app-base.yml")) as f:
+        base_settings = yaml.safe_load(f).get("rembg") or {}
+    candidates = args.candidate or [{"precision": "int8"}, {"model": "u2netp"}]
+    report = run(base_settings, candidates, load_photos(args.images))
+
+    print(f"{'variant':<40}{'p50 ms':>10}{'speedup':>9}{'min IoU':>9}{'MAD':>7}")
+    for result in report:
+        print(f"{result['id']:<40}{result['p50_ms']:>10.1f}{report[0]['p50_ms'] / result['p50_ms']:>9.2f}"
+              f"{result['min_iou']:>9.4f}{result.get('mean_abs_difference', 0):>7.2f}")
+    if args.output:
+        results.write(args.output, "mask_quality", report)
+    failed = [result["id"] for result in report if result["min_iou"] < args.min_iou]
+    for variant in failed:
+        print(f"FAILED {variant}: IoU below {args.min_iou}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
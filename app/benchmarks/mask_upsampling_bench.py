@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the mask_upsampler modes on large synthetic photos.
+
+    python -m app.benchmarks.mask_upsampling_bench [--repeat 3]
+
+u2net sees a 320x320 input in every mode, so inference itself costs the
+same; what differs is the resampling around it. For each mode this times
+the path from the photo to the full size mask with a stand-in for the
+model (the 320x320 model input resized back, as rembg does with the
+prediction) and the growth of the peak RSS, measured in a fresh process (Linux only).
+"""
+import argparse
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.benchmarks.compositor_bench import SIZES
+from app.image_processing.mask_upsampler import MODES, MaskUpsampler
+
+MODEL_SIZE = (320, 320)
+
+
+def synthetic_photo(size, seed=0):
+    """A noisy photo with an elliptic 'car' that differs from the background in colour only."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[:height, :width]
+    inside = ((x - width / 2) / (width * 0.4)) ** 2 + ((y - height * 0.6) / (height * 0.3)) ** 2 < 1
+    pixels = np.where(inside[..., None], np.float32([200, 30, 30]), np.float32([20, 120, 220]))
+    pixels = pixels + rng.normal(0, 6, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def fake_predict(image):
+    """What rembg's predict does around the model: resize to 320x320 and the mask back to the input size."""
+    model_input = image.convert("RGB").resize(MODEL_SIZE, Image.Resampling.LANCZOS)
+    return model_input.convert("L").resize(image.size, Image.Resampling.LANCZOS)
+
+
+def mask_for(upsampler, photo):
+    proxy = upsampler.proxy(photo)
+    return upsampler.upsample(fake_predict(proxy), proxy, photo)
+
+
+def peak_rss_growth_mb(mode, photo):
+    """Run one mode in this (fresh) process and return how far the peak RSS rose above the current RSS."""
+    upsampler = MaskUpsampler(mode=mode)
+    with open("/proc/self/statm") as f:
+        before = int(f.read().split()[1]) * resource.getpagesize()
+    mask_for(upsampler, photo)
+    # ru_maxrss is in KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - before) / 2 ** 20
+
+
+def run(repeat=3):
+    """Benchmark every mode and size, returns a list of result dicts."""
+    results = []
+    for name, size in SIZES.items():
+        photo = synthetic_photo(size)
+        for mode in MODES:
+            upsampler = MaskUpsampler(mode=mode)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                mask_for(upsampler, photo)
+                timings.append(time.perf_counter() - start)
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                peak_mb = pool.submit(peak_rss_growth_mb, mode, photo).result()
+            results.append({"mode": mode, "size": name,
+                            "ms": statistics.median(timings) * 1000,
+                            "peak_rss_mb": peak_mb})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the median is reported")
+    args = parser.parse_args()
+
+    print(f"{'size':<7}{'mode':<8}{'ms':>9}{'+RSS MB':>10}")
+    for result in run(args.repeat):
+        print(f"{result['size']:<7}{result['mode']:<8}{result['ms']:>9.1f}{result['peak_rss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
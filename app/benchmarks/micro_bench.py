@@ -0,0 +1,146 @@
+"""
+In-process micro-benchmarks of each image_processing class on the synthetic corpus.
+
+    python -m app.benchmarks.micro_bench [--sizes 1080p 4K] [--formats jpeg png] [--cases add_logo encode]
+                                         [--repeat 10] [--output micro.json]
+                                         [--baseline baseline.json] [--tolerance 0.15]
+
+Times decode_image for every corpus photo, BackgroundRemover.remove,
+BackgroundApplier.apply and LogoAdder.add for every size and
+OutputEncoder.encode of the composite in every output format. Each case
+runs once to warm up, then `repeat` times; its p50/p99 latency, single
+thread throughput and peak RSS growth (Linux only) are printed and
+written as JSON. With --baseline, the run exits with status 1 when a
+case got slower than the baseline by more than the tolerance.
+Background removal is reported as skipped when the model is not
+available.
+"""
+import argparse
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app.benchmarks import corpus, results
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.encoders import output_encoder
+from app.image_processing.image_io import decode_image
+from app.image_processing.logo_adder import LogoAdder
+
+CASES = ("decode", "remove_background", "apply_background", "add_logo", "encode")
+PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 2 ** 20 if hasattr(os, "sysconf") else 0
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_MB
+    except OSError:
+        return None
+
+
+@contextmanager
+def peak_rss_growth(interval=0.002):
+    """Sample the RSS while the block runs; yields a dict whose "mb" is set to the peak growth afterwards."""
+    growth = {"mb": None}
+    start = _rss_mb()
+    if start is None:
+        yield growth
+        return
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], _rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield growth
+    finally:
+        done.set()
+        sampler.join()
+        growth["mb"] = round(max(peak[0], _rss_mb()) - start, 1)
+
+
+def measure(case_id, function, repeat):
+    """Warm up, then time `repeat` calls of `function`; a failing warm-up marks the case skipped."""
+    try:
+        function()
+    except Exception as e:
+        return {"id": case_id, "skipped": f"{type(e).__name__}: {e}"}
+    seconds = []
+    with peak_rss_growth() as growth:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - started)
+    summary = results.summarize(seconds, id=case_id)
+    summary["throughput_per_s"] = round(1000 / summary["mean_ms"], 3) if summary["mean_ms"] else None
+    summary["peak_rss_growth_mb"] = growth["mb"]
+    return summary
+
+
+def run(sizes=None, formats=None, repeat=10, cases=CASES):
+    """Benchmark `cases` on the corpus, returns a list of result dicts."""
+    sizes = list(sizes or corpus.SIZES)
+    report = []
+    if "decode" in cases:
+        for photo in corpus.build_corpus(sizes, formats):
+            report.append(measure(f"decode/{photo['name']}", lambda: decode_image(photo["data"]), repeat))
+
+    logo = corpus.logo()
+    for size in sizes:
+        photo = decode_image(corpus.build_corpus([size], ["png"])[0]["data"])
+        cutout = corpus.cutout(size)
+        background = corpus.background(size)
+        if "remove_background" in cases:
+            report.append(measure(f"remove_background/{size}",
+                                  lambda: BackgroundRemover().remove(photo), repeat))
+        if "apply_background" in cases:
+            report.append(measure(f"apply_background/{size}",
+                                  lambda: BackgroundApplier().apply(cutout, background), repeat))
+        if "add_logo" in cases:
+            report.append(measure(f"add_logo/{size}", lambda: LogoAdder().add(photo, logo), repeat))
+        if "encode" in cases:
+            composite = BackgroundApplier().apply(cutout, background)
+            for format in output_encoder.available_formats():
+                report.append(measure(f"encode/{size}/{format}",
+                                      lambda: output_encoder.encode(composite, format), repeat))
+    return report
+
+
+def print_results(report):
+    print(f"{'case':<32}{'p50 ms':>10}{'p99 ms':>10}{'per s':>9}{'RSS +MB':>9}")
+    for result in report:
+        if "skipped" in result:
+            print(f"{result['id']:<32}skipped: {result['skipped']}")
+            continue
+        growth = result.get("peak_rss_growth_mb")
+        print(f"{result['id']:<32}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+              f"{result['throughput_per_s'] or 0:>9.1f}{'' if growth is None else growth:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=list(corpus.SIZES), help="Corpus sizes, default all")
+    parser.add_argument("--formats", nargs="+", choices=list(corpus.FORMATS), help="Upload formats, default all")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES), help="Cases to run")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per case")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.formats, args.repeat, args.cases)
+    print_results(report)
+    if args.output:
+        results.write(args.output, "micro", report)
+    if args.baseline:
+        raise SystemExit(results.report(results.compare(report, results.load(args.baseline), args.tolerance)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+JSON results of the benchmark suite and their comparison with a stored baseline.
+
+A result file holds the environment it was measured in and a list of
+results, each identified by an `id` (e.g. "apply_background/4K") and
+carrying latency percentiles in ms and optionally a throughput:
+
+    {"benchmark": "micro", "environment": {...}, "results": [{"id": ..., "p50_ms": ..., ...}]}
+
+compare() reports every metric that got worse than the baseline by more
+than the tolerance; the benchmark CLIs exit with status 1 when there is
+one, so a deploy script can stop on it.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+
+# Metric -> True when higher is better
+METRICS = {
+    "p50_ms": False,
+    "p99_ms": False,
+    "throughput_per_s": True,
+}
+
+
+def percentile(values, q):
+    """The q-th percentile (0-100) of `values`, nearest-rank."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(seconds, **fields):
+    """A result dict of latency percentiles (in ms) of a list of durations in seconds."""
+    milliseconds = [s * 1000 for s in seconds]
+    summary = {
+        "n": len(milliseconds),
+        "p50_ms": round(percentile(milliseconds, 50), 3),
+        "p90_ms": round(percentile(milliseconds, 90), 3),
+        "p99_ms": round(percentile(milliseconds, 99), 3),
+        "mean_ms": round(sum(milliseconds) / len(milliseconds), 3),
+    }
+    summary.update(fields)
+    return summary
+
+
+def environment():
+    """Where the results were measured, so baselines from another machine can be told apart."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write(path, benchmark, results):
+    with open(path, "w") as f:
+        json.dump({"benchmark": benchmark, "environment": environment(), "results": results}, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.15):
+    """
+    Metrics of `results` worse than in `baseline` by more than `tolerance`.
+
+    :param results: List of result dicts
+    :param baseline: List of result dicts, or a loaded result file
+    :param tolerance: Allowed relative change, 0.15 = 15%
+    :return: List of dicts with id, metric, baseline, value and change (relative, positive is worse)
+    """
+    if isinstance(baseline, dict):
+        baseline = baseline["results"]
+    baseline = {result["id"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["id"])
+        if previous is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            value, before = result.get(metric), previous.get(metric)
+            if value is None or not before:
+                continue
+            change = (before - value) / before if higher_is_better else (value - before) / before
+            if change > tolerance:
+                regressions.append({"id": result["id"], "metric": metric, "baseline": before,
+                                    "value": value, "change": round(change, 3)})
+    return regressions
+
+
+def report(regressions):
+    """Print regressions, returns the exit status of a benchmark CLI."""
+    for regression in regressions:
+        print(f"REGRESSION {regression['id']} {regression['metric']}: {regression['baseline']} -> "
+              f"{regression['value']} ({regression['change']:+.0%})")
+    return 1 if regressions else 0
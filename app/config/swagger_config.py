@@ -3,8 +3,12 @@ from flask_restx import Api
 from flask_restx import apidoc
 
 
+from app.image_processing.ingestion import UploadRejected
 from app.routes.transform_image import api as upload_api
 from app.routes.server_online import api as test_api
+from app.routes.jobs import api as jobs_api
+from app.routes.customer_provisioning import api as assets_api
+from app.routes.admin import api as admin_api
 
 URL_PREFIX = '/api/v1'
 
@@ -22,9 +26,17 @@ def create_api(app):
               version='1.0',
               description='API for pixel-showroom')  # Swagger UI URL
 
+    @api.errorhandler(UploadRejected)
+    def handle_upload_rejected(error):
+        """Uploads refused by the ingestion checks (format, file size, pixel count)"""
+        return {"error": str(error)}, error.status
+
     # Register namespaces
     api.add_namespace(upload_api)
     api.add_namespace(test_api)
+    api.add_namespace(jobs_api)
+    api.add_namespace(assets_api)
+    api.add_namespace(admin_api)
 
     # Register the blueprint with the Flask app
     app.register_blueprint(blueprint)
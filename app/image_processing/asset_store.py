@@ -0,0 +1,230 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+
+from PIL import Image
+
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.image_io import decode_image
+from app.image_processing.logo_adder import LogoAdder
+from app.image_processing.lru_cache import LRUCache
+from app.image_processing.mask_cache import MB, digest_bytes
+
+# Asset kind -> function fitting the decoded asset to a target image size
+ASSET_KINDS = {
+    "logo": LogoAdder.fit_logo,
+    "background": BackgroundApplier.fit_background,
+}
+
+
+class AssetNotFound(KeyError):
+    """Raised when a logo or background id is not registered."""
+
+    def __init__(self, asset_id):
+        super().__init__(asset_id)
+        self.asset_id = asset_id
+
+    def __str__(self):
+        return f"Unknown asset '{self.asset_id}'"
+
+
+class AssetForbidden(Exception):
+    """Raised when an asset is deleted without the API key of the customer who registered it."""
+
+    def __init__(self, asset_id):
+        super().__init__(asset_id)
+        self.asset_id = asset_id
+
+    def __str__(self):
+        return f"Asset '{self.asset_id}' is registered by another customer"
+
+
+class AssetStore:
+    """
+    Registered logos and backgrounds, referenced by id instead of being uploaded with every request.
+
+    Registered assets are decoded once and saved as RGBA PNGs in `directory`,
+    which every gunicorn worker on the host shares. Each worker keeps the
+    decoded originals and their fitted variants (logo thumbnail or resized
+    background per target image size) in a byte-bounded LRU, so repeat
+    customers skip both the upload and most of the LANCZOS resampling.
+    Cached entries are keyed by the modification time of the stored PNG,
+    checked on every lookup, so an asset deleted (or registered again)
+    through one worker is no longer served from the memory of the others.
+    Assets registered through the API are owned by the customer's API key
+    (`key_header`): their ids are derived from the uploaded bytes and the
+    key, so registering the same file twice returns the same id, the same
+    file registered by two customers gets two ids, and only the owner's key
+    deletes an asset. Assets registered without a key (the batch CLI) are
+    owned by no one and cannot be deleted through the API.
+    """
+
+    def __init__(self, directory=None, memory_max_mb=256):
+        self.directory = None
+        self.cache = None
+        self.configure({"directory": directory, "memory_max_mb": memory_max_mb})
+
+    def configure(self, settings=None):
+        """
+        Apply the `assets` section of the app config.
+
+        :param settings: dict with optional keys directory, memory_max_mb and key_header
+        """
+        settings = settings or {}
+        self.key_header = settings.get("key_header", "X-API-Key")
+        self.directory = os.path.expanduser(
+            settings.get("directory") or "~/.pixel-showroom/assets")
+        self.cache = LRUCache(int(float(settings.get("memory_max_mb", 256)) * MB))
+
+    def register(self, kind, data, api_key=None):
+        """
+        Decode and store an uploaded logo or background.
+
+        :param kind: 'logo' or 'background'
+        :param data: Uploaded image bytes
+        :param api_key: API key of the customer owning the asset, None for an asset owned by no one
+        :return: Asset metadata dict including its `asset_id`
+        :raises PIL.UnidentifiedImageError: When `data` is not an image
+        """
+        if kind not in ASSET_KINDS:
+            raise ValueError(f"Unknown asset kind '{kind}', choose one of {sorted(ASSET_KINDS)}")
+        digest = digest_bytes(data)
+        owner = _owner(api_key)
+        if owner is not None:
+            digest = hashlib.sha256(f"{owner}:{digest}".encode()).hexdigest()
+        asset_id = f"{kind}-{digest[:32]}"
+        image = decode_image(data).convert("RGBA")
+        metadata = {"asset_id": asset_id, "kind": kind, "width": image.width, "height": image.height}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_atomic(self._path(asset_id, ".png"),
+                           lambda f: image.save(f, format="PNG", compress_level=1))
+        self._write_atomic(self._path(asset_id, ".json"),
+                           lambda f: f.write(json.dumps({**metadata, "owner": owner}).encode()))
+        self.cache.put((asset_id, self._generation(asset_id), None), image, _image_bytes(image))
+        return metadata
+
+    def info(self, asset_id):
+        """Metadata of a registered asset."""
+        metadata = self._metadata(asset_id)
+        metadata.pop("owner", None)
+        return metadata
+
+    def delete(self, asset_id, api_key):
+        """
+        Remove a registered asset from disk and from this worker's cache.
+
+        :param api_key: API key of the customer who registered the asset
+        :raises AssetForbidden: When the asset is owned by another key, or by no one
+        """
+        owner = self._metadata(asset_id).get("owner")
+        if owner is None or _owner(api_key) is None or not hmac.compare_digest(owner, _owner(api_key)):
+            raise AssetForbidden(asset_id)
+        for extension in (".png", ".json"):
+            try:
+                os.remove(self._path(asset_id, extension))
+            except FileNotFoundError:
+                pass
+        # Other workers find the file gone on their next lookup, see _generation()
+        self._discard(asset_id)
+
+    def _metadata(self, asset_id):
+        try:
+            with open(self._path(asset_id, ".json"), "rb") as f:
+                return json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            raise AssetNotFound(asset_id)
+
+    def get(self, asset_id):
+        """The decoded RGBA original of a registered asset. Do not modify it."""
+        return self._get(asset_id, self._generation(asset_id))
+
+    def _get(self, asset_id, generation):
+        key = (asset_id, generation, None)
+        image = self.cache.get(key)
+        if image is None:
+            try:
+                with Image.open(self._path(asset_id, ".png")) as stored:
+                    image = stored.convert("RGBA")
+            except (FileNotFoundError, ValueError):
+                raise AssetNotFound(asset_id)
+            self.cache.put(key, image, _image_bytes(image))
+        return image
+
+    def fitted(self, asset_id, size):
+        """
+        The asset fitted to an image of `size` (logo thumbnail or resized background),
+        cached per size. Do not modify it.
+        """
+        # Ids are prefixed with their kind, see register()
+        fit = ASSET_KINDS.get(asset_id.split("-", 1)[0])
+        if fit is None:
+            raise AssetNotFound(asset_id)
+        generation = self._generation(asset_id)
+        key = (asset_id, generation, tuple(size))
+        variant = self.cache.get(key)
+        if variant is None:
+            variant = fit(self._get(asset_id, generation), tuple(size))
+            self.cache.put(key, variant, _image_bytes(variant))
+        return variant
+
+    def source(self, asset_id):
+        """
+        A registered background in the mode it is fitted in (BackgroundApplier.background_source),
+        not resized, for fitting band by band. Do not modify it.
+        """
+        generation = self._generation(asset_id)
+        key = (asset_id, generation, "source")
+        source = self.cache.get(key)
+        if source is None:
+            source = BackgroundApplier.background_source(self._get(asset_id, generation))
+            self.cache.put(key, source, _image_bytes(source))
+        return source
+
+    def stats(self):
+        """Cache counters, suitable for JSON responses."""
+        return self.cache.stats()
+
+    def _generation(self, asset_id):
+        """Modification time of the stored asset, part of every cache key of it."""
+        try:
+            return os.stat(self._path(asset_id, ".png")).st_mtime_ns
+        except FileNotFoundError:
+            # Deleted, possibly through another worker
+            self._discard(asset_id)
+            raise AssetNotFound(asset_id)
+
+    def _discard(self, asset_id):
+        self.cache.discard_where(lambda key: key[0] == asset_id)
+
+    def _path(self, asset_id, extension):
+        # Ids come from URLs, never let them escape the asset directory
+        if os.path.basename(asset_id) != asset_id or asset_id.startswith("."):
+            raise AssetNotFound(asset_id)
+        return os.path.join(self.directory, f"{asset_id}{extension}")
+
+    def _write_atomic(self, path, write):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def _owner(api_key):
+    """The owner recorded for an API key: its hash, the key itself is never stored."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:32] if api_key else None
+
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+# One store per process; registered assets live in the shared directory
+asset_store = AssetStore()
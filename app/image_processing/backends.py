@@ -0,0 +1,68 @@
+import importlib
+import os
+import threading
+import time
+
+# PyMatting (imported by rembg) compiles numba functions at import time. With numba's
+# default OpenMP/TBB threading layer, a first import on a request thread leaves a pool
+# that never lets the interpreter exit; the workqueue layer has no such pool
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
+# Backend name -> module it is imported from. Importing rembg pulls in onnxruntime,
+# scipy, scikit-image, numba and PyMatting, over a second before the first request
+BACKENDS = {
+    "onnxruntime": "onnxruntime",
+    "rembg.sessions": "rembg.sessions",
+    "rembg.bg": "rembg.bg",
+}
+
+# Backends of optional features, imported by the feature that needs them and not preloaded
+OPTIONAL_BACKENDS = {
+    # int8 quantization of the model (precision: int8), needs the onnx package
+    "onnxruntime.quantization": "onnxruntime.quantization",
+    # Outline polygons of masks (result=polygon), opencv comes with rembg
+    "cv2": "cv2",
+}
+
+
+class BackendRegistry:
+    """
+    Registry of the heavy image-processing backends, each imported on first use.
+
+    Importing the app only registers names, so the health check, Swagger,
+    CLI tools and unit tests do not wait for the ML stack. The gunicorn
+    master still imports it before forking, when it preloads the model.
+    """
+
+    def __init__(self, backends=None):
+        self._lock = threading.Lock()
+        self._modules = dict(backends or {**BACKENDS, **OPTIONAL_BACKENDS})
+        self._loaded = {}
+        self._import_seconds = {}
+
+    def register(self, name, module):
+        """Register a backend by the name of the module that implements it."""
+        self._modules[name] = module
+
+    def get(self, name):
+        """The backend module, imported on the first call."""
+        module = self._loaded.get(name)
+        if module is None:
+            with self._lock:
+                module = self._loaded.get(name)
+                if module is None:
+                    if name not in self._modules:
+                        raise KeyError(f"Unknown backend '{name}', choose one of {sorted(self._modules)}")
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._modules[name])
+                    self._import_seconds[name] = round(time.perf_counter() - started, 3)
+                    self._loaded[name] = module
+        return module
+
+    def status(self):
+        """Import time in seconds of every registered backend, None if not imported yet."""
+        return {name: self._import_seconds.get(name) for name in self._modules}
+
+
+# One registry per process; a backend imported by the gunicorn master is inherited by its workers
+backends = BackendRegistry()
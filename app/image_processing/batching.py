@@ -0,0 +1,200 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.session_pool import session_pool
+
+logger = logging.getLogger(__name__)
+
+# rembg session name -> (mean, std, model input size), as used by each rembg session's predict()
+MODEL_INPUTS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+class _InferenceRequest:
+    """One image waiting for its mask."""
+
+    def __init__(self, image):
+        self.image = image
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.mask = None
+        self.error = None
+
+
+class BatchingInferenceEngine:
+    """
+    Collects mask requests from concurrent request threads and runs them as one
+    batched onnxruntime call.
+
+    A single dispatcher thread per process waits up to `max_wait_ms` after the
+    first queued image (or until `max_batch_size` images are queued), resizes
+    every image to the model input size, runs the session once on the stacked
+    tensor and hands each mask back to its waiting thread.
+    Models exported with a fixed batch dimension of 1 are run image by image
+    inside the same dispatch, so they still avoid thread contention.
+    """
+
+    def __init__(self, session_provider=None, enabled=False, max_batch_size=8, max_wait_ms=10):
+        self._session_provider = session_provider or session_pool.get_session
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.enabled = enabled
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.reset_stats()
+
+    def configure(self, settings=None):
+        """
+        Apply the `batching` section of the app config.
+
+        :param settings: dict with optional keys enabled, max_batch_size and max_wait_ms
+        """
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled", self.enabled))
+        self.max_batch_size = max(1, int(settings.get("max_batch_size", self.max_batch_size)))
+        self.max_wait_ms = max(0.0, float(settings.get("max_wait_ms", self.max_wait_ms)))
+
+    def predict_mask(self, image):
+        """
+        Block until the mask for `image` has been computed by a batched run.
+
+        :param image: PIL Image
+        :return: 8-bit ("L") mask of the same size as `image`
+        """
+        request = _InferenceRequest(image)
+        self._ensure_started()
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.mask
+
+    def stats(self):
+        """Batch fill rate and queue wait counters, suitable for JSON responses."""
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats["batches"]
+        images = stats["images"]
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait_ms
+        stats["avg_batch_size"] = round(images / batches, 3) if batches else 0
+        stats["fill_rate"] = round(
+            images / (batches * self.max_batch_size), 3) if batches else 0
+        stats["avg_queue_wait_ms"] = round(
+            stats["queue_wait_ms_total"] / images, 3) if images else 0
+        return stats
+
+    def queue_depth(self):
+        """Images waiting for a batch to be dispatched."""
+        return self._queue.qsize()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {
+                "batches": 0,
+                "images": 0,
+                "queue_wait_ms_total": 0.0,
+                "queue_wait_ms_max": 0.0,
+            }
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so a preloaded gunicorn master's
+        # dispatcher is restarted in each worker on first use
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._dispatch_loop, name="rembg-batcher", daemon=True)
+                self._thread.start()
+
+    def _dispatch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0].enqueued_at + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        waits = [(started - request.enqueued_at) * 1000 for request in batch]
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["images"] += len(batch)
+            self._stats["queue_wait_ms_total"] += sum(waits)
+            self._stats["queue_wait_ms_max"] = max(
+                self._stats["queue_wait_ms_max"], *waits)
+
+        try:
+            masks = self._infer([request.image for request in batch])
+            for request, mask in zip(batch, masks):
+                request.mask = mask
+        except Exception as e:
+            logger.error("Batched inference of %s images failed: %s", len(batch), e)
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def _infer(self, images):
+        session = self._session_provider()
+        mean, std, size = MODEL_INPUTS[session.model_name]
+        inner_session = session.inner_session
+        model_input = inner_session.get_inputs()[0]
+        tensors = np.stack([_normalize(image, mean, std, size) for image in images])
+
+        if isinstance(model_input.shape[0], int) and model_input.shape[0] == 1:
+            # Fixed batch dimension: one run per image
+            predictions = np.concatenate([
+                inner_session.run(None, {model_input.name: tensor[np.newaxis]})[0]
+                for tensor in tensors
+            ])
+        else:
+            predictions = inner_session.run(None, {model_input.name: tensors})[0]
+
+        return [_to_mask(prediction[0], image.size)
+                for prediction, image in zip(predictions, images)]
+
+
+def _normalize(image, mean, std, size):
+    """Same preprocessing as rembg's BaseSession.normalize, as a float32 CHW tensor."""
+    im = np.asarray(image.convert("RGB").resize(
+        size, Image.Resampling.LANCZOS), dtype=np.float32)
+    im = im / max(float(np.max(im)), 1e-6)
+    im = (im - np.asarray(mean, dtype=np.float32)) / np.asarray(std, dtype=np.float32)
+    return im.transpose((2, 0, 1))
+
+
+def _to_mask(prediction, image_size):
+    """Scale a raw model prediction to 0-255 and resize it to the original image."""
+    low, high = float(np.min(prediction)), float(np.max(prediction))
+    prediction = (prediction - low) / max(high - low, 1e-6)
+    mask = Image.fromarray((prediction * 255).astype("uint8"))
+    return mask.resize(image_size, Image.Resampling.LANCZOS)
+
+
+# One dispatcher per process, shared by every request thread of this worker
+inference_engine = BatchingInferenceEngine()
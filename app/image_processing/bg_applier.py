@@ -1,5 +1,15 @@
+import logging
+import math
+
+import numpy as np
 from PIL import Image
 
+from app.image_processing.compositor import blend_over, composite_image
+from app.image_processing.image_io import like_input, to_image
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
 
 class BackgroundApplier:
     """
@@ -7,34 +17,115 @@ class BackgroundApplier:
     pip install pillow
     """
 
-    def __init__(self, car_image_path, background_image_path, output_image_path):
+    def __init__(self, car_image_path=None, background_image_path=None, output_image_path=None):
         self.car_image_path = car_image_path
         self.background_image_path = background_image_path
         self.output_image_path = output_image_path
 
+    def apply(self, car_image, background):
+        """
+        Applies the background image to an in-memory car image with removed background.
+
+        :param car_image: Car cutout (PIL Image or numpy array), transparency is used as the mask
+        :param background: Background (PIL Image or numpy array)
+        :return: Composited image, RGB when the background is opaque and RGBA otherwise,
+                 same container type as `car_image`
+        """
+        if isinstance(car_image, np.ndarray) and car_image.ndim == 3 and car_image.shape[2] == 4:
+            # Blended straight from the cutout's pixels (e.g. a shared frame), no PIL copy of it
+            fitted = self.fit_background(background, (car_image.shape[1], car_image.shape[0]))
+            output_pixels = np.array(fitted)
+            with metrics.stage("composite"):
+                return blend_over(output_pixels, car_image)
+
+        # Ensure car image is RGBA (to preserve transparency)
+        car_rgba = to_image(car_image)
+        if car_rgba.mode != "RGBA":
+            car_rgba = car_rgba.convert("RGBA")
+        fitted = self.fit_background(background, car_rgba.size)
+
+        # Blend the car over a copy of the background, the fitted background may be shared.
+        # Opaque backgrounds stay RGB, so the result is encoded without an alpha channel
+        output_image = fitted.copy()
+        composite_image(output_image, car_rgba)
+        return like_input(output_image, car_image)
+
+    @staticmethod
+    def fit_background(background, size):
+        """
+        Returns a copy of `background` resized to `size`, RGB when it is opaque
+        and RGBA otherwise, so opaque backgrounds are not blended or encoded
+        with a useless alpha channel.
+        A background that already is of the right size (e.g. fitted once for
+        a whole set of photos) is only copied, not resampled again.
+        """
+        source = BackgroundApplier.background_source(background)
+        if source.size == tuple(size):
+            return source.copy()
+        # Resize background to fit the car image size (optional, you can skip resizing)
+        with metrics.stage("resize"):
+            return source.resize(size, Image.Resampling.LANCZOS)
+
+    @staticmethod
+    def background_source(background):
+        """
+        `background` as a PIL Image in the mode fit_background() gives it,
+        not resized and not copied if it already is.
+        """
+        background = to_image(background)
+        # Ensure background is RGB or RGBA
+        if background.mode == "RGBA" or "transparency" in background.info or background.mode in ("LA", "PA"):
+            background = background.convert("RGBA")
+            if background.getextrema()[3] == (255, 255):
+                background = background.convert("RGB")
+        elif background.mode != "RGB":
+            background = background.convert("RGB")
+        return background
+
+    @staticmethod
+    def fit_background_rows(source, size, top, bottom):
+        """
+        Rows top to bottom of fit_background(source, size), resampling only the
+        source rows they need. Equal to cropping the whole fitted background up
+        to rounding (+-1 per channel, of the premultiplied colours when translucent).
+
+        :param source: Background returned by background_source()
+        """
+        width, height = size
+        if source.size == tuple(size):
+            return source.crop((0, top, width, bottom))
+        scale = source.height / height
+        box_top, box_bottom = top * scale, bottom * scale
+        if source.mode == "RGB":
+            # PIL only resamples the source rows inside the box and the filter's reach
+            return source.resize((width, bottom - top), Image.Resampling.LANCZOS,
+                                 box=(0, box_top, source.width, box_bottom))
+        # RGBA images are premultiplied whole before resampling: crop the rows LANCZOS reads first
+        # (3 output pixels each side, as many source pixels per output pixel when scaling down)
+        margin = math.ceil(3 * max(scale, 1)) + 1
+        crop_top = max(0, math.floor(box_top) - margin)
+        crop_bottom = min(source.height, math.ceil(box_bottom) + margin)
+        rows = source.crop((0, crop_top, source.width, crop_bottom))
+        return rows.resize((width, bottom - top), Image.Resampling.LANCZOS,
+                           box=(0, box_top - crop_top, source.width, box_bottom - crop_top))
+
     def apply_background(self):
         """
-        Applies the background image to the car image with removed background.
+        Path based adapter: applies background_image_path to car_image_path and saves the result.
+
+        :return: True when saved, False when it failed (the error is logged with its traceback)
         """
         try:
             # Open the background image and car image (with removed background)
-            background = Image.open(self.background_image_path).convert(
-                "RGBA")  # Ensure background is RGBA
-            # Ensure car image is RGBA (to preserve transparency)
-            car_image = Image.open(self.car_image_path).convert("RGBA")
-
-            # Resize background to fit the car image size (optional, you can skip resizing)
-            background = background.resize(
-                car_image.size, Image.Resampling.LANCZOS)
-
-            # Paste the car image on top of the background, preserving transparency
-            # Use car image as a mask to preserve its transparency
-            background.paste(car_image, (0, 0), car_image)
+            with Image.open(self.background_image_path) as background, Image.open(self.car_image_path) as car_image:
+                output_image = self.apply(car_image, background)
 
             # Save the final output image
             # Save as PNG to preserve transparency
-            background.save(self.output_image_path, format="PNG")
+            output_image.save(self.output_image_path, format="PNG")
 
-            print(f"Background applied and saved to {self.output_image_path}")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.info("Background applied and saved to %s", self.output_image_path)
+        except Exception:
+            logger.exception("Could not save %s", self.output_image_path)
+            return False
+        return True
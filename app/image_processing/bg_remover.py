@@ -1,4 +1,18 @@
-from rembg import remove
+import logging
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.image_processing.backends import backends
+from app.image_processing.batching import inference_engine
+from app.image_processing.compositor import cutout_in_place, mask_edges
+from app.image_processing.image_io import like_input, to_image
+from app.image_processing.mask_cache import digest_image, mask_cache
+from app.image_processing.mask_upsampler import mask_upsampler
+from app.image_processing.session_pool import session_pool
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class BackgroundRemover:
@@ -6,25 +20,116 @@ class BackgroundRemover:
     pip install rembg pillow onnxruntime
     """
 
-    def __init__(self, input_image_path, output_image_path):
+    def __init__(self, input_image_path=None, output_image_path=None):
         self.input_image_path = input_image_path
         self.output_image_path = output_image_path
 
-    def remove_background(self):
+    def remove(self, image, digest=None, in_place=False, mask=None):
         """
-        Removes the background from the input image and saves the result.
+        Removes the background from an in-memory image.
         rembg uses ML model to remove backgrund(like U-Net)
         The model is loaded and executed using onnxruntime, which is optimized for running machine learning models.
         ls -lh ~/.u2net --> u2net.onnx (168MB)
+
+        :param image: PIL Image or numpy array
+        :param digest: Optional digest of the uploaded bytes (see mask_cache.digest_bytes),
+                       used as the mask cache key
+        :param in_place: Write the cutout into `image`, an HxWx4 uint8 array (a shared frame, see frame_ring)
+        :param mask: Optional "L" mask of the same size, e.g. one returned earlier by mask(); skips inference
+        :return: RGBA cutout, same container type as `image`
+        """
+        if in_place:
+            return self._remove_in_place(image, digest, mask)
+        input_image = to_image(image)
+        if mask is None:
+            mask = self.mask(input_image, digest=digest)
+        with metrics.stage("composite"):
+            cutout = backends.get("rembg.bg").naive_cutout(input_image, mask)
+        return like_input(cutout, image)
+
+    def mask(self, image, digest=None):
+        """
+        The mask remove() cuts the car out with: predict_mask() refined and
+        feathered as configured in the `mask_edges` section.
+
+        :param image: PIL Image, or an HxWx4 uint8 array (e.g. a shared frame) read without a copy
+        :param digest: Optional digest of the uploaded bytes, the mask cache key
+        :return: PIL Image in mode "L", same size as `image`
+        """
+        if isinstance(image, np.ndarray):
+            height, width = image.shape[:2]
+            # A PIL view of the pixels, the model only reads them
+            image = Image.frombuffer("RGBA", (width, height), image, "raw", "RGBA", 0, 1)
+        return mask_edges.apply(self.predict_mask(image, digest=digest))
+
+    @staticmethod
+    def cache_key(digest):
+        """
+        Mask cache key of an image digest: the model, its precision and graph optimization
+        and the upsampling settings all change the mask, a switch of any of them misses.
+        """
+        return mask_cache.key(digest, session_pool.model, **session_pool.params(), **mask_upsampler.params())
+
+    def _remove_in_place(self, pixels, digest, mask):
+        if mask is None:
+            mask = self.mask(pixels, digest=digest)
+        with metrics.stage("composite"):
+            cutout_in_place(pixels, np.asarray(mask))
+        return pixels
+
+    def predict_mask(self, image, digest=None):
+        """
+        Returns the 8-bit alpha mask of the car in `image`.
+        The onnxruntime session comes from the process-wide session_pool, so the
+        model is loaded once per worker instead of once per call.
+        When batching is enabled the mask is computed by the shared
+        inference_engine, which batches concurrent requests into one run.
+        Masks are cached by image digest and model, so re-uploads skip inference.
+        Large photos are inferred on a downsampled copy and the mask is
+        upsampled to full size by the mask_upsampler; the cache holds the
+        small mask.
+
+        :param image: PIL Image
+        :param digest: Optional digest of the uploaded bytes, saves hashing the pixels
+        :return: PIL Image in mode "L", same size as `image`
+        """
+        proxy = mask_upsampler.proxy(image)
+        cache_key = None
+        mask = None
+        if mask_cache.enabled:
+            cache_key = self.cache_key(digest or digest_image(image))
+            mask = mask_cache.get(cache_key)
+
+        if mask is None:
+            with metrics.stage("inference"):
+                if inference_engine.enabled:
+                    mask = inference_engine.predict_mask(proxy)
+                else:
+                    mask = session_pool.get_session().predict(proxy)[0]
+            if cache_key is not None:
+                mask_cache.put(cache_key, mask)
+
+        with metrics.stage("resize"):
+            if mask.size != proxy.size:
+                # Cached for the same upload decoded at another size (a resized delivery variant)
+                mask = mask.resize(proxy.size, Image.Resampling.BILINEAR)
+            return mask_upsampler.upsample(mask, proxy, image)
+
+    def remove_background(self):
+        """
+        Path based adapter: removes the background from input_image_path and saves the result.
         Output format is png:
          1. Less lossless than jpeg
          2. supports transparent background
+
+        :return: True when saved, False when it failed (the error is logged with its traceback)
         """
         try:
-            with open(self.input_image_path, 'rb') as input_file, open(self.output_image_path, 'wb') as output_file:
-                input_image = input_file.read()
-                output_image = remove(input_image)
-                output_file.write(output_image)
-            print(f"Background removed and saved to {self.output_image_path}")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            with Image.open(self.input_image_path) as input_image:
+                output_image = self.remove(ImageOps.exif_transpose(input_image))
+            output_image.save(self.output_image_path, format="PNG")
+            logger.info("Background removed and saved to %s", self.output_image_path)
+        except Exception:
+            logger.exception("Could not save %s", self.output_image_path)
+            return False
+        return True
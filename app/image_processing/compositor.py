@@ -0,0 +1,318 @@
+"""
+numpy compositing core used by BackgroundApplier and LogoAdder.
+
+All functions work in place (on uint8 arrays, or PIL images for
+composite_image) and only touch the rows and columns they need. Blending
+runs in horizontal bands through preallocated uint16 scratch buffers, so the
+temporary memory of a full-frame composite is a few MB regardless of the
+image size.
+"""
+import sys
+
+import numpy as np
+from PIL import Image
+
+from app.metrics import metrics
+
+# Rows blended per band, bounds the scratch buffers to band_rows x width x 4 x 2 bytes
+BAND_ROWS = 64
+
+# An RGBA pixel read as a native uint32: shift that brings alpha into the low byte,
+# and the factor that copies it into the three colour bytes (leaving alpha at 0)
+if sys.byteorder == "little":
+    _ALPHA_SHIFT, _ALPHA_SPREAD = 24, 0x00010101
+else:
+    _ALPHA_SHIFT, _ALPHA_SPREAD = 0, 0x01010100
+
+
+def blend_over(dst, src, offset=(0, 0), band_rows=BAND_ROWS):
+    """
+    Composite a straight-alpha RGBA `src` over `dst` in place.
+
+    Opaque destinations use out = src * a + dst * (1 - a) in integer
+    arithmetic; bands of an RGBA destination that are not fully opaque are
+    blended in premultiplied space (Porter-Duff "over") and converted back to
+    straight alpha. Only the part of `dst` covered by `src` is read or
+    written, and columns where `src` is fully transparent are skipped.
+    RGBA destinations are the fast path, HxWx3 ones are blended channel by
+    channel.
+
+    :param dst: uint8 array HxWx3 or HxWx4, modified in place
+    :param src: uint8 array hxwx4 (straight alpha)
+    :param offset: (x, y) of src's top-left corner in dst, may be negative
+    :return: dst
+    """
+    x, y = offset
+    # Clip the src rectangle to dst
+    left, top = max(x, 0), max(y, 0)
+    right = min(x + src.shape[1], dst.shape[1])
+    bottom = min(y + src.shape[0], dst.shape[0])
+    if right <= left or bottom <= top:
+        return dst
+    src = src[top - y:bottom - y, left - x:right - x]
+    region = dst[top:bottom, left:right]
+
+    if region.shape[2] == 3:
+        _blend_rgb(region, src, band_rows)
+    else:
+        _blend_rgba(region, src, band_rows)
+    return dst
+
+
+def composite_image(base, overlay, position=(0, 0)):
+    """
+    Composite an RGBA PIL `overlay` over the RGB or RGBA PIL `base` in place.
+
+    Only the bounding box of the overlay's visible pixels is converted to
+    numpy, blended with blend_over() and pasted back, so the rest of the
+    frame is never copied or touched.
+
+    :param base: PIL Image in mode RGB or RGBA, modified in place
+    :param overlay: PIL Image in mode RGBA
+    :param position: (x, y) of the overlay's top-left corner in base, may be negative
+    :return: base
+    """
+    with metrics.stage("composite"):
+        return _composite_image(base, overlay, position)
+
+
+def _composite_image(base, overlay, position):
+    visible = overlay.getchannel("A").getbbox()
+    if visible is None:
+        return base
+    x, y = position[0] + visible[0], position[1] + visible[1]
+    box = (max(x, 0), max(y, 0),
+           min(x + visible[2] - visible[0], base.width), min(y + visible[3] - visible[1], base.height))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return base
+    pixels = rgba_pixels(base.crop(box))
+    blend_over(pixels, np.asarray(overlay.crop(visible)), (x - box[0], y - box[1]))
+    base.paste(from_rgba_pixels(pixels, base.mode), box[:2])
+    return base
+
+
+def rgba_pixels(image):
+    """Writable HxWx4 array of an RGB (padded with opaque alpha) or RGBA image, the fast path of blend_over."""
+    # PIL stores RGB pixels in 4 bytes, packing them as RGBX skips a convert("RGBA")
+    raw = bytearray(image.tobytes("raw", "RGBX" if image.mode == "RGB" else "RGBA"))
+    pixels = np.frombuffer(raw, dtype=np.uint8).reshape(image.height, image.width, 4)
+    if image.mode == "RGB":
+        # The padding byte is not always 255 (resize() leaves it at 0), which blend_over would take for alpha
+        pixels[..., 3] = 255
+    return pixels
+
+
+def from_rgba_pixels(pixels, mode):
+    """RGB or RGBA PIL Image of an HxWx4 array, sharing its memory."""
+    height, width = pixels.shape[:2]
+    return Image.frombuffer(mode, (width, height), pixels, "raw", "RGBX" if mode == "RGB" else "RGBA", 0, 1)
+
+
+def _bands(src, band_rows):
+    """Yield (start, stop, left, right) of every band of `src` that is not fully transparent."""
+    height = src.shape[0]
+    for start in range(0, height, band_rows):
+        stop = min(start + band_rows, height)
+        covered = np.flatnonzero(src[start:stop, :, 3].any(axis=0))
+        # Fully transparent bands (most of a car photo's sky) need no work
+        if len(covered):
+            yield start, stop, covered[0], covered[-1] + 1
+
+
+def _blend_rgba(region, src, band_rows):
+    rows, width = min(band_rows, region.shape[0]), region.shape[1]
+    alpha = np.empty((rows, width), dtype=np.uint32)
+    inverse_alpha = np.empty((rows, width, 4), dtype=np.uint8)
+    blended = np.empty((rows, width, 4), dtype=np.uint16)
+    weighted = np.empty((rows, width, 4), dtype=np.uint16)
+
+    for start, stop, left, right in _bands(src, band_rows):
+        s = src[start:stop, left:right]
+        d = region[start:stop, left:right]
+        if not (d[..., 3] == 255).all():
+            _blend_premultiplied(d, s)
+            continue
+        n, m = s.shape[:2]
+        # (a, a, a, 0) per pixel: dst alpha is multiplied by 255 and stays opaque
+        a = alpha[:n, :m]
+        np.right_shift(np.ascontiguousarray(s).view(np.uint32)[..., 0], _ALPHA_SHIFT, out=a)
+        a *= _ALPHA_SPREAD
+        a4 = a.view(np.uint8).reshape(n, m, 4)
+        ia, b, w = inverse_alpha[:n, :m], blended[:n, :m], weighted[:n, :m]
+        np.subtract(255, a4, out=ia)
+        np.multiply(d, ia, out=b, dtype=np.uint16)
+        np.multiply(s, a4, out=w, dtype=np.uint16)
+        _store(d, b, w)
+
+
+def _blend_rgb(region, src, band_rows):
+    rows, width = min(band_rows, region.shape[0]), region.shape[1]
+    blended = np.empty((rows, width, 3), dtype=np.uint16)
+    weighted = np.empty((rows, width, 3), dtype=np.uint16)
+    inverse_alpha = np.empty((rows, width, 1), dtype=np.uint16)
+
+    for start, stop, left, right in _bands(src, band_rows):
+        s = src[start:stop, left:right]
+        d = region[start:stop, left:right]
+        n, m = s.shape[:2]
+        a = s[..., 3:4]
+        b, w, ia = blended[:n, :m], weighted[:n, :m], inverse_alpha[:n, :m]
+        np.subtract(255, a, out=ia, dtype=np.uint16)
+        np.multiply(d, ia, out=b)
+        np.multiply(s[..., :3], a, out=w, dtype=np.uint16)
+        _store(d, b, w)
+
+
+def _store(d, blended, weighted):
+    """d = (blended + weighted) / 255, rounded; weighted is reused as scratch."""
+    blended += weighted
+    # Exact rounded division by 255 for 0..255*255: (x + 128 + ((x + 128) >> 8)) >> 8
+    blended += 128
+    np.right_shift(blended, 8, out=weighted)
+    blended += weighted
+    blended >>= 8
+    np.copyto(d, blended, casting="unsafe")
+
+
+def _blend_premultiplied(d, s):
+    sa = s[..., 3:4] / np.float32(255)
+    da = d[..., 3:4] / np.float32(255)
+    # out_alpha = sa + da * (1 - sa)
+    oa = 1 - sa
+    oa *= da
+    # Premultiplied dst weighted by (1 - sa), then premultiplied src added on top
+    color = d[..., :3] * oa
+    color += s[..., :3] * sa
+    oa += sa
+    # Back to straight alpha, transparent pixels stay black
+    np.divide(color, oa, out=color, where=oa > 0)
+    color[np.broadcast_to(oa == 0, color.shape)] = 0
+    color += 0.5
+    np.copyto(d[..., :3], color, casting="unsafe")
+    oa *= 255
+    oa += 0.5
+    np.copyto(d[..., 3:4], oa, casting="unsafe")
+
+
+def cutout_in_place(pixels, mask, band_rows=BAND_ROWS):
+    """
+    Cut the car out of an RGBA frame in place: `mask` becomes the alpha
+    channel and the colours are weighted by it, with the same rounding as
+    rembg's naive_cutout (a composite over transparent black), so both
+    give identical pixels.
+
+    :param pixels: uint8 array HxWx4, modified in place
+    :param mask: uint8 array HxW
+    :return: pixels
+    """
+    rows, width = min(band_rows, pixels.shape[0]), pixels.shape[1]
+    blended = np.empty((rows, width, 3), dtype=np.uint16)
+    scratch = np.empty((rows, width, 3), dtype=np.uint16)
+    for start in range(0, pixels.shape[0], band_rows):
+        d = pixels[start:start + band_rows]
+        m = mask[start:start + band_rows, :, None]
+        b, s = blended[:len(d)], scratch[:len(d)]
+        np.multiply(d[..., :3], m, out=b, dtype=np.uint16)
+        # Rounded division by 255 of the colour weighted by the mask, over a zero destination
+        s[...] = 0
+        _store(d[..., :3], b, s)
+        d[..., 3] = m[..., 0]
+    return pixels
+
+
+def refine_mask(mask, low=10, high=245):
+    """
+    Sharpen a soft mask in place: values <= low become 0, values >= high
+    become 255 and values in between are stretched linearly.
+
+    :param mask: uint8 array HxW, modified in place
+    :return: mask
+    """
+    if high <= low:
+        raise ValueError("high must be greater than low")
+    lut = np.clip((np.arange(256, dtype=np.float32) - low) * 255 / (high - low) + 0.5, 0, 255).astype(np.uint8)
+    np.take(lut, mask, out=mask)
+    return mask
+
+
+def feather_mask(mask, radius, band_lines=64):
+    """
+    Soften mask edges in place with a separable box blur of the given radius.
+    Lines are blurred `band_lines` at a time through one int32 scratch buffer
+    instead of allocating a blurred copy of the mask.
+
+    :param mask: uint8 array HxW, modified in place
+    :param radius: Blur radius in pixels, 0 leaves the mask untouched
+    :return: mask
+    """
+    if radius <= 0:
+        return mask
+    # Rows first, then columns (through a transposed view)
+    _box_blur_lines(mask, radius, band_lines)
+    _box_blur_lines(mask.T, radius, band_lines)
+    return mask
+
+
+def _box_blur_lines(lines, radius, band_lines):
+    length = lines.shape[1]
+    size = 2 * radius + 1
+    padded = np.empty((min(band_lines, lines.shape[0]), length + size), dtype=np.int32)
+    for start in range(0, lines.shape[0], band_lines):
+        chunk = lines[start:start + band_lines]
+        p = padded[:len(chunk)]
+        # Edge-extended running sum: sum(window i) = cumsum[i + size] - cumsum[i]
+        p[:, 0] = 0
+        p[:, 1:radius + 1] = chunk[:, :1]
+        p[:, radius + 1:radius + 1 + length] = chunk
+        p[:, radius + 1 + length:] = chunk[:, -1:]
+        np.cumsum(p, axis=1, out=p)
+        chunk[:] = (p[:, size:size + length] - p[:, :length] + radius) // size
+
+
+class MaskEdges:
+    """
+    Optional clean-up of background removal masks before the cutout is made.
+
+    `refine` snaps nearly transparent and nearly opaque mask values to 0 and
+    255 (refine_mask), which removes the faint halo u2net leaves around the
+    car; `feather_radius` then softens the edge (feather_mask), so the car
+    blends into a new background. Both are off by default.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `mask_edges` section of the app config.
+
+        :param settings: dict with optional keys refine, low, high and feather_radius
+        """
+        settings = settings or {}
+        self.refine = bool(settings.get("refine", False))
+        self.low = int(settings.get("low", 10))
+        self.high = int(settings.get("high", 245))
+        if self.high <= self.low:
+            raise ValueError("mask_edges.high must be greater than mask_edges.low")
+        self.feather_radius = int(settings.get("feather_radius", 0))
+
+    @property
+    def enabled(self):
+        return self.refine or self.feather_radius > 0
+
+    def apply(self, mask):
+        """
+        :param mask: PIL Image in mode "L", not modified (it may be a cached mask)
+        :return: The cleaned up mask, `mask` itself when nothing is enabled
+        """
+        if not self.enabled:
+            return mask
+        pixels = np.array(mask, dtype=np.uint8)
+        if self.refine:
+            refine_mask(pixels, self.low, self.high)
+        feather_mask(pixels, self.feather_radius)
+        return Image.fromarray(pixels)
+
+
+# One configuration per process, from the `mask_edges` section
+mask_edges = MaskEdges()
@@ -0,0 +1,172 @@
+from PIL import Image
+
+from app.image_processing.image_io import encode_image
+
+# Output format -> (PIL format, mimetype, file extension)
+FORMATS = {
+    "png": ("PNG", "image/png", ".png"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "avif": ("AVIF", "image/avif", ".avif"),
+}
+
+# Formats tried, in order, against the image types a client lists in its Accept header.
+# AVIF is smallest but slowest to encode, WebP is the best trade-off for both cases.
+PREFERENCES = {
+    "alpha": ("webp", "avif", "png"),
+    "opaque": ("webp", "jpeg", "avif", "png"),
+}
+
+
+class EncodedImage:
+    """Encoded output image: its bytes and output format, and the car's bounding box when known."""
+
+    def __init__(self, data, format, bbox=None):
+        self.data = data
+        self.format = format
+        # (left, top, right, bottom) of the visible pixels of a cutout or mask
+        self.bbox = bbox
+
+    @property
+    def mimetype(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def extension(self):
+        return FORMATS[self.format][2]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def has_alpha(image):
+    """True if `image` has an alpha channel that is not fully opaque."""
+    if image.mode not in ("RGBA", "LA", "PA") and "transparency" not in image.info:
+        return False
+    rgba = image if image.mode == "RGBA" else image.convert("RGBA")
+    return rgba.getchannel("A").getextrema()[0] < 255
+
+
+class OutputEncoder:
+    """
+    Chooses the output format of a processed image and encodes it.
+
+    The format comes from the `format` query parameter, else from the image
+    types the client explicitly lists in its Accept header (browsers list
+    image/webp and image/avif), else PNG as before. format=auto lets the
+    server pick: JPEG for opaque composites, WebP with alpha for cutouts.
+    PNG is written with a fast zlib level; images with transparency are never
+    sent as JPEG unless asked to, and are then flattened onto white.
+    Named `variants` deliver a scaled down copy, see max_size().
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `output` section of the app config.
+
+        :param settings: dict with optional keys png_compress_level, jpeg_quality, webp_quality,
+                         webp_method, webp_alpha_quality, avif_quality, avif_speed
+                         and variants (name -> long side in pixels)
+        """
+        settings = settings or {}
+        self.png_compress_level = int(settings.get("png_compress_level", 1))
+        self.jpeg_quality = int(settings.get("jpeg_quality", 85))
+        self.webp_quality = int(settings.get("webp_quality", 80))
+        self.webp_method = int(settings.get("webp_method", 2))
+        self.webp_alpha_quality = int(settings.get("webp_alpha_quality", 90))
+        self.avif_quality = int(settings.get("avif_quality", 60))
+        self.avif_speed = int(settings.get("avif_speed", 8))
+        self.variants = {name: int(size) for name, size in (settings.get("variants") or {}).items()}
+
+    @staticmethod
+    def available_formats():
+        """Output formats this PIL build can encode."""
+        return [name for name in FORMATS if name != "avif" or _avif_available()]
+
+    def max_size(self, variant=None):
+        """
+        Long side in pixels of a delivery variant, None for the full size.
+
+        :raises ValueError: For unknown variant names
+        """
+        if not variant or variant == "full":
+            return None
+        if variant not in self.variants:
+            raise ValueError(f"Unknown variant '{variant}', choose one of {['full', *self.variants]}")
+        return self.variants[variant]
+
+    def check(self, format=None, variant=None):
+        """
+        Validate requested output options before any work is done.
+
+        :raises ValueError: For unknown or unavailable formats and unknown variants
+        """
+        if format and format != "auto" and format not in self.available_formats():
+            raise ValueError(f"Unsupported output format '{format}', choose one of "
+                             f"{['auto', *self.available_formats()]}")
+        self.max_size(variant)
+
+    def choose_format(self, image, format=None, accept=None, alpha=None):
+        """
+        Output format for `image`.
+
+        :param format: Requested format (one of FORMATS or 'auto'), None to negotiate from `accept`
+        :param accept: Image mimetypes the client explicitly accepts, most preferred first
+        :param alpha: Whether the image has transparency, for images not made yet (`image` is then None)
+        :raises ValueError: For unknown or unavailable formats
+        """
+        if format and format != "auto":
+            self.check(format)
+            return format
+        kind = "alpha" if (has_alpha(image) if alpha is None else alpha) else "opaque"
+        available = self.available_formats()
+        for candidate in PREFERENCES[kind]:
+            if candidate in available and FORMATS[candidate][1] in (accept or ()):
+                return candidate
+        if format == "auto":
+            return "webp" if kind == "alpha" else "jpeg"
+        return "png"
+
+    def encode(self, image, format=None, quality=None, accept=None):
+        """
+        Encode `image` in the chosen output format.
+
+        :param quality: 1-100, overrides the configured quality of lossy formats
+        :return: EncodedImage
+        """
+        format = self.choose_format(image, format, accept)
+        if format == "png":
+            params = {"compress_level": self.png_compress_level}
+        elif format == "jpeg":
+            image = _flatten(image)
+            params = {"quality": quality or self.jpeg_quality}
+        elif format == "webp":
+            params = {"quality": quality or self.webp_quality, "method": self.webp_method,
+                      "alpha_quality": self.webp_alpha_quality}
+        else:
+            params = {"quality": quality or self.avif_quality, "speed": self.avif_speed}
+        return EncodedImage(encode_image(image, FORMATS[format][0], **params), format)
+
+
+def _flatten(image):
+    """RGB copy of `image`, transparent pixels composited onto white."""
+    if image.mode == "RGB":
+        return image
+    if not has_alpha(image):
+        return image.convert("RGB")
+    flattened = Image.new("RGB", image.size, (255, 255, 255))
+    flattened.paste(image.convert("RGBA"), mask=image.convert("RGBA").getchannel("A"))
+    return flattened
+
+
+def _avif_available():
+    # Native in recent PIL builds, registered by pillow-avif-plugin in older ones
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+# One encoder per process, configured from the `output` section
+output_encoder = OutputEncoder()
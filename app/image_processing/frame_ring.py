@@ -0,0 +1,157 @@
+"""
+Ring of preallocated RGBA frame slots shared with the offload worker processes.
+
+With offloading enabled (see offload.py) the server process decodes the
+uploaded photo of a workflow into a free slot of one
+multiprocessing.shared_memory block (straight into the slot for upright RGB
+and RGBA JPEGs at their stored size, through a decoded copy for PNGs and
+rotated or scaled photos), and the worker process works on the
+slot's pixels in place: background removal writes the alpha channel
+(compositor.cutout_in_place), LogoAdder blends onto the slot and
+BackgroundApplier reads the car from it. Decoded photos are never pickled
+or encoded between processes, slots are reused instead of allocating a
+block per request, and the memory of in-flight photos is bounded by
+`frames` x `frame_max_megapixels`: requests wait for a free slot.
+Photos larger than a slot go through the bytes handoff.
+"""
+import logging
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.image_io import decode_image
+
+logger = logging.getLogger(__name__)
+
+MEGAPIXEL = 1000 * 1000
+
+
+class Frame:
+    """Picklable handle of a photo decoded into a slot of a FrameRing."""
+
+    def __init__(self, ring, slot, offset, size, digest=None, info=None):
+        self.ring = ring
+        self.slot = slot
+        self.offset = offset
+        self.size = size
+        # Digest of the uploaded bytes, the mask cache key
+        self.digest = digest
+        # The ICC profile of the decoded photo, which its pixels do not carry
+        self.info = info or {}
+
+    def pixels(self):
+        """Writable HxWx4 uint8 view of the frame's slot, in any process."""
+        width, height = self.size
+        return np.ndarray((height, width, 4), dtype=np.uint8, buffer=_attached(self.ring).buf, offset=self.offset)
+
+
+class FrameRing:
+    """Fixed set of RGBA frame slots in one shared memory block, created by the server process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._block = None
+        self._free = None
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the frame keys of the `offload` section of the app config.
+
+        :param settings: dict with optional keys frames (slots, 0 disables the ring) and frame_max_megapixels
+        """
+        settings = settings or {}
+        self.slots = int(settings.get("frames", 4))
+        self.slot_bytes = int(float(settings.get("frame_max_megapixels", 24)) * MEGAPIXEL) * 4
+
+    @property
+    def enabled(self):
+        return self._block is not None
+
+    def create(self):
+        """Allocate the slots; the ring stays disabled when /dev/shm cannot hold them all."""
+        with self._lock:
+            if self._block is not None or self.slots <= 0:
+                return self
+            size = self.slots * self.slot_bytes
+            # The block is sparse: a tmpfs smaller than it would only fail (SIGBUS) once the slots fill up
+            if shutil.disk_usage("/dev/shm").total < size:
+                logger.warning("/dev/shm is smaller than %d frames of %dMB, photos go through the bytes handoff",
+                               self.slots, self.slot_bytes // MEGAPIXEL)
+                return self
+            self._block = shared_memory.SharedMemory(create=True, size=size)
+            _blocks[self._block.name] = self._block
+            self._free = queue.SimpleQueue()
+            for slot in range(self.slots):
+                self._free.put(slot)
+            logger.info("Allocated %d shared frames of %dMB", self.slots, self.slot_bytes // MEGAPIXEL)
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._block is not None:
+                del _blocks[self._block.name]
+                self._block.close()
+                self._block.unlink()
+                self._block = None
+
+    @contextmanager
+    def decode(self, data, max_size=None, digest=None):
+        """
+        Decode uploaded bytes into a free slot, waiting for one, and hold the slot until the block exits.
+        Raises what image_io.decode_image raises.
+
+        :param max_size: Long side the photo is scaled down to, see decode_image
+        :param digest: Digest of `data`, passed on with the Frame
+        :return: Frame, None when the photo is larger than a slot
+        """
+        slot = self._free.get()
+        offset = slot * self.slot_bytes
+        mapped = []
+
+        def into(mode, size):
+            # PIL keeps RGB in 4 bytes per pixel, the padding byte is the opaque alpha of the slot
+            if mode not in ("RGB", "RGBA") or size[0] * size[1] * 4 > self.slot_bytes:
+                return None
+            mapped.append(Image.core.map_buffer(self._block.buf, size, "raw", offset, (mode, 0, 1)))
+            return mapped[-1]
+
+        try:
+            image = decode_image(data, max_size=max_size, into=into)
+            if image.width * image.height * 4 > self.slot_bytes:
+                yield None
+                return
+            info = {key: image.info[key] for key in ("icc_profile",) if image.info.get(key)}
+            frame = Frame(self._block.name, slot, offset, image.size, digest, info)
+            pixels = frame.pixels()
+            if mapped and image.im is mapped[0]:
+                # Decoded into the slot; decoders leave the padding byte of RGB as is on some paths
+                if image.mode == "RGB":
+                    pixels[..., 3] = 255
+            elif image.mode == "RGB":
+                # Rotated or scaled photos are copied in. RGB photos get an opaque alpha channel,
+                # other modes are converted as LogoAdder does
+                pixels[..., :3] = image
+                pixels[..., 3] = 255
+            else:
+                pixels[...] = image.convert("RGBA")
+            # No view of the block may outlive the slot, close() would fail
+            del image, pixels, mapped[:]
+            yield frame
+        finally:
+            self._free.put(slot)
+
+
+# Blocks of this process's rings, and those attached by name in worker processes
+_blocks = {}
+
+
+def _attached(name):
+    if name not in _blocks:
+        _blocks[name] = shared_memory.SharedMemory(name=name)
+    return _blocks[name]
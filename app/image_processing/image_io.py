@@ -0,0 +1,94 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+from app.image_processing.ingestion import UploadRejected, image_ingestion
+from app.metrics import metrics
+
+
+def decode_image(data, target_size=None, max_size=None, into=None):
+    """
+    Decode uploaded image bytes into a PIL Image (single decode at ingress).
+    EXIF orientation is applied here so every stage sees an upright image.
+    The header is checked by the image_ingestion policy before any pixel is decoded.
+
+    :param data: Uploaded image bytes
+    :param target_size: Optional (width, height) the image will be scaled down to.
+                        JPEGs are then decoded at the smallest 1/2, 1/4 or 1/8
+                        scale that still covers it (Image.draft).
+    :param max_size: Optional long side in pixels; larger images are scaled
+                     down to it, JPEGs draft-decoded as for target_size
+    :param into: Optional function (mode, size) -> PIL core image or None. Upright
+                 JPEGs (and other formats not decoded by getexif()) that need no
+                 scaling are decoded straight into the memory it returns (see
+                 frame_ring), instead of memory of their own.
+    :raises UploadRejected: For unsupported formats and oversized images
+    """
+    with metrics.stage("decode"):
+        return _decode_image(data, target_size, max_size, into)
+
+
+def _decode_image(data, target_size, max_size, into):
+    try:
+        image = Image.open(BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(str(e), 413)
+    image_ingestion.check(image)
+
+    # draft() works on the stored orientation, rotated photos have their sides swapped
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    rotated = orientation in (5, 6, 7, 8)
+    upright_size = image.size[::-1] if rotated else image.size
+    if max_size and max(upright_size) > max_size:
+        scale = max_size / max(upright_size)
+        target_size = (max(1, round(upright_size[0] * scale)), max(1, round(upright_size[1] * scale)))
+    else:
+        max_size = None
+    if target_size and image.format in ("JPEG", "MPO"):
+        image.draft(image.mode, tuple(target_size[::-1] if rotated else target_size))
+
+    # exif_transpose() returns a copy even of upright photos, twice their decoded size at peak
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    elif into is not None and image.tile and (not max_size or image.size == target_size):
+        # image.tile is empty once decoded: PNG's getexif() decodes the pixels, looking for eXIf after them
+        memory = into(image.mode, image.size)
+        if memory is not None:
+            # ImageFile.load() decodes into the image memory already set
+            image.im = memory
+    image.load()
+    if max_size and image.size != target_size:
+        image = image.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return image
+
+
+def encode_image(image, format="PNG", **params):
+    """
+    Encode a PIL Image into bytes (single encode at egress).
+
+    :param params: Encoder options passed to Image.save, e.g. quality or compress_level
+    """
+    output = BytesIO()
+    with metrics.stage("encode"):
+        image.save(output, format=format, **params)
+    return output.getvalue()
+
+
+def to_image(image):
+    """
+    Accept a PIL Image or a numpy array (HxW, HxWx3 or HxWx4 uint8) and return a PIL Image.
+    """
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return image
+
+
+def like_input(result, original):
+    """
+    Return `result` (a PIL Image) in the same container type as `original`,
+    so numpy callers get numpy arrays back.
+    """
+    if isinstance(original, np.ndarray):
+        return np.asarray(result)
+    return result
@@ -0,0 +1,121 @@
+import os
+
+from PIL import Image
+
+from app.image_processing.mask_cache import MB
+
+# Formats accepted by default (PIL format names); MPO is how PIL reports many phone JPEGs
+DEFAULT_FORMATS = ("JPEG", "MPO", "PNG", "WEBP", "AVIF")
+
+
+class UploadRejected(Exception):
+    """Raised for uploads that are refused before they are decoded."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        # Keeps the status when raised in an offload worker process
+        return self.__class__, (str(self), self.status)
+
+
+class ImageIngestion:
+    """
+    Checks uploaded images before their pixels are decoded.
+
+    Only the image header is parsed (PIL's Image.open is lazy), so uploads
+    in an unsupported format, over `max_file_mb` or with more than
+    `max_pixels` pixels (decompression bombs: a few KB of PNG can expand to
+    GBs of pixels) are rejected without reading the whole body into memory
+    or allocating the decoded image.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, settings=None, max_file_mb=None):
+        """
+        Apply the `ingestion` section of the app config.
+
+        :param settings: dict with optional keys formats, max_pixels and max_dimension
+        :param max_file_mb: Max size of one uploaded image (`image_max_size`), None for no limit
+        """
+        settings = settings or {}
+        self.formats = tuple(format.upper() for format in settings.get("formats", DEFAULT_FORMATS))
+        self.max_pixels = int(settings.get("max_pixels", 50_000_000))
+        self.max_dimension = int(settings.get("max_dimension", 16384))
+        self.max_file_bytes = int(float(max_file_mb) * MB) if max_file_mb else None
+
+    def check(self, image):
+        """
+        Validate an opened, not yet decoded image from its header.
+
+        :param image: PIL Image returned by Image.open()
+        :raises UploadRejected: For unsupported formats and oversized images
+        """
+        if image.format not in self.formats:
+            raise UploadRejected(
+                f"Unsupported image format {image.format}, upload one of {', '.join(self.formats)}", 415)
+        width, height = image.size
+        if width * height > self.max_pixels or max(width, height) > self.max_dimension:
+            raise UploadRejected(
+                f"Image of {width}x{height} pixels is too large, the limit is {self.max_pixels} pixels "
+                f"and {self.max_dimension} pixels per side", 413)
+
+    def read(self, file_storage):
+        """
+        Check an uploaded file and return its bytes.
+
+        The file size comes from the upload's spooled stream and the format and
+        dimensions from its header, the body is only read once both are accepted.
+
+        :param file_storage: werkzeug FileStorage, or None
+        :return: The uploaded bytes, None when no file was uploaded
+        :raises UploadRejected: For oversized, unsupported or undecodable uploads
+        """
+        if not file_storage:
+            return None
+        stream = self._checked_stream(file_storage)
+        try:
+            with Image.open(stream) as image:
+                self.check(image)
+        except Image.DecompressionBombError as e:
+            raise UploadRejected(str(e), 413)
+        except (OSError, SyntaxError, ValueError) as e:
+            raise UploadRejected(f"{file_storage.filename or 'Upload'} is not a readable image: {e}")
+        finally:
+            stream.seek(0)
+        return stream.read()
+
+    def read_mask(self, file_storage):
+        """
+        Check an uploaded mask and return its bytes: an image as read() does,
+        or a JSON document (RLE or polygons, see mask_codec) within the size limit.
+
+        :param file_storage: werkzeug FileStorage, or None
+        :return: The uploaded bytes, None when no file was uploaded
+        """
+        if not file_storage:
+            return None
+        stream = self._checked_stream(file_storage)
+        if stream.read(64).lstrip()[:1] == b"{":
+            stream.seek(0)
+            return stream.read()
+        return self.read(file_storage)
+
+    def _checked_stream(self, file_storage):
+        """The upload's stream, rewound, once its size is accepted."""
+        stream = file_storage.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        if self.max_file_bytes is not None and size > self.max_file_bytes:
+            raise UploadRejected(
+                f"{file_storage.filename or 'Upload'} is {size / MB:.1f}MB, "
+                f"the limit is {self.max_file_bytes / MB:g}MB per image", 413)
+        return stream
+
+
+# One ingestion policy per process, configured from the `ingestion` section
+image_ingestion = ImageIngestion()
@@ -1,5 +1,14 @@
+import logging
+
+import numpy as np
 from PIL import Image
 
+from app.image_processing.compositor import blend_over, composite_image
+from app.image_processing.image_io import like_input, to_image
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
 
 class LogoAdder:
     """
@@ -7,51 +16,97 @@ class LogoAdder:
     pip install pillow
     """
 
-    def __init__(self, input_image_path, logo_path, output_image_path):
+    def __init__(self, input_image_path=None, logo_path=None, output_image_path=None):
         self.input_image_path = input_image_path
         self.logo_path = logo_path
         self.output_image_path = output_image_path
 
+    def add(self, image, logo, location="top-left", in_place=False):
+        """
+        Adds the logo to an in-memory image at the specified location.
+
+        :param image: PIL Image or numpy array
+        :param logo: PIL Image or numpy array
+        :param location: The position to place the logo.
+                         Options: 'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
+        :param in_place: Blend the logo onto `image` itself: an HxWx3 or HxWx4 uint8 array (e.g. a shared frame)
+                         or an RGB or RGBA PIL Image, of which only the logo's bounding box is touched
+        :return: Image with the logo (RGB images stay RGB, anything else becomes RGBA),
+                 same container type as `image`
+        """
+        if in_place and isinstance(image, Image.Image):
+            logo_rgba = self.fit_logo(logo, image.size)
+            return composite_image(image, logo_rgba, self.position(location, image.size, logo_rgba.size))
+        if in_place:
+            size = (image.shape[1], image.shape[0])
+            logo_rgba = self.fit_logo(logo, size)
+            with metrics.stage("composite"):
+                return blend_over(image, np.asarray(logo_rgba), self.position(location, size, logo_rgba.size))
+
+        image_out = to_image(image)
+        # RGB images stay RGB, other modes are converted to RGBA
+        image_out = image_out.copy() if image_out.mode in ("RGB", "RGBA") else image_out.convert("RGBA")
+        logo_rgba = self.fit_logo(logo, image_out.size)
+
+        # Only the logo's bounding box is blended, the rest of the frame is left untouched
+        composite_image(image_out, logo_rgba, self.position(location, image_out.size, logo_rgba.size))
+        return like_input(image_out, image)
+
+    @staticmethod
+    def position(location, image_size, logo_size):
+        """Top-left corner of a logo of `logo_size` placed at `location`, 'top-left' if location is invalid."""
+        width, height = image_size
+        logo_width, logo_height = logo_size
+        positions = {
+            "top-left": (10, 10),
+            "top-right": (width - logo_width - 10, 10),
+            "bottom-left": (10, height - logo_height - 10),
+            "bottom-right": (width - logo_width - 10, height - logo_height - 10),
+            "center": ((width - logo_width) // 2, (height - logo_height) // 2),
+        }
+        return positions.get(location, (10, 10))
+
+    @staticmethod
+    def fit_logo(logo, image_size):
+        """
+        Returns an RGBA copy of `logo` scaled down to fit 1/7th of the image width.
+        Fitting an already fitted logo again is a no-op, so callers can fit a
+        shared logo once per image size and pass the result to add().
+        """
+        # Convert logo to RGBA (to preserve transparency)
+        logo_rgba = to_image(logo).convert("RGBA")
+
+        # Resize the logo (optional, scale based on the input image size)
+        # Resize logo using LANCZOS filter
+        with metrics.stage("resize"):
+            logo_rgba.thumbnail(LogoAdder.logo_size(image_size),
+                                Image.Resampling.LANCZOS)
+        return logo_rgba
+
+    @staticmethod
+    def logo_size(image_size):
+        """The box a logo is fitted into on an image of `image_size`: 1/7th of the image width, square."""
+        max_logo_width = image_size[0] // 7
+        return max_logo_width, max_logo_width
+
     def add_logo(self, location="top-left"):
         """
-        Adds the logo to the input image at the specified location.
+        Path based adapter: adds logo_path to input_image_path and saves the result.
 
         :param location: The position to place the logo.
                          Options: 'top-left', 'top-right', 'bottom-left', 'bottom-right', 'center'
+        :return: True when saved, False when it failed (the error is logged with its traceback)
         """
         try:
             # Open the input image (car) and the logo image
-            # Convert car image to RGBA (for transparency handling)
-            image = Image.open(self.input_image_path).convert("RGBA")
-            # Convert logo to RGBA (to preserve transparency)
-            logo = Image.open(self.logo_path).convert("RGBA")
-
-            # Resize the logo (optional, scale based on the input image size)
-            # Adjust logo size to be 1/7th of the image width
-            max_logo_width = image.width // 7
-            # Resize logo using LANCZOS filter
-            logo.thumbnail((max_logo_width, max_logo_width),
-                           Image.Resampling.LANCZOS)
-
-            # Determine the logo position
-            positions = {
-                "top-left": (10, 10),
-                "top-right": (image.width - logo.width - 10, 10),
-                "bottom-left": (10, image.height - logo.height - 10),
-                "bottom-right": (image.width - logo.width - 10, image.height - logo.height - 10),
-                "center": ((image.width - logo.width) // 2, (image.height - logo.height) // 2),
-            }
-
-            # Default to 'top-left' if location is invalid
-            position = positions.get(location, (10, 10))
-
-            # Paste the logo onto the car image, maintaining transparency
-            # Use the logo as the mask to preserve transparency
-            image.paste(logo, position, logo)
+            with Image.open(self.input_image_path) as image, Image.open(self.logo_path) as logo:
+                output_image = self.add(image, logo, location=location)
 
             # Save the output image as PNG (to preserve transparency)
-            image.save(self.output_image_path, format="PNG")
+            output_image.save(self.output_image_path, format="PNG")
 
-            print(f"Logo added and saved to {self.output_image_path}")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.info("Logo added and saved to %s", self.output_image_path)
+        except Exception:
+            logger.exception("Could not save %s", self.output_image_path)
+            return False
+        return True
@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by the total size in bytes
+    of its values rather than by the number of entries.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for `key` (marking it recently used) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """
+        Store `value` under `key`, evicting least recently used entries until
+        the cache fits in max_bytes. Values larger than max_bytes are not cached.
+
+        :param size: Size of `value` in bytes, as accounted against max_bytes
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _key, (_value, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def discard(self, key):
+        """Remove `key` if present."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def discard_where(self, predicate):
+        """Remove every entry whose key matches `predicate(key)`."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss/eviction counters and byte usage, suitable for JSON responses."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from app.image_processing.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def digest_bytes(data):
+    """sha256 hex digest of raw (upload) bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_image(image):
+    """sha256 hex digest of decoded pixels, for callers that never had the raw bytes."""
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class DiskMaskStore:
+    """
+    On-disk tier of the mask cache, shared by every gunicorn worker on the host.
+
+    Masks are stored as 8-bit grayscale PNGs named after their cache key and
+    written atomically (temp file + rename), so workers never read a partial
+    file. Entries older than ttl_seconds are treated as misses and removed;
+    once the directory grows past max_bytes the oldest entries are evicted.
+    """
+
+    def __init__(self, directory, max_bytes, ttl_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                self.evictions += 1
+                return None
+            with Image.open(path) as mask:
+                mask.load()
+                return mask
+        except OSError:
+            return None
+
+    def put(self, key, mask):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = BytesIO()
+        mask.save(buffer, format="PNG", compress_level=1)
+        data = buffer.getvalue()
+
+        # Write to a temp file in the same directory and rename it into place
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_bytes()
+            else:
+                self._approx_bytes += len(data)
+            if self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".png"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # Evicted by another worker
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _scan_bytes(self):
+        return sum(size for _path, size, _mtime in self._entries())
+
+    def _evict(self):
+        """Remove expired entries, then the oldest ones until the store is at 90% of max_bytes."""
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _path, size, _mtime in entries)
+        for path, size, mtime in entries:
+            expired = self.ttl_seconds and now - mtime > self.ttl_seconds
+            if not expired and total <= self.max_bytes * 0.9:
+                continue
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._approx_bytes = total
+
+
+class MaskCache:
+    """
+    Two-tier content-addressed cache of background removal masks.
+
+    Keys are derived from a digest of the input image plus the model and the
+    parameters that influence the mask, so a re-uploaded photo skips inference
+    entirely. Only the 8-bit alpha mask is cached (a quarter of an RGBA image),
+    callers apply it to the decoded image themselves.
+    Tier 1 is a per-process LRU bounded by bytes, tier 2 an optional
+    DiskMaskStore shared by all workers.
+    """
+
+    def __init__(self, enabled=False, memory_max_mb=64, disk_dir=None, disk_max_mb=1024, ttl_seconds=7 * 24 * 3600):
+        self.memory = None
+        self.disk = None
+        self.disk_hits = 0
+        self.configure({
+            "enabled": enabled,
+            "memory_max_mb": memory_max_mb,
+            "disk_dir": disk_dir,
+            "disk_max_mb": disk_max_mb,
+            "ttl_seconds": ttl_seconds,
+        })
+
+    def configure(self, settings=None):
+        """
+        Apply the `mask_cache` section of the app config.
+
+        :param settings: dict with optional keys enabled, memory_max_mb, disk_dir,
+                         disk_max_mb and ttl_seconds. No disk_dir disables tier 2.
+        """
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled", False))
+        self.memory = LRUCache(int(float(settings.get("memory_max_mb", 64)) * MB))
+        disk_dir = settings.get("disk_dir")
+        self.disk = DiskMaskStore(
+            disk_dir,
+            int(float(settings.get("disk_max_mb", 1024)) * MB),
+            int(settings.get("ttl_seconds", 0) or 0),
+        ) if disk_dir else None
+        self.disk_hits = 0
+
+    @staticmethod
+    def key(digest, model, **params):
+        """Cache key for an input digest, model name and mask-affecting parameters."""
+        material = json.dumps({"digest": digest, "model": model, "params": params}, sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached mask for `key` or None."""
+        mask = self.memory.get(key)
+        if mask is not None or self.disk is None:
+            return mask
+        mask = self.disk.get(key)
+        if mask is not None:
+            self.disk_hits += 1
+            self.memory.put(key, mask, _mask_bytes(mask))
+        return mask
+
+    def put(self, key, mask):
+        """Store `mask` in both tiers. Disk failures are logged, never raised."""
+        self.memory.put(key, mask, _mask_bytes(mask))
+        if self.disk is not None:
+            try:
+                self.disk.put(key, mask)
+            except OSError as e:
+                logger.warning("Could not write mask %s to disk cache: %s", key, e)
+
+    def stats(self):
+        """Hit/miss/eviction counters per tier, suitable for JSON responses."""
+        memory = self.memory.stats()
+        return {
+            "enabled": self.enabled,
+            "memory": memory,
+            "disk": {
+                "directory": self.disk.directory,
+                "hits": self.disk_hits,
+                "evictions": self.disk.evictions,
+            } if self.disk is not None else None,
+            "hits": memory["hits"] + self.disk_hits,
+            # Memory misses that the disk tier did not answer either
+            "misses": memory["misses"] - self.disk_hits,
+        }
+
+
+def _mask_bytes(mask):
+    return mask.width * mask.height * len(mask.getbands())
+
+
+# One cache per process; the disk tier is shared between processes
+mask_cache = MaskCache()
@@ -0,0 +1,124 @@
+"""
+Compact encodings of background removal masks, for clients that composite themselves.
+
+/remove-background?result= returns the 8-bit mask as a grayscale PNG
+(`mask`), or the mask thresholded at 50% as run-lengths (`rle`) or as
+outline polygons (`polygon`), each with the car's tight bounding box.
+Any of them, or a cutout whose alpha channel is the mask, can be uploaded
+back as the `mask` of /apply-background and /process-car-image to skip
+inference. RLE counts alternate transparent and opaque runs over the
+pixels in row-major order, starting with a (possibly empty) transparent
+run. Polygons are lists of [x, y] points; `holes` are cut out of them.
+"""
+import json
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.image_processing.backends import backends
+from app.image_processing.image_io import decode_image
+from app.image_processing.ingestion import UploadRejected, image_ingestion
+
+# result= of /remove-background, besides the default cutout
+ENCODINGS = ("mask", "rle", "polygon")
+
+# Mask values at or above this are opaque in the RLE and polygon encodings
+THRESHOLD = 128
+
+
+def bounding_box(image):
+    """
+    Tight box (left, top, right, bottom) of the visible pixels, None when there are none.
+
+    :param image: PIL Image in mode "L" (a mask) or with an alpha channel, or an HxWx4 uint8 array
+    """
+    if isinstance(image, np.ndarray):
+        rows = np.flatnonzero(image[..., 3].any(axis=1))
+        if not len(rows):
+            return None
+        columns = np.flatnonzero(image[rows[0]:rows[-1] + 1, :, 3].any(axis=0))
+        return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+    return (image if image.mode == "L" else image.getchannel("A")).getbbox()
+
+
+def encode_rle(mask):
+    """{"size": [width, height], "counts": [...]} of an "L" mask thresholded at THRESHOLD."""
+    pixels = np.asarray(mask).ravel() >= THRESHOLD
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [pixels.size]))).tolist()
+    if pixels.size and pixels[0]:
+        counts.insert(0, 0)
+    return {"size": list(mask.size), "counts": counts}
+
+
+def decode_rle(rle):
+    width, height = _size(rle)
+    counts = rle.get("counts")
+    if not isinstance(counts, list) or not all(isinstance(count, int) and count >= 0 for count in counts) \
+            or sum(counts) != width * height:
+        raise UploadRejected(f"RLE mask counts must be non-negative integers adding up to {width}x{height}")
+    values = np.resize(np.array([0, 255], dtype=np.uint8), len(counts))
+    return Image.fromarray(np.repeat(values, counts).reshape(height, width))
+
+
+def encode_polygons(mask, tolerance=1.0):
+    """
+    {"size": [width, height], "polygons": [...], "holes": [...]} of an "L" mask thresholded at THRESHOLD.
+
+    :param tolerance: Max distance in pixels between the outline and its simplified polygon
+    """
+    cv2 = backends.get("cv2")
+    binary = (np.asarray(mask) >= THRESHOLD).astype(np.uint8)
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    polygons, holes = [], []
+    for contour, (_next, _previous, _child, parent) in zip(contours, hierarchy[0] if hierarchy is not None else ()):
+        points = cv2.approxPolyDP(contour, tolerance, True).reshape(-1, 2).tolist()
+        # Outer outlines have no parent, holes (e.g. windows) are their children
+        (holes if parent >= 0 else polygons).append(points)
+    return {"size": list(mask.size), "polygons": polygons, "holes": holes}
+
+
+def decode_polygons(document):
+    width, height = _size(document)
+    mask = Image.new("L", (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for key, fill in (("polygons", 255), ("holes", 0)):
+        for points in document.get(key) or []:
+            try:
+                draw.polygon([tuple(point) for point in points], fill=fill)
+            except (TypeError, ValueError) as e:
+                raise UploadRejected(f"Invalid mask polygon: {e}")
+    return mask
+
+
+def decode_mask(data, size):
+    """
+    The "L" mask of an uploaded mask, scaled to `size` when it was made at another size.
+
+    :param data: Bytes of a grayscale image, a cutout (its alpha channel is used) or an RLE or polygon JSON document
+    :param size: (width, height) of the photo the mask is applied to
+    :raises UploadRejected: For malformed JSON masks
+    """
+    if data.lstrip()[:1] == b"{":
+        try:
+            document = json.loads(data)
+        except ValueError as e:
+            raise UploadRejected(f"Invalid JSON mask: {e}")
+        mask = decode_rle(document) if "counts" in document else decode_polygons(document)
+    else:
+        image = decode_image(data, target_size=size)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        mask = image.convert("RGBA").getchannel("A") if has_alpha else image.convert("L")
+    if mask.size != tuple(size):
+        mask = mask.resize(size, Image.Resampling.BILINEAR)
+    return mask
+
+
+def _size(document):
+    size = document.get("size") if isinstance(document, dict) else None
+    if not (isinstance(size, list) and len(size) == 2 and all(isinstance(side, int) and side > 0 for side in size)):
+        raise UploadRejected("JSON masks need a size of [width, height]")
+    if size[0] * size[1] > image_ingestion.max_pixels:
+        raise UploadRejected(f"Mask of {size[0]}x{size[1]} pixels is too large, "
+                             f"the limit is {image_ingestion.max_pixels} pixels", 413)
+    return size
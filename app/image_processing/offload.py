@@ -0,0 +1,187 @@
+"""
+Process pool the transform workflows are offloaded to.
+
+Served by threads, Pillow and onnxruntime work contends for one GIL with
+the threads that read uploads and write responses. With offloading
+enabled (always in ASGI mode, see app/asgi.py) the route threads only
+wait: a workflow runs in one of `processes` spawned worker processes,
+each with its own warm model session. The uploaded photo is decoded by
+the server into a slot of a ring of `frames` shared RGBA frames (see
+frame_ring.py) the worker works on in place. Other uploads, and encoded
+results, of `shared_memory_min_kb` and more move between the processes
+through multiprocessing.shared_memory blocks instead of the executor's pipe.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from multiprocessing import shared_memory
+
+from app.image_processing.encoders import EncodedImage, output_encoder
+from app.image_processing.frame_ring import FrameRing
+from app.image_processing.mask_cache import digest_bytes
+
+logger = logging.getLogger(__name__)
+
+KB = 1024
+
+
+class SharedBytes:
+    """Picklable handle of bytes in a shared memory block."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    @classmethod
+    def create(cls, data):
+        """Copy `data` into a new block, returns (handle, block); the creator unlinks the block."""
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        block.buf[:len(data)] = data
+        return cls(block.name, len(data)), block
+
+    def read(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            return bytes(block.buf[:self.size])
+        finally:
+            block.close()
+
+
+class ProcessOffload:
+    """Runs workflows in a pool of worker processes, or in the calling thread when disabled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._worker = False
+        self.frames = FrameRing()
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `offload` section of the app config.
+
+        :param settings: dict with optional keys enabled, processes, warm_up, shared_memory_min_kb,
+                         frames and frame_max_megapixels
+        """
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled", False))
+        self.processes = int(settings.get("processes", 2))
+        self.warm_up = bool(settings.get("warm_up", True))
+        self.shared_memory_min_bytes = int(float(settings.get("shared_memory_min_kb", 64)) * KB)
+        self.frames.configure(settings)
+
+    def start(self):
+        """Start the worker processes and wait until each has warmed up its model session."""
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process with onnxruntime and event loop threads is not safe
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=(self.warm_up,))
+                # Every process runs the initializer before its first task
+                for future in [self._executor.submit(_ready) for _ in range(self.processes)]:
+                    future.result()
+                self.frames.create()
+                logger.info("Started %d offload worker processes", self.processes)
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+                self.frames.close()
+
+    def run(self, function, *args, **kwargs):
+        """
+        Call function(*args, **kwargs) in a worker process and return its result.
+
+        `function` must be importable by name (a module level function). The first argument,
+        the uploaded photo of the workflows, is decoded here into a frame (at the size of the
+        `output` variant) and passed as a frame_ring.Frame. Other bytes arguments and
+        EncodedImage results go through shared memory, other values are pickled.
+        """
+        if not self.enabled or self._worker:
+            return function(*args, **kwargs)
+        executor = self._executor or self.start()
+        with ExitStack() as stack:
+            if self.frames.enabled and args and isinstance(args[0], (bytes, bytearray)):
+                # The slot is held until the worker has encoded its result
+                frame = stack.enter_context(self.frames.decode(
+                    args[0], output_encoder.max_size((kwargs.get("output") or {}).get("variant")),
+                    digest_bytes(args[0])))
+                if frame is not None:
+                    args = (frame, *args[1:])
+            args = tuple(self._share(value, stack) for value in args)
+            kwargs = {name: self._share(value, stack) for name, value in kwargs.items()}
+            result = executor.submit(_run_in_worker, function, args, kwargs).result()
+        return _receive(result)
+
+    def _share(self, value, stack):
+        if isinstance(value, (bytes, bytearray)) and len(value) >= self.shared_memory_min_bytes:
+            handle, block = SharedBytes.create(value)
+            stack.callback(block.unlink)
+            stack.callback(block.close)
+            return handle
+        return value
+
+
+class _SharedResult:
+    """An EncodedImage whose data the worker process left in a shared memory block."""
+
+    def __init__(self, data, format, bbox=None):
+        self.data = data
+        self.format = format
+        self.bbox = bbox
+
+
+def _receive(result):
+    if isinstance(result, _SharedResult):
+        block = shared_memory.SharedMemory(name=result.data.name)
+        try:
+            data = bytes(block.buf[:result.data.size])
+        finally:
+            block.close()
+            block.unlink()
+        return EncodedImage(data, result.format, result.bbox)
+    return result
+
+
+def _init_worker(warm_up):
+    """Worker process start: configure every component from the app config and warm up the model."""
+    from app.app import app
+    from app.startup import warm_up_worker
+
+    # Workflows called in a worker process run in it
+    process_offload._worker = True
+    if warm_up:
+        warm_up_worker(app)
+
+
+def _ready():
+    return True
+
+
+def _run_in_worker(function, args, kwargs):
+    from app.metrics import metrics
+
+    args = tuple(value.read() if isinstance(value, SharedBytes) else value for value in args)
+    kwargs = {name: value.read() if isinstance(value, SharedBytes) else value for name, value in kwargs.items()}
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        # Stage timings of this process, merged by /metrics with those of the server
+        metrics.flush()
+    if isinstance(result, EncodedImage) and len(result.data) >= process_offload.shared_memory_min_bytes:
+        handle, block = SharedBytes.create(result.data)
+        # Unlinked by the server process once it has read the result
+        block.close()
+        return _SharedResult(handle, result.format, result.bbox)
+    return result
+
+
+# One pool per server process
+process_offload = ProcessOffload()
@@ -0,0 +1,37 @@
+from app.image_processing.image_io import decode_image, encode_image
+
+
+class ImagePipeline:
+    """
+    Chain of in-memory image stages.
+
+    Each stage is a callable that takes a PIL Image and returns a PIL Image,
+    e.g. BackgroundRemover().remove or a functools.partial of
+    BackgroundApplier().apply. The upload is decoded once, every stage works
+    on the decoded image and the result is encoded once, so nothing touches
+    the filesystem between stages.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, stage):
+        """
+        Append a stage to the pipeline.
+
+        :param name: Short stage name (used in logs and error messages)
+        :param stage: Callable taking and returning a PIL Image
+        :return: The pipeline, so calls can be chained
+        """
+        self.stages.append((name, stage))
+        return self
+
+    def run(self, image):
+        """Run every stage on an already decoded image."""
+        for _name, stage in self.stages:
+            image = stage(image)
+        return image
+
+    def process(self, data, format="PNG"):
+        """Decode `data`, run every stage and encode the result as `format`."""
+        return encode_image(self.run(decode_image(data)), format=format)
@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+from app.image_processing.encoders import FORMATS, EncodedImage
+from app.image_processing.lru_cache import LRUCache
+from app.image_processing.mask_cache import MB, digest_bytes
+
+
+class ResponseCache:
+    """
+    Per-worker cache of transform results, keyed by their ETag.
+
+    The ETag of a request is a digest of the workflow, the digests of its
+    uploads, its other parameters (asset ids, logo position, result), the
+    output options and a fingerprint of the config sections that change the
+    pixels (model, mask upsampling and edges, encoder settings). Identical
+    requests get the same ETag on every worker and host sharing the config:
+    a client or CDN sending it back as If-None-Match gets a 304 without any
+    work, and a hit in this LRU skips decoding, inference, compositing and
+    encoding. Responses carry `Cache-Control: public, max-age=max_age_seconds`.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, settings=None, fingerprint=None):
+        """
+        Apply the `response_cache` section of the app config.
+
+        :param settings: dict with optional keys enabled, memory_max_mb and max_age_seconds
+        :param fingerprint: JSON serialisable settings that change the output images, part of every ETag
+        """
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled", True))
+        self.max_age_seconds = int(settings.get("max_age_seconds", 86400))
+        self.memory = LRUCache(int(float(settings.get("memory_max_mb", 128)) * MB))
+        self.fingerprint = json.dumps(fingerprint, sort_keys=True, default=str)
+
+    def etag(self, workflow_name, args, kwargs, output):
+        """
+        ETag of a workflow call, without quotes.
+
+        :param args: Positional arguments of the workflow, uploads as bytes
+        :param kwargs: Keyword arguments of the workflow
+        :param output: The `output` argument; the Accept header only counts when the format is negotiated
+        """
+        output = dict(output or {})
+        if output.get("format") in FORMATS:
+            output.pop("accept", None)
+        material = json.dumps({
+            "workflow": workflow_name,
+            "args": [_digest(value) for value in args],
+            "kwargs": {name: _digest(value) for name, value in kwargs.items()},
+            "output": output,
+            "settings": self.fingerprint,
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()[:40]
+
+    def cache_control(self):
+        return f"public, max-age={self.max_age_seconds}"
+
+    def get(self, etag):
+        """The cached EncodedImage or JSON result of an ETag, or None."""
+        if not self.enabled:
+            return None
+        return self.memory.get(etag)
+
+    def put(self, etag, result):
+        if not self.enabled:
+            return
+        size = len(result) if isinstance(result, EncodedImage) else len(json.dumps(result))
+        self.memory.put(etag, result, size)
+
+    def stats(self):
+        """Cache counters, suitable for JSON responses."""
+        return {"enabled": self.enabled, **self.memory.stats()}
+
+
+def _digest(value):
+    return "sha256:" + digest_bytes(value) if isinstance(value, (bytes, bytearray)) else value
+
+
+# One response cache per worker, configured from the `response_cache` section
+response_cache = ResponseCache()
@@ -0,0 +1,167 @@
+"""
+Scratch space for request uploads and for backends that need a file path.
+
+werkzeug spools every multipart upload of a request over 500KB to a
+TemporaryFile on the root disk. The app's requests use ScratchRequest
+instead, whose uploads stay in memory up to `memory_max_mb` each and only
+then spill to `directory`, a tmpfs (/dev/shm) by default, so uploads
+never cause disk I/O. Spilled uploads are unlinked files that vanish with
+their handle. Named scratch files (path()) are prefixed with the pid of
+their worker and removed when the block exits; sweep() removes those a
+killed worker left behind. All scratch space a worker uses at the same
+time is capped at `max_mb`, beyond which new uploads are refused with 503.
+"""
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from flask import Request
+
+from app.image_processing.ingestion import UploadRejected
+from app.process_utils import pid_alive
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+DEFAULT_DIRECTORY = "/dev/shm/pixel-showroom"
+
+
+class ScratchFull(UploadRejected):
+    """Raised when a worker's scratch space cap is reached, answered with 503."""
+
+    def __init__(self, message, status=503):
+        super().__init__(message, status)
+
+
+class ScratchBuffers:
+    """Per-worker, size-capped scratch space: memory first, then a tmpfs directory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `scratch` section of the app config.
+
+        :param settings: dict with optional keys memory_max_mb (per buffer),
+                         directory and max_mb (per worker)
+        """
+        settings = settings or {}
+        self.memory_max_bytes = int(float(settings.get("memory_max_mb", 16)) * MB)
+        self.max_bytes = int(float(settings.get("max_mb", 512)) * MB)
+        directory = os.path.expanduser(settings.get("directory") or DEFAULT_DIRECTORY)
+        if not os.path.isdir(os.path.dirname(directory.rstrip(os.sep)) or os.sep):
+            # No /dev/shm (e.g. macOS): the platform's temp directory
+            directory = os.path.join(tempfile.gettempdir(), "pixel-showroom-scratch")
+        self.directory = directory
+
+    def in_use(self):
+        """Bytes of scratch space held by this worker."""
+        return self._in_use
+
+    def spooled(self):
+        """A file object kept in memory up to memory_max_mb, then spilled to the scratch directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        return _ScratchFile(self, self.memory_max_bytes, self.directory)
+
+    @contextmanager
+    def path(self, data=None, suffix=""):
+        """
+        A named file in the scratch directory, for backends that only accept paths.
+        The file is removed when the block exits.
+
+        :param data: Optional bytes the file is created with
+        :param suffix: File name suffix, e.g. ".png"
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex}{suffix}")
+        size = len(data) if data else 0
+        self.reserve(size)
+        try:
+            with open(path, "wb") as f:
+                if data:
+                    f.write(data)
+            yield path
+        finally:
+            if os.path.exists(path):
+                size = max(size, os.path.getsize(path))
+                os.remove(path)
+            self.release(size)
+
+    def reserve(self, size):
+        with self._lock:
+            if self._in_use + size > self.max_bytes:
+                raise ScratchFull(f"Too many uploads in progress, retry later "
+                                  f"({self.max_bytes / MB:g}MB scratch space per worker)")
+            self._in_use += size
+
+    def release(self, size):
+        with self._lock:
+            self._in_use = max(0, self._in_use - size)
+
+    def sweep(self):
+        """Remove the named scratch files of workers that no longer run, at worker start."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for name in names:
+            pid = name.split("-", 1)[0]
+            if pid.isdigit() and pid_alive(int(pid)):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info("Removed %d orphaned scratch files from %s", removed, self.directory)
+        return removed
+
+    def init_app(self, app):
+        """Spool the app's multipart uploads through this scratch space."""
+        app.request_class = ScratchRequest
+
+
+class ScratchRequest(Request):
+    """Flask request whose multipart uploads are spooled by scratch_buffers."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return scratch_buffers.spooled()
+
+
+class _ScratchFile(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile that counts the bytes written against the worker's cap until it is closed."""
+
+    def __init__(self, buffers, max_size, directory):
+        super().__init__(max_size=max_size, dir=directory)
+        self._buffers = buffers
+        self._reserved = 0
+
+    def write(self, s):
+        self._buffers.reserve(len(s))
+        self._reserved += len(s)
+        return super().write(s)
+
+    def writelines(self, iterable):
+        for line in iterable:
+            self.write(line)
+
+    def close(self):
+        self._buffers.release(self._reserved)
+        self._reserved = 0
+        super().close()
+
+    def __exit__(self, *exc_info):
+        # SpooledTemporaryFile.__exit__ closes the underlying file without calling close()
+        self.close()
+
+
+# One scratch space per worker process
+scratch_buffers = ScratchBuffers()
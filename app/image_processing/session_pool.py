@@ -0,0 +1,344 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from app.image_processing.backends import backends
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Friendly model names accepted in config/app-base.yml -> rembg session names
+SUPPORTED_MODELS = {
+    "u2net": "u2net",
+    "u2netp": "u2netp",
+    "isnet": "isnet-general-use",
+    "isnet-general-use": "isnet-general-use",
+    "silueta": "silueta",
+}
+
+# Model weights: fp32 (the published model) or int8 (a dynamically quantized copy of it)
+PRECISIONS = ("fp32", "int8")
+
+# Config name -> onnxruntime GraphOptimizationLevel
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class SessionPool:
+    """
+    Process-wide registry of rembg inference sessions.
+
+    Building a rembg session loads the onnx model (u2net.onnx is 168MB) and
+    initialises an onnxruntime InferenceSession, which takes seconds. The pool
+    builds one session per model per process and hands the same instance to
+    every BackgroundRemover call.
+    With gunicorn each worker owns its pool; sessions are created lazily on
+    first use or eagerly through warm_up().
+
+    The model is a variant of the configured one: its fp32 weights or a
+    dynamically int8-quantized copy (made once and kept next to it), graph
+    optimized at `graph_optimization`. With `optimized_model_dir` the
+    optimized graph is saved on first load and later sessions load it as
+    is, skipping the optimization passes. Sessions run on the configured
+    execution providers that are installed (e.g. OpenVINO), the CPU one
+    otherwise.
+
+    onnxruntime sessions own thread pools and cannot be carried over a fork,
+    but the model file can: preload() downloads and reads it once in the
+    gunicorn master, and every worker builds its session from those
+    copy-on-write shared bytes instead of reading (or racing to download)
+    the file again.
+    """
+
+    def __init__(self, model="u2net", intra_op_threads=0, inter_op_threads=0, providers=None):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._state = {}
+        self._model_bytes = {}
+        self.model = model
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.providers = providers
+        self.precision = "fp32"
+        self.graph_optimization = "all"
+        self.optimized_model_dir = None
+
+    def configure(self, settings=None):
+        """
+        Apply the `rembg` section of the app config.
+
+        :param settings: dict with optional keys model, precision (fp32 | int8),
+                         graph_optimization (disabled | basic | extended | all),
+                         optimized_model_dir, intra_op_threads, inter_op_threads
+                         and providers. 0 threads means "let onnxruntime decide".
+        """
+        settings = settings or {}
+        with self._lock:
+            self.model = settings.get("model", self.model)
+            self.intra_op_threads = int(
+                settings.get("intra_op_threads", self.intra_op_threads) or 0)
+            self.inter_op_threads = int(
+                settings.get("inter_op_threads", self.inter_op_threads) or 0)
+            self.providers = settings.get("providers", self.providers)
+            self.precision = settings.get("precision", self.precision)
+            self.graph_optimization = settings.get("graph_optimization", self.graph_optimization)
+            optimized_model_dir = settings.get("optimized_model_dir", self.optimized_model_dir)
+            self.optimized_model_dir = os.path.expanduser(optimized_model_dir) if optimized_model_dir else None
+            # Sessions built with the old settings are no longer valid
+            self._sessions.clear()
+            self._state.clear()
+            self._model_bytes.clear()
+        resolve_model_name(self.model)
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision '{self.precision}', choose one of {list(PRECISIONS)}")
+        if self.graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unsupported graph_optimization '{self.graph_optimization}', "
+                             f"choose one of {list(GRAPH_OPTIMIZATION_LEVELS)}")
+
+    def session_options(self, optimized=False):
+        """
+        Build the onnxruntime SessionOptions used for every new session.
+
+        :param optimized: The model is a saved optimized graph, skip the optimization passes
+        """
+        ort = backends.get("onnxruntime")
+        sess_opts = ort.SessionOptions()
+        level = "disabled" if optimized else self.graph_optimization
+        sess_opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[level])
+        if self.intra_op_threads:
+            sess_opts.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            sess_opts.inter_op_num_threads = self.inter_op_threads
+        return sess_opts
+
+    def get_session(self, model=None):
+        """
+        Return the shared session for `model` (defaults to the configured model),
+        creating it on first use.
+        """
+        model_name = resolve_model_name(model or self.model)
+        session = self._sessions.get(model_name)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(model_name)
+                if session is None:
+                    session = self._create_session(model_name)
+                    self._sessions[model_name] = session
+        # += on a shared dict loses counts between threads
+        with self._lock:
+            self._state[model_name]["uses"] += 1
+        metrics.inc("pixel_model_session_uses_total", model=model_name)
+        return session
+
+    def providers_in_use(self):
+        """The configured execution providers that are installed, in order; the CPU one if none is."""
+        available = backends.get("onnxruntime").get_available_providers()
+        if not self.providers:
+            return available
+        return [p for p in self.providers if p in available] or ["CPUExecutionProvider"]
+
+    def model_path(self, model_name):
+        """
+        The model file of the configured precision, downloaded (and quantized) first if needed.
+
+        int8 models are quantized from the fp32 file once and kept in optimized_model_dir,
+        or next to the fp32 file.
+        """
+        path = _session_class(model_name).download_models()
+        if self.precision == "fp32":
+            return path
+        quantized = os.path.join(self.optimized_model_dir or os.path.dirname(path), f"{model_name}.int8.onnx")
+        if not os.path.exists(quantized):
+            quantize_model(path, quantized)
+        return quantized
+
+    def optimized_model_path(self, model_name):
+        """Where the optimized graph of the model is saved, None if it is not."""
+        if not self.optimized_model_dir or self.graph_optimization == "disabled":
+            return None
+        # Optimizations at the "all" level depend on the onnxruntime version and the machine
+        ort_version = backends.get("onnxruntime").__version__
+        return os.path.join(self.optimized_model_dir,
+                            f"{model_name}.{self.precision}.{self.graph_optimization}.ort-{ort_version}.onnx")
+
+    def read_model(self, model_name):
+        """
+        The bytes sessions of `model_name` are built from: the saved optimized graph, made
+        from the model file if it does not exist yet, or the model file itself.
+
+        :return: (bytes, True if they are an optimized graph)
+        """
+        path = self.model_path(model_name)
+        optimized_path = self.optimized_model_path(model_name)
+        if optimized_path and not os.path.exists(optimized_path):
+            self._save_optimized(path, optimized_path)
+        if optimized_path:
+            path = optimized_path
+        with open(path, "rb") as f:
+            return f.read(), bool(optimized_path)
+
+    def preload(self, model=None):
+        """
+        Read the model file into memory (downloading, quantizing and optimizing it first
+        if needed), in the gunicorn master before the workers are forked. Sessions built
+        afterwards, in this process or a forked one, are created from these bytes.
+
+        :return: Size of the model in bytes
+        """
+        model_name = resolve_model_name(model or self.model)
+        started = time.perf_counter()
+        model_bytes = self.read_model(model_name)
+        with self._lock:
+            self._model_bytes[model_name] = model_bytes
+        logger.info("Preloaded model %s (%.0fMB) in %.3fs",
+                    model_name, len(model_bytes[0]) / 2 ** 20, time.perf_counter() - started)
+        return len(model_bytes[0])
+
+    def warm_up(self, model=None):
+        """
+        Load the model and run one inference on a blank image so the first real
+        request does not pay for onnxruntime's lazy initialisation.
+        """
+        model_name = resolve_model_name(model or self.model)
+        try:
+            session = self.get_session(model_name)
+            started = time.perf_counter()
+            session.predict(Image.new("RGB", (320, 320)))
+            state = self._state[model_name]
+            state["warmup_seconds"] = round(time.perf_counter() - started, 3)
+            state["warmed_up"] = True
+            logger.info("Model %s warmed up in %ss", model_name, state["warmup_seconds"])
+        except Exception as e:
+            self._state.setdefault(model_name, _new_state())["error"] = str(e)
+            logger.error("Model %s warm-up failed: %s", model_name, e)
+        return self.status(model_name)
+
+    def warm_up_async(self, model=None):
+        """Run warm_up() on a daemon thread so the caller can keep booting."""
+        thread = threading.Thread(
+            target=self.warm_up, args=(model,), name="rembg-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def params(self):
+        """Settings that change the inferred mask, for the mask cache key."""
+        return {"precision": self.precision, "graph_optimization": self.graph_optimization}
+
+    def status(self, model=None):
+        """Health of the configured (or given) model, suitable for JSON responses."""
+        model_name = resolve_model_name(model or self.model)
+        state = dict(self._state.get(model_name) or _new_state())
+        state["model"] = model_name
+        state["precision"] = self.precision
+        state["graph_optimization"] = self.graph_optimization
+        state["loaded"] = model_name in self._sessions
+        return state
+
+    def reset(self):
+        """Drop every session, e.g. in a freshly forked worker. Preloaded model bytes are kept."""
+        with self._lock:
+            self._sessions.clear()
+            self._state.clear()
+
+    def _create_session(self, model_name):
+        session_class = _session_class(model_name)
+        started = time.perf_counter()
+        try:
+            model_bytes, optimized = self._model_bytes.get(model_name) or self.read_model(model_name)
+            session = self._session_from_bytes(session_class, model_name, model_bytes, optimized)
+        except Exception as e:
+            self._state[model_name] = _new_state(error=str(e))
+            raise
+        state = _new_state()
+        state["load_seconds"] = round(time.perf_counter() - started, 3)
+        state["providers"] = session.providers
+        self._state[model_name] = state
+        metrics.inc("pixel_model_sessions_created_total", model=model_name)
+        logger.info("Loaded model %s in %ss", model_name, state["load_seconds"])
+        return session
+
+    def _session_from_bytes(self, session_class, model_name, model_bytes, optimized=False):
+        """A rembg session whose onnxruntime session is built from in-memory model bytes."""
+        # Same attributes as rembg's BaseSession.__init__, which only accepts a file path
+        session = session_class.__new__(session_class)
+        session.model_name = model_name
+        session.providers = self.providers_in_use()
+        session.inner_session = backends.get("onnxruntime").InferenceSession(
+            model_bytes, sess_options=self.session_options(optimized), providers=session.providers)
+        return session
+
+    def _save_optimized(self, model_path, optimized_path):
+        """Optimize the graph of `model_path` once and save it, for every later session to load as is."""
+        started = time.perf_counter()
+        os.makedirs(os.path.dirname(optimized_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(optimized_path), suffix=".onnx")
+        os.close(fd)
+        try:
+            sess_opts = self.session_options()
+            sess_opts.optimized_model_filepath = temp_path
+            backends.get("onnxruntime").InferenceSession(
+                model_path, sess_options=sess_opts, providers=self.providers_in_use())
+            # Other workers may be doing the same, the file appears complete or not at all
+            os.replace(temp_path, optimized_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.info("Saved the %s optimized graph of %s to %s in %.3fs", self.graph_optimization,
+                    model_path, optimized_path, time.perf_counter() - started)
+
+
+def quantize_model(model_path, quantized_path):
+    """
+    Write a copy of the onnx model at `model_path` with its weights dynamically quantized to int8.
+    Needs the onnx package, which onnxruntime's quantization tools are built on.
+    """
+    try:
+        quantization = backends.get("onnxruntime.quantization")
+    except ImportError as e:
+        raise RuntimeError(f"int8 precision needs the onnx package to quantize the model: {e}")
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(quantized_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(quantized_path), suffix=".onnx")
+    os.close(fd)
+    try:
+        quantization.quantize_dynamic(model_path, temp_path, weight_type=quantization.QuantType.QUInt8)
+        os.replace(temp_path, quantized_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info("Quantized %s to %s in %.3fs", model_path, quantized_path, time.perf_counter() - started)
+
+
+def _session_class(model_name):
+    return next(sc for sc in backends.get("rembg.sessions").sessions_class if sc.name() == model_name)
+
+
+def resolve_model_name(model):
+    """Map a configured model name to the rembg session name."""
+    try:
+        return SUPPORTED_MODELS[model]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported model '{model}', choose one of {sorted(SUPPORTED_MODELS)}")
+
+
+def _new_state(error=None):
+    return {
+        "warmed_up": False,
+        "load_seconds": None,
+        "warmup_seconds": None,
+        "uses": 0,
+        "error": error,
+    }
+
+
+# One pool per process, shared by every request handled by this worker
+session_pool = SessionPool()
@@ -0,0 +1,209 @@
+"""
+Bounded memory compositing of large photos onto a background.
+
+From `min_megapixels` up, apply_background and process_car_image with a
+background never build the full size cutout, fitted background and
+composite (4 bytes per pixel each, hundreds of MB for a 50MP studio shot).
+The photo is composited in bands of `band_rows` rows instead: each band of
+the car is cut out with its band of the mask, only that band of the
+background is resampled (BackgroundApplier.fit_background_rows) and the
+logo, fitted once, is blended where it overlaps the band. PNG results are
+filtered and deflated band by band as they are composited (PngWriter),
+other formats are written back into the decoded photo, which PIL then
+encodes. Besides the decoded photo and its mask, a request holds a few
+bands and its encoded output.
+"""
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.compositor import blend_over, cutout_in_place, from_rgba_pixels, rgba_pixels
+from app.image_processing.encoders import EncodedImage, output_encoder
+from app.image_processing.logo_adder import LogoAdder
+from app.metrics import metrics
+
+MEGAPIXEL = 1000 * 1000
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class TiledCompositor:
+    """Band by band compositing and encoding of photos from `min_megapixels` up."""
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `tiling` section of the app config.
+
+        :param settings: dict with optional keys min_megapixels (0 disables tiling) and band_rows
+        """
+        settings = settings or {}
+        self.min_pixels = int(float(settings.get("min_megapixels", 16)) * MEGAPIXEL)
+        self.band_rows = int(settings.get("band_rows", 64))
+
+    def applies(self, size):
+        """True if a photo of `size` is composited in bands."""
+        return self.min_pixels > 0 and size[0] * size[1] >= self.min_pixels
+
+    def composite(self, car, background, mask=None, logo=None, logo_position="top-right", output=None):
+        """
+        Composite a car onto a background, and optionally a logo on top, band by band, and encode the result.
+
+        :param car: Decoded photo (PIL Image); its pixels are overwritten by the result unless it is encoded as PNG
+        :param background: Background returned by BackgroundApplier.background_source()
+        :param mask: "L" mask the car is cut out with, None to use the car's own transparency
+        :param logo: Fitted RGBA logo (LogoAdder.fit_logo), or None
+        :param output: The `output` dict of the workflows (format, quality, accept)
+        :return: EncodedImage, with the background's ICC profile
+        """
+        output = output or {}
+        # The car covers part of the background at most, the result is opaque if the background is
+        mode = background.mode
+        format = output_encoder.choose_format(None, output.get("format"), output.get("accept"),
+                                              alpha=mode == "RGBA")
+        if logo is not None:
+            logo_offset = LogoAdder.position(logo_position, car.size, logo.size)
+            logo = np.asarray(logo)
+
+        if format == "png":
+            writer = PngWriter(car.size, mode, output_encoder.png_compress_level,
+                               background.info.get("icc_profile"))
+            result = None
+        else:
+            # Bands are written back once read, an opaque photo holds its own composite
+            result = car if car.mode == mode else Image.new(mode, car.size)
+        with metrics.stage("composite"):
+            for top in range(0, car.height, self.band_rows):
+                bottom = min(top + self.band_rows, car.height)
+                pixels = self._band(car, background, mask, top, bottom)
+                if logo is not None:
+                    blend_over(pixels, logo, (logo_offset[0], logo_offset[1] - top))
+                if result is None:
+                    writer.write(pixels)
+                else:
+                    result.paste(from_rgba_pixels(pixels, mode), (0, top))
+        if result is None:
+            with metrics.stage("encode"):
+                return EncodedImage(writer.close(), "png")
+        result.info = dict(background.info)
+        return output_encoder.encode(result, format, output.get("quality"), output.get("accept"))
+
+    @staticmethod
+    def _band(car, background, mask, top, bottom):
+        """Rows top to bottom of the car composited onto the background, as an RGBA array."""
+        box = (0, top, car.width, bottom)
+        rows = car.crop(box)
+        car_pixels = rgba_pixels(rows if rows.mode in ("RGB", "RGBA") else rows.convert("RGBA"))
+        if mask is not None:
+            cutout_in_place(car_pixels, np.asarray(mask.crop(box)))
+        pixels = rgba_pixels(BackgroundApplier.fit_background_rows(background, car.size, top, bottom))
+        return blend_over(pixels, car_pixels)
+
+
+class PngWriter:
+    """
+    PNG encoder fed with bands of rows. Each row is filtered with the filter
+    giving the smallest sum of absolute differences, as libpng and PIL
+    choose them, and deflated as it arrives, so the image is never held
+    whole: only its compressed chunks are.
+    """
+
+    def __init__(self, size, mode="RGB", compress_level=1, icc_profile=None):
+        """
+        :param mode: RGB or RGBA
+        :param compress_level: zlib level 0-9
+        :param icc_profile: Bytes of an ICC profile to embed
+        """
+        self.width, self.height = size
+        self.channels = 4 if mode == "RGBA" else 3
+        self.rows = 0
+        self._compressor = zlib.compressobj(compress_level)
+        # Filters of the first row refer to a row of zeros
+        self._previous = np.zeros(self.width * self.channels, dtype=np.uint8)
+        color_type = 6 if mode == "RGBA" else 2
+        self._chunks = [PNG_SIGNATURE,
+                        _chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, color_type, 0, 0, 0))]
+        if icc_profile:
+            self._chunks.append(_chunk(b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc_profile)))
+
+    def write(self, pixels):
+        """
+        Append rows to the image.
+
+        :param pixels: uint8 array hxWx4 (the alpha channel is dropped for RGB images) or hxWx3
+        """
+        rows = np.ascontiguousarray(pixels[..., :self.channels]).reshape(len(pixels), -1)
+        filtered = _filter_rows(rows, self._previous, self.channels)
+        self._previous = rows[-1].copy()
+        self.rows += len(rows)
+        data = self._compressor.compress(filtered)
+        if data:
+            self._chunks.append(_chunk(b"IDAT", data))
+
+    def close(self):
+        """The encoded PNG, once every row has been written."""
+        if self.rows != self.height:
+            raise ValueError(f"{self.rows} rows written to a PNG of {self.height} rows")
+        self._chunks.append(_chunk(b"IDAT", self._compressor.flush()))
+        self._chunks.append(_chunk(b"IEND", b""))
+        return b"".join(self._chunks)
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _filter_rows(rows, previous, channels):
+    """
+    Rows filtered for PNG, each prefixed with its filter type (0 None, 1 Sub, 2 Up, 3 Average, 4 Paeth).
+    Filters work on the unfiltered neighbours, so every row of the band is filtered at once.
+    """
+    height, stride = rows.shape
+    up = np.empty_like(rows)
+    up[0] = previous
+    up[1:] = rows[:-1]
+    left = np.zeros_like(rows)
+    left[:, channels:] = rows[:, :-channels]
+    up_left = np.zeros_like(rows)
+    up_left[:, channels:] = up[:, :-channels]
+
+    output = np.empty((height, stride + 1), dtype=np.uint8)
+    output[:, 0] = 0
+    best = output[:, 1:]
+    best[...] = rows
+    best_score = _score(rows)
+    for filter_type, candidate in ((1, lambda: rows - left),
+                                   (2, lambda: rows - up),
+                                   (3, lambda: rows - ((left.astype(np.uint16) + up) >> 1).astype(np.uint8)),
+                                   (4, lambda: rows - _paeth(left, up, up_left))):
+        filtered = candidate()
+        score = _score(filtered)
+        better = score < best_score
+        if better.any():
+            best[better] = filtered[better]
+            best_score[better] = score[better]
+            output[better, 0] = filter_type
+    return output
+
+
+def _score(filtered):
+    """Sum of the absolute values of the filtered bytes of each row, read as signed."""
+    return np.abs(filtered.view(np.int8).astype(np.int16)).sum(axis=1, dtype=np.int64)
+
+
+def _paeth(a, b, c):
+    """The Paeth predictor of every byte from its left (a), upper (b) and upper left (c) neighbours."""
+    a, b, c = (x.astype(np.int16) for x in (a, b, c))
+    pa = np.abs(b - c)
+    pb = np.abs(a - c)
+    pc = np.abs(a + b - 2 * c)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c)).astype(np.uint8)
+
+
+# One tiled compositor per process, configured from the `tiling` section
+tiled_compositor = TiledCompositor()
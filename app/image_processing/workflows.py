@@ -0,0 +1,293 @@
+"""
+Upload-bytes-in, encoded-image-out entry points for each transform route.
+They are shared by the synchronous routes and the asynchronous job runner.
+Each takes an optional `output` dict (format, quality, variant, accept, see
+encoders.OutputEncoder) and returns an encoders.EncodedImage.
+Undecodable uploads raise PIL.UnidentifiedImageError, uploads refused by
+the ingestion checks raise ingestion.UploadRejected, unknown asset ids
+raise asset_store.AssetNotFound.
+In offload worker processes the uploaded photo may arrive as a
+frame_ring.Frame already decoded by the server, which every stage then
+works on in place.
+Large photos given a background are composited and encoded band by band,
+see tiling.TiledCompositor.
+"""
+import contextvars
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+import numpy as np
+
+from app.image_processing.asset_store import ASSET_KINDS, asset_store
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.encoders import has_alpha, output_encoder
+from app.image_processing.frame_ring import Frame
+from app.image_processing.image_io import decode_image, to_image
+from app.image_processing.logo_adder import LogoAdder
+from app.image_processing.mask_cache import digest_bytes
+from app.image_processing.mask_codec import bounding_box, decode_mask, encode_polygons, encode_rle
+from app.image_processing.pipeline import ImagePipeline
+from app.image_processing.tiling import tiled_compositor
+
+
+# Asset kind -> size its fitted variant covers on an image of a given size
+FIT_SIZES = {
+    "logo": LogoAdder.logo_size,
+    "background": lambda image_size: image_size,
+}
+
+
+class SharedAsset:
+    """
+    A logo or background given either as uploaded bytes or as a registered asset id.
+    Fitted variants are computed once per image size: by the asset_store for
+    registered assets, locally for uploads (e.g. for a whole bulk photo set).
+    When the one image size it is used for is known up front, an uploaded
+    JPEG is only decoded at the scale its fitted variant needs.
+    """
+
+    def __init__(self, kind, data=None, asset_id=None, image_size=None):
+        self.kind = kind
+        self.asset_id = asset_id
+        self.image = None
+        if asset_id:
+            # Fail early on unknown ids
+            asset_store.get(asset_id)
+        elif data:
+            self.image = decode_image(data, FIT_SIZES[kind](image_size) if image_size else None)
+        self._fitted = {}
+        self._source = None
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.asset_id) or self.image is not None
+
+    def fitted(self, size):
+        """The asset fitted to an image of `size`. Do not modify it."""
+        if self.asset_id:
+            return asset_store.fitted(self.asset_id, size)
+        with self._lock:
+            if size not in self._fitted:
+                self._fitted[size] = ASSET_KINDS[self.kind](self.image, size)
+            return self._fitted[size]
+
+    def source(self):
+        """The background before fitting, to fit band by band (see tiling). Do not modify it."""
+        if self.asset_id:
+            return asset_store.source(self.asset_id)
+        with self._lock:
+            if self._source is None:
+                self._source = BackgroundApplier.background_source(self.image)
+            return self._source
+
+
+def _decode(image_data, output):
+    if isinstance(image_data, Frame):
+        # Decoded by the server process at the variant's size, see frame_ring
+        return image_data.pixels()
+    # Resized delivery variants are decoded straight at their size
+    return decode_image(image_data, max_size=output_encoder.max_size((output or {}).get('variant')))
+
+
+def _digest(image_data):
+    return image_data.digest if isinstance(image_data, Frame) else digest_bytes(image_data)
+
+
+def _size(image):
+    return (image.shape[1], image.shape[0]) if isinstance(image, np.ndarray) else image.size
+
+
+def _info(image_data):
+    return image_data.info if isinstance(image_data, Frame) else None
+
+
+def _encode(image, output, info=None):
+    """:param info: PIL info (ICC profile) of an image given as an array, e.g. of its frame"""
+    output = output or {}
+    if isinstance(image, np.ndarray):
+        image = to_image(image)
+        # Frames are RGBA, opaque ones are encoded without an alpha channel like decoded RGB photos
+        if image.mode == 'RGBA' and not has_alpha(image):
+            image = image.convert('RGB')
+        image.info.update(info or {})
+    return output_encoder.encode(image, output.get('format'), output.get('quality'), output.get('accept'))
+
+
+def remove_background(image_data, output=None):
+    """Remove the background of an uploaded image, returns an EncodedImage with the car's bounding box."""
+    image = _decode(image_data, output)
+    # The upload digest keys the mask cache, so re-uploads skip inference
+    pipeline = ImagePipeline().add_stage('remove_background', partial(
+        BackgroundRemover().remove, digest=_digest(image_data), in_place=isinstance(image_data, Frame)))
+    cutout = pipeline.run(image)
+    encoded = _encode(cutout, output)
+    encoded.bbox = bounding_box(cutout)
+    return encoded
+
+
+def background_mask(image_data, result='mask', output=None):
+    """
+    The background removal mask of an uploaded image, for clients that composite themselves.
+
+    :param result: 'mask' for a grayscale image (PNG unless another format is asked for),
+                   'rle' or 'polygon' for the mask thresholded at 50%, see mask_codec
+    :return: EncodedImage with the car's bounding box for 'mask', else a dict
+             of the encoding with the bounding box as 'bbox'
+    """
+    image = _decode(image_data, output)
+    mask = BackgroundRemover().mask(image, digest=_digest(image_data))
+    bbox = bounding_box(mask)
+    if result == 'rle':
+        return {**encode_rle(mask), 'bbox': bbox}
+    if result == 'polygon':
+        return {**encode_polygons(mask), 'bbox': bbox}
+    output = output or {}
+    encoded = output_encoder.encode(mask, output.get('format') or 'png', output.get('quality'))
+    encoded.bbox = bbox
+    return encoded
+
+
+def _tiled(image, background):
+    """True if `image` is composited onto `background` band by band instead of whole."""
+    # Shared frames are already decoded whole and composited in place
+    return bool(background) and not isinstance(image, np.ndarray) and tiled_compositor.applies(image.size)
+
+
+def _mask(mask_data, image):
+    """The uploaded mask for `image`, None to infer one."""
+    return decode_mask(mask_data, _size(image)) if mask_data else None
+
+
+def add_logo(image_data, logo_data=None, position='top-right', logo_id=None, output=None):
+    """Add an uploaded or registered logo to an uploaded image, returns an EncodedImage."""
+    image = _decode(image_data, output)
+    logo = SharedAsset('logo', logo_data, logo_id, _size(image))
+    # The decoded photo is ours: only the logo's bounding box is blended, no copy of the whole photo
+    in_place = isinstance(image_data, Frame) or image.mode in ('RGB', 'RGBA')
+    pipeline = ImagePipeline().add_stage('add_logo', partial(
+        LogoAdder().add, logo=logo.fitted(_size(image)), location=position, in_place=in_place))
+    return _encode(pipeline.run(image), output, _info(image_data))
+
+
+def apply_background(image_data, background_data=None, background_id=None, output=None, mask_data=None):
+    """
+    Apply an uploaded or registered background to an uploaded car cutout, returns an EncodedImage.
+    With `mask_data` (see mask_codec.decode_mask) the upload is the original photo, cut out with that mask.
+    """
+    image = _decode(image_data, output)
+    background = SharedAsset('background', background_data, background_id, _size(image))
+    if _tiled(image, background):
+        return tiled_compositor.composite(image, background.source(), mask=_mask(mask_data, image), output=output)
+    pipeline = ImagePipeline()
+    if mask_data:
+        pipeline.add_stage('remove_background', partial(
+            BackgroundRemover().remove, mask=_mask(mask_data, image), in_place=isinstance(image_data, Frame)))
+    pipeline.add_stage(
+        'apply_background', partial(BackgroundApplier().apply, background=background.fitted(_size(image))))
+    # Composited onto the background, which the result keeps the ICC profile of
+    return _encode(pipeline.run(image), output, background.fitted(_size(image)).info)
+
+
+def _tiled_car(car_image_data, car_image, logo, background, logo_position, output, mask=None):
+    """process_car_image of a large photo with a background: its mask, then every stage band by band."""
+    if mask is None:
+        # The upload digest keys the mask cache, so re-uploads skip inference
+        mask = BackgroundRemover().mask(car_image, digest=_digest(car_image_data))
+    return tiled_compositor.composite(car_image, background.source(), mask=mask,
+                                      logo=logo.fitted(car_image.size) if logo else None,
+                                      logo_position=logo_position, output=output)
+
+
+def _car_pipeline(car_image_data, car_image, logo, background, logo_position, mask=None):
+    # A shared frame is cut out in place. The logo is blended in place onto the frame, the new cutout
+    # or the new composite, whichever the earlier stages give
+    in_place = isinstance(car_image_data, Frame)
+    size = _size(car_image)
+
+    # Step 1: Remove the background from the car image, with the uploaded mask if any
+    # The upload digest keys the mask cache, so re-uploads skip inference
+    pipeline = ImagePipeline().add_stage('remove_background', partial(
+        BackgroundRemover().remove, digest=_digest(car_image_data), in_place=in_place, mask=mask))
+
+    # Step 2: If background is provided, apply it to the car image after background removal
+    if background:
+        pipeline.add_stage('apply_background', partial(
+            BackgroundApplier().apply, background=background.fitted(size)))
+
+    # Step 3: If logo is provided, add the logo to the car image (with background, if applied)
+    if logo:
+        pipeline.add_stage('add_logo', partial(
+            LogoAdder().add, logo=logo.fitted(size), location=logo_position, in_place=True))
+    return pipeline
+
+
+def _result_info(car_image, background):
+    # Cutouts carry no ICC profile, composites the background's
+    return background.fitted(_size(car_image)).info if background else None
+
+
+def process_car_image(car_image_data, logo_data=None, background_data=None, logo_position='top-right',
+                      logo_id=None, background_id=None, output=None, mask_data=None):
+    """
+    Remove the background of a car image, then optionally apply a background and add a logo.
+    The logo and background are either uploaded bytes or registered asset ids.
+    An uploaded `mask_data` (see mask_codec.decode_mask) is used instead of inferring the mask.
+    Returns an EncodedImage.
+    """
+    # Decode every upload once, all stages work on the decoded images
+    car_image = _decode(car_image_data, output)
+    background = SharedAsset('background', background_data, background_id, _size(car_image))
+    logo = SharedAsset('logo', logo_data, logo_id, _size(car_image))
+
+    if _tiled(car_image, background):
+        return _tiled_car(car_image_data, car_image, logo, background, logo_position, output,
+                          _mask(mask_data, car_image))
+    pipeline = _car_pipeline(car_image_data, car_image, logo, background, logo_position,
+                             _mask(mask_data, car_image))
+    return _encode(pipeline.run(car_image), output, _result_info(car_image, background))
+
+
+def process_car_images(car_images, logo_data=None, background_data=None, logo_position='top-right', max_parallel=4,
+                       logo_id=None, background_id=None, output=None):
+    """
+    Process a whole photo set that shares one logo and one background.
+
+    The logo and background are decoded once, and fitted once per distinct
+    photo size. Photos run on `max_parallel` threads, so their background
+    removals reach the batching inference engine together. At most
+    `max_parallel` photos are decoded or held at any time.
+
+    :param car_images: Iterable of (name, loader) pairs, loader() returns the uploaded bytes
+    :return: Generator of (name, EncodedImage, error) in completion order,
+             error is the exception of a photo that failed (its image is then None)
+    """
+    background = SharedAsset('background', background_data, background_id)
+    logo = SharedAsset('logo', logo_data, logo_id)
+
+    def process(loader):
+        car_image_data = loader()
+        car_image = _decode(car_image_data, output)
+        if _tiled(car_image, background):
+            return _tiled_car(car_image_data, car_image, logo, background, logo_position, output)
+        pipeline = _car_pipeline(car_image_data, car_image, logo, background, logo_position)
+        return _encode(pipeline.run(car_image), output, _result_info(car_image, background))
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='bulk') as executor:
+        pending = {}
+        car_images = iter(car_images)
+        while True:
+            # Keep at most max_parallel photos in flight
+            for name, loader in car_images:
+                # In the request's context, so stage timings are attributed to its route and trace
+                pending[executor.submit(contextvars.copy_context().run, process, loader)] = name
+                if len(pending) >= max_parallel:
+                    break
+            if not pending:
+                return
+            done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                error = future.exception()
+                yield name, None if error else future.result(), error
@@ -0,0 +1,388 @@
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+
+from app.process_utils import pid_alive
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    callback_url TEXT,
+    result_url TEXT,
+    result BLOB,
+    result_mimetype TEXT,
+    result_extension TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_queue_order ON jobs (status, priority, created_at);
+CREATE TABLE IF NOT EXISTS job_inputs (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+# Columns added since the first release, created on databases that predate them
+ADDED_COLUMNS = (
+    ("jobs", "result_mimetype", "TEXT"),
+    ("jobs", "result_extension", "TEXT"),
+)
+
+
+class JobQueueFull(Exception):
+    """Raised by JobManager.submit when max_queue_depth jobs are already waiting."""
+
+    def __init__(self, queued, retry_after):
+        super().__init__(f"Job queue is full ({queued} jobs waiting)")
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+class CallbackRejected(ValueError):
+    """Raised for callback URLs that resolve to private, loopback or link-local addresses."""
+
+
+class JobManager:
+    """
+    SQLite backed job queue for long-running image processing.
+
+    Every gunicorn worker shares the same database file, so a job can be
+    submitted to one worker, executed by whichever worker is free and polled
+    through any worker. Each worker runs `worker_threads` executor threads
+    that claim the highest priority (lowest number), oldest queued job.
+    The number of queued jobs is capped at max_queue_depth; beyond that
+    submit() raises JobQueueFull so the route can answer 429 instead of
+    holding a request thread until it times out.
+    Callbacks are only sent to public addresses (or the configured
+    callback_allowed_hosts), so a callback_url cannot make the worker POST to
+    the instance metadata service or other internal endpoints.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._last_cleanup = 0
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `jobs` section of the app config.
+
+        :param settings: dict with optional keys db_path, worker_threads, max_queue_depth,
+                         result_ttl_seconds, poll_interval_seconds, retry_after_seconds,
+                         callback_timeout_seconds and callback_allowed_hosts (host names
+                         that may resolve to private addresses, e.g. an internal webhook)
+        """
+        settings = settings or {}
+        self.db_path = settings.get("db_path", "/tmp/pixel-showroom/jobs.sqlite3")
+        self.worker_threads = int(settings.get("worker_threads", 1))
+        self.max_queue_depth = int(settings.get("max_queue_depth", 32))
+        self.result_ttl_seconds = int(settings.get("result_ttl_seconds", 3600))
+        self.poll_interval_seconds = float(settings.get("poll_interval_seconds", 0.5))
+        self.retry_after_seconds = int(settings.get("retry_after_seconds", 10))
+        self.callback_timeout_seconds = float(settings.get("callback_timeout_seconds", 10))
+        self.callback_allowed_hosts = {host.lower() for host in settings.get("callback_allowed_hosts") or ()}
+        self._initialized = False
+
+    def register(self, kind, handler, download_name, mimetype="image/png"):
+        """
+        Register a job kind.
+
+        :param handler: Callable invoked as handler(**inputs, **params) that returns the result bytes,
+                        or an object with data, mimetype and extension attributes (encoders.EncodedImage)
+        :param download_name: File name used when the result is downloaded, its extension is
+                              replaced by the one the handler returned
+        :param mimetype: Mimetype of results returned as plain bytes
+        """
+        self._handlers[kind] = (handler, download_name, mimetype)
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    def submit(self, kind, inputs, params=None, priority=5, callback_url=None, result_url=None, job_id=None):
+        """
+        Queue a job and return its id.
+
+        :param inputs: dict of name -> uploaded bytes (None values are passed through)
+        :param params: JSON serialisable keyword arguments for the handler
+        :param priority: 0 (most urgent) to 9, lower numbers run first
+        :param callback_url: Optional URL that receives a POST with the job status when it finishes
+        :param result_url: URL of the result endpoint, included in the callback payload
+        :param job_id: Id to use, defaults to new_job_id()
+        :raises JobQueueFull: When max_queue_depth jobs are already queued
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job_id = job_id or self.new_job_id()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queue_depth:
+                conn.execute("ROLLBACK")
+                raise JobQueueFull(queued, self.retry_after_seconds)
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, params, callback_url, result_url, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, priority, json.dumps(params or {}),
+                 callback_url, result_url, time.time()))
+            conn.executemany(
+                "INSERT INTO job_inputs (job_id, name, data) VALUES (?, ?, ?)",
+                [(job_id, name, data) for name, data in inputs.items()])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.start()
+        self._wake_up.set()
+        return job_id
+
+    def check_callback_url(self, url):
+        """
+        Validate a callback URL against the addresses its host resolves to now.
+
+        :raises CallbackRejected: For non-http(s) URLs and hosts that resolve to a private,
+                                  loopback, link-local, reserved or multicast address,
+                                  unless the host is in callback_allowed_hosts
+        """
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        if parts.scheme not in ("http", "https") or not host:
+            raise CallbackRejected(f"Callback URL {url} is not an http(s) URL")
+        if host in self.callback_allowed_hosts:
+            return
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None)}
+        except (socket.gaierror, UnicodeError) as e:
+            raise CallbackRejected(f"Callback host {host} does not resolve: {e}")
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split("%", 1)[0])
+            if not ip.is_global or ip.is_multicast:
+                raise CallbackRejected(f"Callback host {host} resolves to the non-public address {ip}")
+
+    def get(self, job_id):
+        """Status of a job as a dict (without the result bytes), or None if unknown or expired."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, kind, status, priority, error, created_at, started_at, finished_at,"
+                " (SELECT COUNT(*) FROM jobs q WHERE q.status = 'queued' AND"
+                "  (q.priority < j.priority OR (q.priority = j.priority AND q.created_at < j.created_at)))"
+                " FROM jobs j WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "kind", "status", "priority", "error",
+                        "created_at", "started_at", "finished_at", "queue_position"), row))
+        if job["status"] != QUEUED:
+            job.pop("queue_position")
+        return job
+
+    def result(self, job_id):
+        """Return (result bytes, mimetype, download name) of a succeeded job, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT kind, result, result_mimetype, result_extension FROM jobs WHERE id = ? AND status = ?",
+                (job_id, SUCCEEDED)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        kind, result, result_mimetype, result_extension = row
+        _handler, download_name, mimetype = self._handlers[kind]
+        if result_extension:
+            download_name = os.path.splitext(download_name)[0] + result_extension
+        return result, result_mimetype or mimetype, download_name
+
+    def stats(self):
+        """Number of jobs per status, suitable for JSON responses."""
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        finally:
+            conn.close()
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+
+    def start(self):
+        """Start this process' executor threads (again, after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._requeue_orphans()
+            self._threads = [
+                threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.worker_threads)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._add_columns(conn)
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def _add_columns(conn):
+        for table, column, column_type in ADDED_COLUMNS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column in columns:
+                continue
+            try:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            except sqlite3.OperationalError as e:
+                # Another worker added it first
+                if "duplicate column" not in str(e):
+                    raise
+
+    def _requeue_orphans(self):
+        """Put jobs back in the queue whose worker process died while running them."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, worker_pid FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for job_id, pid in rows:
+                if not pid_alive(pid):
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_pid = NULL WHERE id = ? AND status = ?",
+                        (QUEUED, job_id, RUNNING))
+        finally:
+            conn.close()
+
+    def _claim(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, kind, params FROM jobs WHERE status = ?"
+                " ORDER BY priority, created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, started_at = ? WHERE id = ?",
+                (RUNNING, os.getpid(), time.time(), row[0]))
+            inputs = dict(conn.execute(
+                "SELECT name, data FROM job_inputs WHERE job_id = ?", (row[0],)).fetchall())
+            conn.execute("COMMIT")
+            return row[0], row[1], json.loads(row[2]), inputs
+        finally:
+            conn.close()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                logger.error("Could not claim a job: %s", e)
+                claimed = None
+            if claimed is None:
+                self._cleanup()
+                self._wake_up.wait(self.poll_interval_seconds)
+                self._wake_up.clear()
+                continue
+            self._execute(*claimed)
+
+    def _execute(self, job_id, kind, params, inputs):
+        handler = self._handlers[kind][0]
+        mimetype = extension = None
+        try:
+            result = handler(**inputs, **params)
+            # Encoded images carry their own mimetype and file extension
+            mimetype, extension = getattr(result, "mimetype", None), getattr(result, "extension", None)
+            result = getattr(result, "data", result)
+            status, error = SUCCEEDED, None
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, kind)
+            result, status, error = None, FAILED, str(e)
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, result_mimetype = ?, result_extension = ?,"
+                " error = ?, finished_at = ? WHERE id = ?",
+                (status, result, mimetype, extension, error, time.time(), job_id))
+            # Inputs are no longer needed once the job has run
+            conn.execute("DELETE FROM job_inputs WHERE job_id = ?", (job_id,))
+            row = conn.execute(
+                "SELECT callback_url, result_url FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        if row and row[0]:
+            self._notify(row[0], {"job_id": job_id, "status": status,
+                                  "error": error, "result_url": row[1] if status == SUCCEEDED else None})
+
+    def _notify(self, callback_url, payload):
+        try:
+            # Checked again when sending: the host may resolve differently than at submission
+            self.check_callback_url(callback_url)
+            # Redirects could lead to an internal address
+            requests.post(callback_url, json=payload, timeout=self.callback_timeout_seconds,
+                          allow_redirects=False)
+        except CallbackRejected as e:
+            logger.warning("Callback for job %s not sent: %s", payload["job_id"], e)
+        except requests.RequestException as e:
+            logger.warning("Callback to %s for job %s failed: %s", callback_url, payload["job_id"], e)
+
+    def _cleanup(self):
+        """Delete finished jobs older than result_ttl_seconds, at most once a minute."""
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, now - self.result_ttl_seconds))
+        except sqlite3.Error as e:
+            logger.warning("Could not expire old jobs: %s", e)
+        finally:
+            conn.close()
+
+
+# One manager per process, the queue itself lives in the shared database
+job_manager = JobManager()
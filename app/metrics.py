@@ -0,0 +1,316 @@
+"""
+Prometheus-style metrics shared by every gunicorn worker on the host.
+
+Each worker records counters, gauges and histograms in memory and writes a
+snapshot of them to `directory` at most every `flush_interval_seconds`;
+/metrics merges the snapshots of all live workers. Image processing code
+times its stages (decode, inference, resize, composite, encode) with
+metrics.stage(); requests are timed per route by the hooks init_app()
+installs, which also tag every request with an id. Stage timings of a
+request are logged with that id (and sent back as a Server-Timing header)
+when it carries `X-Trace: 1`, or for every request with `trace: true`.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from app.process_utils import pid_alive
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("app.trace")
+
+# Upper bounds in seconds, from a cached mask lookup to a 12MP bulk photo
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Name -> (type, help) of every metric
+METRICS = {
+    "pixel_requests_total": ("counter", "Requests handled, by route and status code"),
+    "pixel_request_duration_seconds": ("histogram", "Request latency by route"),
+    "pixel_stage_duration_seconds": ("histogram", "Image processing stage latency by stage and route"),
+    "pixel_requests_in_flight": ("gauge", "Requests being handled"),
+    "pixel_inference_queue_depth": ("gauge", "Images waiting for a batched inference run"),
+    "pixel_admission_decisions_total": ("counter", "Transform requests admitted or refused with 429, by route "
+                                                   "and decision (admitted, over_capacity, rate_limited)"),
+    "pixel_admission_cost_in_flight": ("gauge", "Estimated cost of the transform requests being processed"),
+    "pixel_admission_capacity": ("gauge", "Cost the workers admit at the same time"),
+    "pixel_jobs": ("gauge", "Jobs in the shared queue by status"),
+    "pixel_model_sessions_created_total": ("counter", "onnxruntime sessions built, by model"),
+    "pixel_model_session_uses_total": ("counter", "Times a pooled session was handed out, by model"),
+}
+
+# Trace of the current request: {"id", "route", "stages": [(stage, seconds)] or None}
+_request = contextvars.ContextVar("pixel_request", default=None)
+
+
+class Metrics:
+    """Per-worker metric registry with a shared on-disk aggregation directory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._per_worker_gauges = {}
+        self._global_gauges = {}
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `metrics` section of the app config.
+
+        :param settings: dict with optional keys directory, flush_interval_seconds,
+                         buckets (histogram upper bounds in seconds) and trace
+        """
+        settings = settings or {}
+        self.directory = os.path.expanduser(settings.get("directory") or "/tmp/pixel-showroom/metrics")
+        self.flush_interval_seconds = float(settings.get("flush_interval_seconds", 1))
+        self.buckets = tuple(float(b) for b in settings.get("buckets", DEFAULT_BUCKETS))
+        self.trace = bool(settings.get("trace", False))
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+        self._last_flush = 0
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name, value, **labels):
+        """Add `value` (may be negative) to a gauge."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record one observation in a histogram."""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def register_gauge(self, name, read, per_worker=True):
+        """
+        A gauge read when metrics are collected.
+
+        :param read: Callable returning a number, or a dict of label dict (as a tuple of
+                     (name, value) pairs) -> number
+        :param per_worker: Summed across workers if True, else read by the scraping worker only
+                           (for state every worker shares, like the job queue)
+        """
+        (self._per_worker_gauges if per_worker else self._global_gauges)[name] = read
+
+    @contextmanager
+    def stage(self, name):
+        """Time an image processing stage, and add it to the trace of the current request."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            request = _request.get()
+            self.observe("pixel_stage_duration_seconds", seconds, stage=name,
+                         route=request["route"] if request else "background")
+            if request and request["stages"] is not None:
+                request["stages"].append((name, seconds))
+
+    def init_app(self, app):
+        """Install the request hooks: request ids, per-route latency, in-flight requests and traces."""
+        from flask import g, request
+
+        @app.before_request
+        def start_request():
+            g.metrics_started = time.perf_counter()
+            traced = self.trace or request.headers.get("X-Trace") == "1"
+            g.metrics_request = {
+                "id": request.headers.get("X-Request-ID") or uuid.uuid4().hex,
+                "route": request.url_rule.rule if request.url_rule else "unmatched",
+                "stages": [] if traced else None,
+            }
+            _request.set(g.metrics_request)
+            self.add("pixel_requests_in_flight", 1)
+
+        @app.after_request
+        def tag_response(response):
+            state = g.get("metrics_request")
+            if state is None:
+                return response
+            response.headers["X-Request-ID"] = state["id"]
+            g.metrics_status = response.status_code
+            # Stages of a streamed response run after this, they are only logged
+            if state["stages"]:
+                response.headers["Server-Timing"] = ", ".join(
+                    f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in state["stages"])
+            return response
+
+        @app.teardown_request
+        def finish_request(_error=None):
+            # Popped: a streamed response is torn down again when its stream ends
+            state = g.pop("metrics_request", None)
+            if state is None:
+                return
+            seconds = time.perf_counter() - g.metrics_started
+            self.add("pixel_requests_in_flight", -1)
+            self.observe("pixel_request_duration_seconds", seconds, route=state["route"])
+            self.inc("pixel_requests_total", route=state["route"], status=str(g.get("metrics_status", 500)))
+            if state["stages"] is not None:
+                trace_logger.info("request_id=%s route=%s total_ms=%.1f %s", state["id"], state["route"],
+                                  seconds * 1000, " ".join(f"{stage}_ms={s * 1000:.1f}"
+                                                           for stage, s in state["stages"]))
+            _request.set(None)
+            self.flush()
+
+    def snapshot(self):
+        """This worker's metrics as a JSON serialisable dict."""
+        gauges = {}
+        for name, read in self._per_worker_gauges.items():
+            for labels, value in _read_gauge(read).items():
+                gauges[(name, labels)] = value
+        with self._lock:
+            gauges.update(self._gauges)
+            return {
+                "pid": os.getpid(),
+                "buckets": list(self.buckets),
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+                "histograms": [[name, labels, counts[:], total, count]
+                               for (name, labels), (counts, total, count) in self._histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this worker's snapshot to the shared directory, at most every flush_interval_seconds."""
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval_seconds:
+            return
+        self._last_flush = now
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, os.path.join(self.directory, f"{os.getpid()}.json"))
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", self.directory, e)
+
+    def clear_directory(self):
+        """Drop the snapshots of a previous server run, called by the gunicorn master at startup."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def collect(self):
+        """Metrics of every live worker merged, in the Prometheus text exposition format."""
+        self.flush(force=True)
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = (name, _labels(dict(labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, _labels(dict(labels)))
+                gauges[key] = gauges.get(key, 0) + value
+            if snapshot["buckets"] != list(self.buckets):
+                continue
+            for name, labels, counts, total, count in snapshot["histograms"]:
+                key = (name, _labels(dict(labels)))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        for name, read in self._global_gauges.items():
+            for labels, value in _read_gauge(read).items():
+                gauges[(name, labels)] = value
+        return self._format(counters, gauges, histograms)
+
+    def _snapshots(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            if not pid_alive(int(name[:-5]) if name[:-5].isdigit() else 0):
+                # Worker restarted: its counters reset like those of a restarted process
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def _format(self, counters, gauges, histograms):
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = {"counter": counters, "gauge": gauges, "histogram": histograms}[kind]
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in keys:
+                labels = key[1]
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_number(series[key])}")
+                    continue
+                counts, total, count = series[key]
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += bucket_count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(f"{name}_bucket{_format_labels((*labels, ('le', le)))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def current_request_id():
+    """Id of the request being handled on this thread (or copied context), None outside requests."""
+    request = _request.get()
+    return request["id"] if request else None
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _read_gauge(read):
+    value = read()
+    if isinstance(value, dict):
+        return {_labels(dict(labels)): v for labels, v in value.items()}
+    return {(): value}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
+
+
+# One registry per process; /metrics merges those of every worker
+metrics = Metrics()
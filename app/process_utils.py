@@ -0,0 +1,15 @@
+"""Helpers about the other processes of the host (workers, offload processes, job runners)."""
+import os
+
+
+def pid_alive(pid):
+    """True if a process with this pid exists, whoever owns it. False for pid 0 or None."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,311 @@
+"""
+Opt-in profiling of live workers, behind an admin token.
+
+Three tools, served by the /api/v1/admin routes (see routes/admin.py) to
+requests carrying the token in `X-Admin-Token`:
+
+- Stack sampling: sample() records the Python stack of every thread of the
+  worker that serves the call every `interval` seconds for a few seconds,
+  and returns them in the collapsed format of flamegraph.pl and speedscope
+  (`thread;outer (file:line);...;inner (file:line) count`).
+- Per-request cProfile: a fraction `sample_rate` of requests, and requests
+  of admins sent with `X-Profile: 1`, run under cProfile. Their profiles
+  are saved as pstats files in `directory`, which every worker on the host
+  shares, and are named by the X-Profile-ID header of the response. One
+  request per worker is profiled at a time (Python 3.12 allows a single
+  active profiler per process): others arriving meanwhile are not.
+- tracemalloc: snapshots of the top allocating lines of the worker, each
+  compared with the previous one. numpy buffers are traced, PIL's are not.
+
+Both profilers see the threads of the worker they run in. With
+offload.enabled, the workflows run in the offload pool's processes, so a
+worker shows its request threads waiting on the pool.
+"""
+import cProfile
+import hmac
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Leaf frames of threads waiting for work (gunicorn's idle threads, the job executor), left out of samples
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("socket.py", "accept"),
+}
+
+
+class ProfilerBusy(Exception):
+    """Raised by Profiler.sample while another sampling runs in the worker."""
+
+
+class Profiler:
+    """Stack sampler, per-request cProfile capture and tracemalloc snapshots of a worker process."""
+
+    def __init__(self):
+        self._sampling = threading.Lock()
+        # Held by the request being profiled
+        self._profiling = threading.Lock()
+        self._baseline = None
+        self._short_names = {}
+        self.configure()
+
+    def configure(self, settings=None):
+        """
+        Apply the `profiling` section of the app config.
+
+        :param settings: dict with optional keys enabled, admin_token_env (or admin_token), sample_rate,
+                         directory, max_profiles, max_sample_seconds and tracemalloc_frames
+        """
+        settings = settings or {}
+        self.enabled = bool(settings.get("enabled", False))
+        self.admin_token = settings.get("admin_token") or os.environ.get(
+            settings.get("admin_token_env", "PIXEL_ADMIN_TOKEN"), "")
+        if self.enabled and not self.admin_token:
+            logger.warning("Profiling is enabled without an admin token, its routes stay disabled")
+        self.sample_rate = float(settings.get("sample_rate", 0))
+        self.directory = os.path.expanduser(settings.get("directory") or "/tmp/pixel-showroom/profiles")
+        self.max_profiles = int(settings.get("max_profiles", 200))
+        self.max_sample_seconds = float(settings.get("max_sample_seconds", 60))
+        frames = int(settings.get("tracemalloc_frames", 0))
+        if self.enabled and frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def is_admin(self, request):
+        """True if a Flask request carries the admin token, and profiling is enabled."""
+        token = request.headers.get("X-Admin-Token", "")
+        return self.enabled and bool(self.admin_token) and hmac.compare_digest(token, self.admin_token)
+
+    def init_app(self, app):
+        """Install the request hooks running sampled and requested requests under cProfile."""
+        from flask import g, request
+
+        @app.before_request
+        def start_profile():
+            if not self.enabled:
+                return
+            requested = request.headers.get("X-Profile") == "1" and self.is_admin(request)
+            if not (requested or (self.sample_rate > 0 and random.random() < self.sample_rate)):
+                return
+            if not self._profiling.acquire(blocking=False):
+                return
+            # cProfile follows the thread it is enabled in, i.e. this request's
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another profiler is active in the process (sys.monitoring, Python >= 3.12)
+                self._profiling.release()
+                logger.warning("Could not profile the request: %s", e)
+                return
+            g.profile = (uuid.uuid4().hex, profile, time.perf_counter())
+
+        @app.after_request
+        def tag_profile(response):
+            if g.get("profile") is not None:
+                response.headers["X-Profile-ID"] = g.profile[0]
+            return response
+
+        @app.teardown_request
+        def save_profile(_error=None):
+            # Popped: a streamed response is torn down again when its stream ends
+            state = g.pop("profile", None)
+            if state is None:
+                return
+            profile_id, profile, started = state
+            profile.disable()
+            self._profiling.release()
+            metadata = {
+                "profile_id": profile_id,
+                "route": request.url_rule.rule if request.url_rule else "unmatched",
+                "method": request.method,
+                "pid": os.getpid(),
+                "seconds": round(time.perf_counter() - started, 4),
+                "created_at": time.time(),
+            }
+            try:
+                self._save(profile, metadata)
+            except OSError as e:
+                logger.warning("Could not save profile %s to %s: %s", profile_id, self.directory, e)
+
+    def sample(self, seconds, interval=0.01, idle=False):
+        """
+        Sample the stacks of every other thread of this process.
+
+        :param seconds: How long to sample, at most max_sample_seconds
+        :param interval: Seconds between samples
+        :param idle: Keep threads waiting for work (see IDLE_FRAMES)
+        :return: (collapsed stacks, one per line and most frequent first; number of samples taken)
+        :raises ProfilerBusy: While another sampling runs in this worker
+        """
+        if not self._sampling.acquire(blocking=False):
+            raise ProfilerBusy("Another sampling is running in this worker, retry later")
+        try:
+            counts = {}
+            samples = 0
+            own = threading.get_ident()
+            deadline = time.monotonic() + min(seconds, self.max_sample_seconds)
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = self._stack(frame)
+                    if not idle and stack[-1][0] in IDLE_FRAMES:
+                        continue
+                    key = ";".join([names.get(ident, str(ident)), *(label for _leaf, label in stack)])
+                    counts[key] = counts.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self._sampling.release()
+        lines = sorted(counts.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in lines), samples
+
+    def _stack(self, frame):
+        """[((file name, function), label)] of a frame and its callers, outermost first."""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            name = self._short_name(code.co_filename)
+            stack.append(((os.path.basename(name), code.co_name), f"{code.co_name} ({name}:{code.co_firstlineno})"))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _short_name(self, filename):
+        """A source path relative to the sys.path entry it is imported from."""
+        short = self._short_names.get(filename)
+        if short is None:
+            short = filename
+            for root in sys.path:
+                if root and filename.startswith(root.rstrip(os.sep) + os.sep):
+                    candidate = filename[len(root.rstrip(os.sep)) + 1:]
+                    if len(candidate) < len(short):
+                        short = candidate
+            self._short_names[filename] = short
+        return short
+
+    def profiles(self):
+        """Metadata of the saved request profiles, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        profiles = []
+        for name in names:
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(profiles, key=lambda profile: -profile.get("created_at", 0))
+
+    def profile_path(self, profile_id):
+        """Path of a saved pstats file, None if there is no such profile."""
+        # Ids come from URLs, never let them escape the profile directory
+        if os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.prof")
+        return path if os.path.exists(path) else None
+
+    def profile_text(self, profile_id, sort="cumulative", limit=50):
+        """pstats report of a saved profile, its `limit` top functions by `sort`; None if unknown."""
+        path = self.profile_path(profile_id)
+        if path is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def _save(self, profile, metadata):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = metadata["profile_id"]
+        profile.create_stats()
+        for extension, write in ((".prof", lambda f: f.write(_marshal(profile))),
+                                 (".json", lambda f: f.write(json.dumps(metadata).encode()))):
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp_path, os.path.join(self.directory, profile_id + extension))
+        # The oldest profiles make room for new ones
+        for old in self.profiles()[self.max_profiles:]:
+            for extension in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, old["profile_id"] + extension))
+                except FileNotFoundError:
+                    pass
+
+    def start_tracemalloc(self, frames=1):
+        """Start tracing allocations, with `frames` frames per traceback. Already tracing is left as is."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._baseline = None
+        return self.tracemalloc_status()
+
+    def stop_tracemalloc(self):
+        tracemalloc.stop()
+        self._baseline = None
+
+    def tracemalloc_status(self):
+        traced, peak = tracemalloc.get_traced_memory()
+        return {"tracing": tracemalloc.is_tracing(), "frames": tracemalloc.get_traceback_limit(),
+                "pid": os.getpid(), "traced_kb": round(traced / 1024, 1), "peak_kb": round(peak / 1024, 1)}
+
+    def top_allocations(self, limit=25, group_by="lineno"):
+        """
+        The `limit` top allocation sites of a new snapshot, with their growth since the previous one.
+
+        :param group_by: lineno, filename or traceback
+        :return: dict of tracemalloc_status() and `top`, None when not tracing
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        if self._baseline is None:
+            stats = snapshot.statistics(group_by)
+        else:
+            stats = snapshot.compare_to(self._baseline, group_by)
+        self._baseline = snapshot
+        top = []
+        for stat in stats[:limit]:
+            entry = {
+                "file": self._short_name(stat.traceback[0].filename),
+                "line": stat.traceback[0].lineno,
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+                "size_diff_kb": round(getattr(stat, "size_diff", stat.size) / 1024, 1),
+            }
+            if group_by == "traceback":
+                entry["traceback"] = [f"{self._short_name(frame.filename)}:{frame.lineno}"
+                                      for frame in stat.traceback]
+            top.append(entry)
+        return {**self.tracemalloc_status(), "top": top}
+
+
+def _marshal(profile):
+    """The stats of a disabled cProfile.Profile in the pstats file format (what dump_stats writes)."""
+    return marshal.dumps(profile.stats)
+
+
+# One profiler per worker process, configured from the `profiling` section
+profiler = Profiler()
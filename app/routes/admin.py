@@ -0,0 +1,140 @@
+import os
+from functools import wraps
+
+from flask import Response, request, send_file
+from flask_restx import Namespace, Resource, inputs, reqparse
+
+from app.profiling import ProfilerBusy, profiler
+
+# Define the admin namespace
+api = Namespace(
+    'Admin', description='Profiling of live workers, for requests carrying the X-Admin-Token header', path='/admin')
+
+
+def admin_only(method):
+    """Answer 404 while profiling is disabled and 403 to requests without the admin token."""
+    @wraps(method)
+    def check(*args, **kwargs):
+        if not profiler.enabled or not profiler.admin_token:
+            return {"error": "Not found"}, 404
+        if not profiler.is_admin(request):
+            return {"error": "Admin token required"}, 403
+        return method(*args, **kwargs)
+    return check
+
+
+sample_parser = reqparse.RequestParser()
+sample_parser.add_argument(
+    'seconds', type=float, location='args', required=False, default=10,
+    help='How long to sample, capped by profiling.max_sample_seconds')
+sample_parser.add_argument(
+    'interval_ms', type=inputs.int_range(1, 1000), location='args', required=False, default=10,
+    help='Milliseconds between samples')
+sample_parser.add_argument(
+    'idle', type=inputs.boolean, location='args', required=False, default=False,
+    help='Keep the stacks of threads waiting for work')
+
+profile_parser = reqparse.RequestParser()
+profile_parser.add_argument(
+    'format', type=str, location='args', required=False, default='text', choices=['text', 'pstats'],
+    help='text for the pstats report, pstats for the raw file (snakeviz, pstats.Stats)')
+profile_parser.add_argument(
+    'sort', type=str, location='args', required=False, default='cumulative',
+    choices=['cumulative', 'tottime', 'calls'], help='Order of the text report')
+profile_parser.add_argument(
+    'limit', type=inputs.int_range(1, 1000), location='args', required=False, default=50,
+    help='Functions in the text report')
+
+tracemalloc_parser = reqparse.RequestParser()
+tracemalloc_parser.add_argument(
+    'limit', type=inputs.int_range(1, 500), location='args', required=False, default=25,
+    help='Allocation sites returned')
+tracemalloc_parser.add_argument(
+    'group_by', type=str, location='args', required=False, default='lineno',
+    choices=['lineno', 'filename', 'traceback'], help='How allocations are grouped')
+
+tracemalloc_start_parser = reqparse.RequestParser()
+tracemalloc_start_parser.add_argument(
+    'frames', type=inputs.int_range(1, 100), location='args', required=False, default=1,
+    help='Frames kept per allocation traceback, more costs more memory and time')
+
+
+@api.route('/profile/sample')
+class StackSample(Resource):
+    method_decorators = [admin_only]
+
+    @api.doc(description='Sample the Python stacks of every thread of the worker serving this request and '
+                         'return them as collapsed stacks, the input of flamegraph.pl and speedscope. The '
+                         'X-Worker-PID header tells which worker was sampled.')
+    @api.expect(sample_parser)
+    def get(self):
+        """Sample a live worker"""
+        request_params = sample_parser.parse_args()
+        try:
+            stacks, samples = profiler.sample(request_params['seconds'], request_params['interval_ms'] / 1000,
+                                              idle=request_params['idle'])
+        except ProfilerBusy as e:
+            return {"error": str(e)}, 409
+        return Response(stacks, mimetype='text/plain',
+                        headers={'X-Samples': str(samples), 'X-Worker-PID': str(os.getpid())})
+
+
+@api.route('/profiles')
+class Profiles(Resource):
+    method_decorators = [admin_only]
+
+    @api.doc(description='Saved request profiles of every worker on the host, newest first. Requests are '
+                         'profiled when sent by an admin with X-Profile: 1, or at profiling.sample_rate.')
+    def get(self):
+        """List request profiles"""
+        return {"profiles": profiler.profiles()}
+
+
+@api.route('/profiles/<string:profile_id>')
+class Profile(Resource):
+    method_decorators = [admin_only]
+
+    @api.doc(description='The cProfile report of a request, by the X-Profile-ID header of its response.')
+    @api.expect(profile_parser)
+    def get(self, profile_id):
+        """Get a request profile"""
+        request_params = profile_parser.parse_args()
+        if request_params['format'] == 'pstats':
+            path = profiler.profile_path(profile_id)
+            if path is None:
+                return {"error": f"Unknown profile '{profile_id}'"}, 404
+            return send_file(path, as_attachment=True, download_name=f"{profile_id}.prof",
+                             mimetype='application/octet-stream')
+        text = profiler.profile_text(profile_id, request_params['sort'], request_params['limit'])
+        if text is None:
+            return {"error": f"Unknown profile '{profile_id}'"}, 404
+        return Response(text, mimetype='text/plain')
+
+
+@api.route('/tracemalloc')
+class Tracemalloc(Resource):
+    method_decorators = [admin_only]
+
+    @api.doc(description='Top allocation sites of the worker serving this request, with their growth since '
+                         'its previous snapshot. numpy arrays are traced, PIL image buffers are not.')
+    @api.expect(tracemalloc_parser)
+    def get(self):
+        """Snapshot the top allocators"""
+        request_params = tracemalloc_parser.parse_args()
+        top = profiler.top_allocations(request_params['limit'], request_params['group_by'])
+        if top is None:
+            return {"error": "Allocations are not traced, start tracing with POST first"}, 409
+        return top
+
+    @api.doc(description='Start tracing the allocations of the worker serving this request.')
+    @api.expect(tracemalloc_start_parser)
+    def post(self):
+        """Start tracing allocations"""
+        request_params = tracemalloc_start_parser.parse_args()
+        return profiler.start_tracemalloc(request_params['frames'])
+
+    @api.doc(description='Stop tracing the allocations of the worker serving this request.')
+    def delete(self):
+        """Stop tracing allocations"""
+        profiler.stop_tracemalloc()
+        return '', 204
@@ -0,0 +1,68 @@
+from flask import request
+from flask_restx import Namespace, Resource, reqparse
+from PIL import UnidentifiedImageError
+from werkzeug.datastructures import FileStorage
+
+from app.image_processing.asset_store import ASSET_KINDS, AssetForbidden, AssetNotFound, asset_store
+from app.image_processing.ingestion import image_ingestion
+
+# Define the customer provisioning namespace
+api = Namespace(
+    'CustomerProvisioning', description='Register dealer logos and backgrounds once, reference them by id',
+    path='/assets')
+
+# Define a parser for asset upload
+asset_upload_parser = reqparse.RequestParser()
+asset_upload_parser.add_argument(
+    'image', type=FileStorage, location='files', required=True, help='Logo or background image (max 10MB)')
+asset_upload_parser.add_argument(
+    'kind', type=str, location='args', required=True, choices=sorted(ASSET_KINDS),
+    help='What the image is used for')
+
+
+@api.route('')
+class Assets(Resource):
+    @api.doc(description='Register a logo or background, owned by the API key the request is sent with. Pass the '
+                         'returned asset_id as logo_id or background_id to the image routes instead of uploading '
+                         'the file again.')
+    @api.expect(asset_upload_parser)
+    def post(self):
+        """Register a logo or background"""
+        request_params = asset_upload_parser.parse_args()  # Parse the incoming request arguments
+        api_key = request.headers.get(asset_store.key_header)
+        if not api_key:
+            return {"error": f"Assets are registered with the customer's {asset_store.key_header} header"}, 401
+
+        image_file = request_params['image']
+        if not image_file:
+            return {"error": "No image file provided"}, 400
+
+        try:
+            return asset_store.register(request_params['kind'], image_ingestion.read(image_file), api_key), 201
+        except UnidentifiedImageError as e:
+            return {"error": str(e)}, 400
+
+
+@api.route('/<string:asset_id>')
+class Asset(Resource):
+    @api.doc(description='Metadata of a registered logo or background.')
+    def get(self, asset_id):
+        """Get a registered asset"""
+        try:
+            return asset_store.info(asset_id)
+        except AssetNotFound as e:
+            return {"error": str(e)}, 404
+
+    @api.doc(description='Remove a registered logo or background, with the API key that registered it.')
+    def delete(self, asset_id):
+        """Delete a registered asset"""
+        api_key = request.headers.get(asset_store.key_header)
+        if not api_key:
+            return {"error": f"Assets are deleted with the customer's {asset_store.key_header} header"}, 401
+        try:
+            asset_store.delete(asset_id, api_key)
+        except AssetNotFound as e:
+            return {"error": str(e)}, 404
+        except AssetForbidden as e:
+            return {"error": str(e)}, 403
+        return '', 204
@@ -0,0 +1,158 @@
+from flask_restx import Namespace, Resource, inputs
+from flask import send_file, url_for
+from io import BytesIO
+
+from app.image_processing import workflows
+from app.image_processing.ingestion import image_ingestion
+from app.jobs.job_queue import CallbackRejected, JobQueueFull, job_manager
+from app.routes.transform_image import (background_upload_parser, logo_upload_parser, multi_upload_parser,
+                                        output_params, upload_image_parser)
+
+# Define the jobs namespace
+api = Namespace(
+    'Jobs', description='Asynchronous car image processing: submit a job, then poll or get called back',
+    path='/jobs')
+
+# Job kinds, their handler and the download name of their result
+job_manager.register('remove-background', workflows.remove_background, 'processed_image.png')
+job_manager.register('add-logo', workflows.add_logo, 'image_with_logo.png')
+job_manager.register('apply-background', workflows.apply_background, 'car_with_background.png')
+job_manager.register('process-car-image', workflows.process_car_image, 'final_image.png')
+
+
+def job_parser(parser):
+    """Copy a transform_image parser and add the job submission arguments."""
+    parser = parser.copy()
+    parser.add_argument(
+        'priority', type=inputs.int_range(0, 9), location='args', required=False, default=5,
+        help='0 (most urgent) to 9, lower numbers run first')
+    parser.add_argument(
+        'callback_url', type=inputs.URL(schemes=('http', 'https')), location='args', required=False,
+        help='URL that receives a POST with the job status once it has finished')
+    return parser
+
+
+remove_background_job_parser = job_parser(upload_image_parser)
+# Job results are stored images, masks (result=mask, rle or polygon) are served by the synchronous route
+remove_background_job_parser.remove_argument('result')
+add_logo_job_parser = job_parser(logo_upload_parser)
+apply_background_job_parser = job_parser(background_upload_parser)
+process_car_image_job_parser = job_parser(multi_upload_parser)
+
+
+def submit_job(kind, request_params, inputs, params=None):
+    """
+    Queue a job and answer 202 with its URLs, 400 for invalid output options or
+    callback URLs, or 429 when the queue is full.
+    """
+    try:
+        if request_params['callback_url']:
+            job_manager.check_callback_url(request_params['callback_url'])
+    except CallbackRejected as e:
+        return {"error": str(e)}, 400
+    try:
+        # The output options, Accept header included, are resolved now: the job runs outside the request
+        params = {**(params or {}), 'output': output_params(request_params)}
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    job_id = job_manager.new_job_id()
+    status_url = url_for('main.job_status', job_id=job_id, _external=True)
+    result_url = url_for('main.job_result', job_id=job_id, _external=True)
+    try:
+        job_manager.submit(
+            kind, inputs, params,
+            priority=request_params['priority'],
+            callback_url=request_params['callback_url'],
+            result_url=result_url,
+            job_id=job_id)
+    except JobQueueFull as e:
+        return {"error": str(e)}, 429, {'Retry-After': str(e.retry_after)}
+    return {"job_id": job_id, "status": "queued", "status_url": status_url, "result_url": result_url}, 202
+
+
+@api.route('/remove-background')
+class RemoveBackgroundJob(Resource):
+    @api.doc(description='Queue a background removal job and get its job id.')
+    @api.expect(remove_background_job_parser)
+    def post(self):
+        """Submit a background removal job"""
+        request_params = remove_background_job_parser.parse_args()
+        return submit_job('remove-background', request_params, {
+            'image_data': image_ingestion.read(request_params['image']),
+        })
+
+
+@api.route('/add-logo')
+class AddLogoJob(Resource):
+    @api.doc(description='Queue a job that adds a logo to an image and get its job id.')
+    @api.expect(add_logo_job_parser)
+    def post(self):
+        """Submit a logo job"""
+        request_params = add_logo_job_parser.parse_args()
+        if not request_params['image'] or not (request_params['logo'] or request_params['logo_id']):
+            return {"error": "No image or logo file provided"}, 400
+        return submit_job('add-logo', request_params, {
+            'image_data': image_ingestion.read(request_params['image']),
+            'logo_data': image_ingestion.read(request_params['logo']),
+        }, {'position': request_params['position'], 'logo_id': request_params['logo_id']})
+
+
+@api.route('/apply-background')
+class ApplyBackgroundJob(Resource):
+    @api.doc(description='Queue a job that applies a background to a car cutout and get its job id.')
+    @api.expect(apply_background_job_parser)
+    def post(self):
+        """Submit a background job"""
+        request_params = apply_background_job_parser.parse_args()
+        if not request_params['image'] or not (request_params['background'] or request_params['background_id']):
+            return {"error": "No image or background file provided"}, 400
+        return submit_job('apply-background', request_params, {
+            'image_data': image_ingestion.read(request_params['image']),
+            'background_data': image_ingestion.read(request_params['background']),
+            'mask_data': image_ingestion.read_mask(request_params['mask']),
+        }, {'background_id': request_params['background_id']})
+
+
+@api.route('/process-car-image')
+class ProcessCarImageJob(Resource):
+    @api.doc(description='Queue a full car image processing job and get its job id.')
+    @api.expect(process_car_image_job_parser)
+    def post(self):
+        """Submit a car image processing job"""
+        request_params = process_car_image_job_parser.parse_args()
+        return submit_job('process-car-image', request_params, {
+            'car_image_data': image_ingestion.read(request_params['car_image']),
+            'logo_data': image_ingestion.read(request_params['logo']),
+            'background_data': image_ingestion.read(request_params['background']),
+            'mask_data': image_ingestion.read_mask(request_params['mask']),
+        }, {'logo_position': request_params['logo_position'],
+            'logo_id': request_params['logo_id'],
+            'background_id': request_params['background_id']})
+
+
+@api.route('/<string:job_id>', endpoint='job_status')
+class JobStatus(Resource):
+    @api.doc(description='Status of a job: queued (with its queue position), running, succeeded or failed.')
+    def get(self, job_id):
+        """Get the status of a job"""
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": "Unknown or expired job"}, 404
+        return job
+
+
+@api.route('/<string:job_id>/result', endpoint='job_result')
+class JobResult(Resource):
+    @api.doc(description='Download the processed image of a succeeded job.')
+    def get(self, job_id):
+        """Download the result of a job"""
+        result = job_manager.result(job_id)
+        if result is None:
+            job = job_manager.get(job_id)
+            if job is None:
+                return {"error": "Unknown or expired job"}, 404
+            return {"error": f"Job is {job['status']}", "status": job['status']}, 409
+
+        output_image, mimetype, download_name = result
+        return send_file(BytesIO(output_image), as_attachment=True, download_name=download_name,
+                         mimetype=mimetype)
@@ -1,5 +1,15 @@
+from flask import Response
 from flask_restx import Namespace, Resource
 
+from app import startup
+
+from app.image_processing.backends import backends
+from app.image_processing.batching import inference_engine
+from app.image_processing.mask_cache import mask_cache
+from app.image_processing.response_cache import response_cache
+from app.image_processing.session_pool import session_pool
+from app.metrics import metrics
+
 # Define the default namespace
 api = Namespace('TestServer', description='Test if server is online', path='/')
 
@@ -7,6 +17,21 @@ api = Namespace('TestServer', description='Test if server is online', path='/')
 @api.route('/test')
 class HelloWorld(Resource):
 
-    @api.doc(description='Returns a hello world message')
+    @api.doc(description='Returns a hello world message and the background removal model state')
+    def get(self):
+        return {'message': 'Hello World, I am online!',
+                'model': session_pool.status(),
+                'backends': backends.status(),
+                'batching': inference_engine.stats(),
+                'mask_cache': mask_cache.stats(),
+                'response_cache': response_cache.stats(),
+                'startup': startup.stats()}
+
+
+@api.route('/metrics')
+class Metrics(Resource):
+
+    @api.doc(description='Request and stage latency histograms, in-flight requests, queue depths and model '
+                         'session counters of every worker, in the Prometheus text format')
     def get(self):
-        return {'message': 'Hello World, I am online!'}
+        return Response(metrics.collect(), mimetype='text/plain; version=0.0.4')
@@ -1,19 +1,57 @@
-from flask_restx import Namespace, Resource, reqparse
-from flask import request, jsonify, send_file
+from flask_restx import Namespace, Resource, inputs, reqparse
+from flask import Response, current_app, request, send_file, stream_with_context
+from PIL import UnidentifiedImageError
 from werkzeug.datastructures import FileStorage
 
-from app.image_processing.bg_applier import BackgroundApplier
-from app.image_processing.bg_remover import BackgroundRemover
-from io import BytesIO
-import tempfile
+from app.admission import Overloaded, admission_control, image_pixels
+from app.image_processing import workflows
+from app.image_processing.asset_store import AssetNotFound, asset_store
+from app.image_processing.encoders import FORMATS, output_encoder
+from app.image_processing.ingestion import UploadRejected, image_ingestion
+from app.image_processing.mask_codec import ENCODINGS
+from app.image_processing.offload import process_offload
+from app.image_processing.response_cache import response_cache
+from contextlib import ExitStack
+from functools import partial
+from io import BytesIO, RawIOBase
+import itertools
 import os
-
-from app.image_processing.logo_adder import LogoAdder
+import zipfile
 
 # Define the upload namespace
 api = Namespace(
     'CarImageProcess', description='Car Image upload and process', path='/')
 
+
+def add_output_arguments(parser):
+    """Add the output format, quality and variant arguments shared by every transform route."""
+    parser.add_argument(
+        'format', type=str, location='args', required=False, choices=['auto', *FORMATS],
+        help='Output format; by default negotiated from the Accept header, PNG if it lists no image types. '
+             'auto picks JPEG for opaque images and WebP for cutouts')
+    parser.add_argument(
+        'quality', type=inputs.int_range(1, 100), location='args', required=False,
+        help='Quality of lossy output formats, 1-100')
+    parser.add_argument(
+        'variant', type=str, location='args', required=False,
+        help='Resized delivery variant (see the output.variants config), full size by default')
+    return parser
+
+
+def output_params(request_params):
+    """
+    The `output` argument of the workflows: the requested format, quality and variant,
+    plus the image types the client explicitly accepts, most preferred first.
+
+    :raises ValueError: For unavailable formats and unknown variants
+    """
+    output_encoder.check(request_params['format'], request_params['variant'])
+    accept = [mimetype for mimetype, quality in request.accept_mimetypes
+              if quality > 0 and mimetype.startswith('image/') and mimetype != 'image/*']
+    return {'format': request_params['format'], 'quality': request_params['quality'],
+            'variant': request_params['variant'], 'accept': accept}
+
+
 # Define a parser for file upload
 upload_image_parser = reqparse.RequestParser()
 upload_image_parser.add_argument('image',
@@ -21,6 +59,95 @@ upload_image_parser.add_argument('image',
                                  location='files',
                                  required=True,
                                  help='Image (max 10MB)')
+add_output_arguments(upload_image_parser)
+upload_image_parser.add_argument(
+    'result', type=str, location='args', required=False, default='cutout', choices=['cutout', *ENCODINGS],
+    help='cutout (default), or only the mask: mask (grayscale image), rle or polygon (JSON, thresholded at 50%). '
+         'The car\'s bounding box is sent as X-Bounding-Box, or as bbox in JSON')
+
+
+# Workflows that run background removal, unless they are given a mask
+INFERENCE_WORKFLOWS = (workflows.remove_background, workflows.background_mask, workflows.process_car_image)
+
+
+def admit(cost, hold=None):
+    """Admission of the current request, see admission.AdmissionControl.admit."""
+    return admission_control.admit(cost, admission_control.client_key(request),
+                                   request.url_rule.rule if request.url_rule else 'unmatched', hold=hold)
+
+
+def overloaded(error):
+    return {"error": str(error)}, 429, {'Retry-After': str(error.retry_after)}
+
+
+def run_workflow(workflow, download_name, request_params, *args, **kwargs):
+    """
+    Run one of the image_processing.workflows and send the result as a downloadable file
+    in the requested or negotiated output format.
+    Results carry an ETag derived from the inputs: requests sending it back as If-None-Match
+    are answered with 304, repeated requests from the response cache unless they are sent
+    with Cache-Control: no-cache.
+    Undecodable uploads and invalid output options are answered with 400, uploads refused by
+    the ingestion checks with their status, unknown asset ids with 404, requests refused by
+    admission control with 429 and Retry-After, any other failure with 500.
+    """
+    try:
+        output = output_params(request_params)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    etag = response_cache.etag(workflow.__name__, args, kwargs, output)
+    try:
+        # A deleted asset is not found, even for a result made with it
+        for asset_id in (kwargs.get('logo_id'), kwargs.get('background_id')):
+            if asset_id:
+                asset_store.info(asset_id)
+    except AssetNotFound as e:
+        return {"error": str(e)}, 404
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=cache_headers(etag))
+
+    # no-cache asks for the result to be made again, e.g. to trace its stages
+    output_image = None if request.cache_control.no_cache else response_cache.get(etag)
+    if output_image is None:
+        cost = admission_control.cost(image_pixels(args[0]),
+                                      inference=workflow in INFERENCE_WORKFLOWS and not kwargs.get('mask_data'))
+        try:
+            with admit(cost):
+                # In a worker process when offloading is enabled
+                output_image = process_offload.run(workflow, *args, output=output, **kwargs)
+        except Overloaded as e:
+            return overloaded(e)
+        except UnidentifiedImageError as e:
+            return {"error": str(e)}, 400
+        except UploadRejected as e:
+            return {"error": str(e)}, e.status
+        except AssetNotFound as e:
+            return {"error": str(e)}, 404
+        except Exception as e:
+            return {"error": str(e)}, 500
+        response_cache.put(etag, output_image)
+
+    if isinstance(output_image, dict):
+        # A JSON encoded mask
+        return output_image, 200, cache_headers(etag)
+
+    # Send the processed image as a downloadable file
+    response = send_file(BytesIO(output_image.data), as_attachment=True,
+                         download_name=os.path.splitext(download_name)[0] + output_image.extension,
+                         mimetype=output_image.mimetype, etag=False)
+    if output_image.bbox:
+        # The car's tight box, for clients that crop or composite themselves
+        response.headers['X-Bounding-Box'] = ','.join(str(side) for side in output_image.bbox)
+    response.headers.update(cache_headers(etag))
+    return response
+
+
+def cache_headers(etag):
+    """The ETag and caching headers of a transform result."""
+    # Weak: the same inputs give equivalent images, byte equal only with the same image libraries
+    return {'ETag': f'W/"{etag}"', 'Cache-Control': response_cache.cache_control(),
+            # The format depends on the Accept header unless it was asked for
+            'Vary': 'Accept'}
 
 
 # Background Removal Resource under the upload namespace
@@ -36,41 +163,13 @@ class RemoveBackground(Resource):
         # Get the uploaded file
         image_file = request_params['image']
         if not image_file:
-            return jsonify({"error": "No image file provided"}), 400
+            return {"error": "No image file provided"}, 400
 
-        # Create a temporary file to save the uploaded image
-        with tempfile.NamedTemporaryFile(delete=False) as temp_input_file:
-            temp_input_file.write(image_file.read())
-            temp_input_path = temp_input_file.name
-
-        try:
-            # Create a temporary file for the output
-            temp_output_file = tempfile.NamedTemporaryFile(
-                delete=False, suffix='.png')
-            temp_output_path = temp_output_file.name
-            temp_output_file.close()
-
-            # Use BackgroundRemover with the input and output file paths
-            remover = BackgroundRemover(temp_input_path, temp_output_path)
-            remover.remove_background()
-
-            # Open the output file and send it as a response
-            with open(temp_output_path, 'rb') as f:
-                output_image = f.read()
-
-            # Send the processed image as a downloadable file
-            return send_file(BytesIO(output_image), as_attachment=True, download_name='processed_image.png',
-                             mimetype='image/png')
-
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-
-        finally:
-            # Clean up temporary files
-            if os.path.exists(temp_input_path):
-                os.remove(temp_input_path)
-            if os.path.exists(temp_output_path):
-                os.remove(temp_output_path)
+        if request_params['result'] in ENCODINGS:
+            return run_workflow(workflows.background_mask, 'mask.png', request_params,
+                                image_ingestion.read(image_file), result=request_params['result'])
+        return run_workflow(workflows.remove_background, 'processed_image.png', request_params,
+                            image_ingestion.read(image_file))
 
 
 # Define a parser for file upload
@@ -78,9 +177,13 @@ logo_upload_parser = reqparse.RequestParser()
 logo_upload_parser.add_argument(
     'image', type=FileStorage, location='files', required=True, help='Image (max 10MB)')
 logo_upload_parser.add_argument(
-    'logo', type=FileStorage, location='files', required=True, help='Logo image (max 10MB)')
+    'logo', type=FileStorage, location='files', required=False, help='Logo image (max 10MB), or use logo_id')
 logo_upload_parser.add_argument(
-    'position', type=str, location='args', required=False, default='top-right', choices=['top-left', 'top-right', 'bottom-left', 'bottom-right'], help='Position to place the logo')
+    'logo_id', type=str, location='args', required=False, help='Id of a logo registered through /assets')
+logo_upload_parser.add_argument(
+    'position', type=str, location='args', required=False, default='top-right',
+    choices=['top-left', 'top-right', 'bottom-left', 'bottom-right'], help='Position to place the logo')
+add_output_arguments(logo_upload_parser)
 
 
 @api.route('/add-logo')
@@ -95,51 +198,15 @@ class AddLogo(Resource):
         # Get the uploaded image, logo, and position
         image_file = request_params['image']
         logo_file = request_params['logo']
+        logo_id = request_params['logo_id']
         position = request_params['position']
-        if not image_file or not logo_file:
-            return jsonify({"error": "No image or logo file provided"}), 400
-
-        # Create temporary files to save the uploaded image and logo
-        with tempfile.NamedTemporaryFile(delete=False) as temp_input_file:
-            temp_input_file.write(image_file.read())
-            temp_input_path = temp_input_file.name
-
-        with tempfile.NamedTemporaryFile(delete=False) as temp_logo_file:
-            temp_logo_file.write(logo_file.read())
-            temp_logo_path = temp_logo_file.name
-
-        try:
-            # Create a temporary file for the output
-            temp_output_file = tempfile.NamedTemporaryFile(
-                delete=False, suffix='.png')
-            temp_output_path = temp_output_file.name
-            temp_output_file.close()
-
-            # Use LogoAdder with the input, logo, and output file paths
-            logo_adder = LogoAdder(
-                temp_input_path, temp_logo_path, temp_output_path)
-            # Use the position from the request to place the logo
-            logo_adder.add_logo(location=position)
-
-            # Open the output file and send it as a response
-            with open(temp_output_path, 'rb') as f:
-                output_image = f.read()
-
-            # Send the processed image as a downloadable file
-            return send_file(BytesIO(output_image), as_attachment=True, download_name='image_with_logo.png',
-                             mimetype='image/png')
-
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        if not image_file or not (logo_file or logo_id):
+            return {"error": "No image or logo file provided"}, 400
 
-        finally:
-            # Clean up temporary files
-            if os.path.exists(temp_input_path):
-                os.remove(temp_input_path)
-            if os.path.exists(temp_logo_path):
-                os.remove(temp_logo_path)
-            if os.path.exists(temp_output_path):
-                os.remove(temp_output_path)
+        # Use the position from the request to place the logo
+        return run_workflow(workflows.add_logo, 'image_with_logo.png', request_params,
+                            image_ingestion.read(image_file), image_ingestion.read(logo_file),
+                            position=position, logo_id=logo_id)
 
 
 # Define a parser for file upload
@@ -147,12 +214,21 @@ background_upload_parser = reqparse.RequestParser()
 background_upload_parser.add_argument(
     'image', type=FileStorage, location='files', required=True, help='Image (max 10MB)')
 background_upload_parser.add_argument(
-    'background', type=FileStorage, location='files', required=True, help='Background image (max 10MB)')
+    'background', type=FileStorage, location='files', required=False,
+    help='Background image (max 10MB), or use background_id')
+background_upload_parser.add_argument(
+    'background_id', type=str, location='args', required=False,
+    help='Id of a background registered through /assets')
+background_upload_parser.add_argument(
+    'mask', type=FileStorage, location='files', required=False,
+    help='Mask returned by /remove-background (image, RLE or polygon JSON); the image is then the original photo')
+add_output_arguments(background_upload_parser)
 
 
 @api.route('/apply-background')
 class ApplyBackground(Resource):
-    @api.doc(description='Upload an image (car without background) and a background image, apply the car on the background.')
+    @api.doc(description='Upload an image (car without background) and a background image, '
+                         'apply the car on the background.')
     @api.expect(background_upload_parser)
     def post(self):
         """Handle the image and background upload and apply the car to the new background"""
@@ -162,49 +238,14 @@ class ApplyBackground(Resource):
         # Get the uploaded image and background
         image_file = request_params['image']
         background_file = request_params['background']
-        if not image_file or not background_file:
-            return jsonify({"error": "No image or background file provided"}), 400
-
-        # Create temporary files to save the uploaded image and background
-        with tempfile.NamedTemporaryFile(delete=False) as temp_input_file:
-            temp_input_file.write(image_file.read())
-            temp_input_path = temp_input_file.name
-
-        with tempfile.NamedTemporaryFile(delete=False) as temp_background_file:
-            temp_background_file.write(background_file.read())
-            temp_background_path = temp_background_file.name
-
-        try:
-            # Create a temporary file for the output
-            temp_output_file = tempfile.NamedTemporaryFile(
-                delete=False, suffix='.png')
-            temp_output_path = temp_output_file.name
-            temp_output_file.close()
+        background_id = request_params['background_id']
+        if not image_file or not (background_file or background_id):
+            return {"error": "No image or background file provided"}, 400
 
-            # Use BackgroundApplier with the car image and background file
-            background_applier = BackgroundApplier(
-                temp_input_path, temp_background_path, temp_output_path)
-            background_applier.apply_background()
-
-            # Open the output file and send it as a response
-            with open(temp_output_path, 'rb') as f:
-                output_image = f.read()
-
-            # Send the processed image as a downloadable file
-            return send_file(BytesIO(output_image), as_attachment=True, download_name='car_with_background.png',
-                             mimetype='image/png')
-
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-
-        finally:
-            # Clean up temporary files
-            if os.path.exists(temp_input_path):
-                os.remove(temp_input_path)
-            if os.path.exists(temp_background_path):
-                os.remove(temp_background_path)
-            if os.path.exists(temp_output_path):
-                os.remove(temp_output_path)
+        return run_workflow(workflows.apply_background, 'car_with_background.png', request_params,
+                            image_ingestion.read(image_file), image_ingestion.read(background_file),
+                            background_id=background_id,
+                            mask_data=image_ingestion.read_mask(request_params['mask']))
 
 
 multi_upload_parser = reqparse.RequestParser()
@@ -215,12 +256,25 @@ multi_upload_parser.add_argument(
 multi_upload_parser.add_argument(
     'background', type=FileStorage, location='files', required=False, help='Background image (max 10MB)')
 multi_upload_parser.add_argument(
-    'logo_position', type=str, location='args', required=False, default='top-right', choices=['top-left', 'top-right', 'bottom-left', 'bottom-right'], help='Position to place the logo')
+    'logo_id', type=str, location='args', required=False, help='Id of a logo registered through /assets')
+multi_upload_parser.add_argument(
+    'background_id', type=str, location='args', required=False,
+    help='Id of a background registered through /assets')
+multi_upload_parser.add_argument(
+    'logo_position', type=str, location='args', required=False, default='top-right',
+    choices=['top-left', 'top-right', 'bottom-left', 'bottom-right'], help='Position to place the logo')
+multi_upload_parser.add_argument(
+    'mask', type=FileStorage, location='files', required=False,
+    help='Mask returned by /remove-background for this car image (image, RLE or polygon JSON), '
+         'skips background removal')
+add_output_arguments(multi_upload_parser)
+
 
 # Combined Process Resource under the upload namespace
 @api.route('/process-car-image')
 class ProcessCarImage(Resource):
-    @api.doc(description='Upload a car image, optional logo, and optional background. The image is processed accordingly.')
+    @api.doc(description='Upload a car image, optional logo, and optional background. '
+                         'The image is processed accordingly.')
     @api.expect(multi_upload_parser)
     def post(self):
         """Handle the upload of car image, logo, and background and process them accordingly"""
@@ -233,75 +287,139 @@ class ProcessCarImage(Resource):
         logo_position = request_params['logo_position']
 
         if not car_image_file:
-            return jsonify({"error": "Car image is required"}), 400
-
-        # Create temporary files to save the uploaded car image, logo, and background
-        with tempfile.NamedTemporaryFile(delete=False) as temp_car_file:
-            temp_car_file.write(car_image_file.read())
-            temp_car_path = temp_car_file.name
-
-        temp_background_path = None
-        temp_logo_path = None
-        temp_output_path = None
-
-        try:
-            # Step 1: Remove the background from the car image
-            temp_removed_bg_path = tempfile.NamedTemporaryFile(delete=False, suffix='.png').name
-            remover = BackgroundRemover(temp_car_path, temp_removed_bg_path)
-            remover.remove_background()
-
-            # Step 2: If background is provided, apply it to the car image after background removal
-            if background_file:
-                with tempfile.NamedTemporaryFile(delete=False) as temp_background_file:
-                    temp_background_file.write(background_file.read())
-                    temp_background_path = temp_background_file.name
-
-                # Create a temporary file for the output after applying the background
-                temp_output_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-                temp_output_path = temp_output_file.name
-                temp_output_file.close()
-
-                # Use BackgroundApplier to apply the car image (without background) on the background
-                background_applier = BackgroundApplier(temp_removed_bg_path, temp_background_path, temp_output_path)
-                background_applier.apply_background()
-
-                # Clean up temporary background file after processing
-                if os.path.exists(temp_background_path):
-                    os.remove(temp_background_path)
+            return {"error": "Car image is required"}, 400
+
+        return run_workflow(workflows.process_car_image, 'final_image.png', request_params,
+                            image_ingestion.read(car_image_file),
+                            logo_data=image_ingestion.read(logo_file),
+                            background_data=image_ingestion.read(background_file),
+                            logo_position=logo_position,
+                            logo_id=request_params['logo_id'],
+                            background_id=request_params['background_id'],
+                            mask_data=image_ingestion.read_mask(request_params['mask']))
+
+
+bulk_upload_parser = reqparse.RequestParser()
+bulk_upload_parser.add_argument(
+    'car_image', type=FileStorage, location='files', required=True, action='append',
+    help='Car images, repeat the field for every photo (max 10MB each)')
+bulk_upload_parser.add_argument(
+    'logo', type=FileStorage, location='files', required=False, help='Logo image shared by all photos (max 10MB)')
+bulk_upload_parser.add_argument(
+    'background', type=FileStorage, location='files', required=False,
+    help='Background image shared by all photos (max 10MB)')
+bulk_upload_parser.add_argument(
+    'logo_id', type=str, location='args', required=False, help='Id of a logo registered through /assets')
+bulk_upload_parser.add_argument(
+    'background_id', type=str, location='args', required=False,
+    help='Id of a background registered through /assets')
+bulk_upload_parser.add_argument(
+    'logo_position', type=str, location='args', required=False, default='top-right',
+    choices=['top-left', 'top-right', 'bottom-left', 'bottom-right'], help='Position to place the logo')
+add_output_arguments(bulk_upload_parser)
+
+
+class _ZipStream(RawIOBase):
+    """Write-only, non-seekable sink that lets zipfile produce an archive chunk by chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(results):
+    """
+    Yield a ZIP archive of (name, EncodedImage, error) results as they arrive.
+    Failed photos are stored as `<name>.error.txt` so one bad upload does not fail the set.
+    """
+    stream = _ZipStream()
+    # Encoded images are already compressed, store them as-is
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, output_image, error in results:
+            if error is not None:
+                archive.writestr(f'{name}.error.txt', str(error))
             else:
-                # If no background is provided, use the car image after background removal
-                temp_output_path = temp_removed_bg_path
-
-            # Step 3: If logo is provided, add the logo to the car image (with background, if applied)
-            if logo_file:
-                with tempfile.NamedTemporaryFile(delete=False) as temp_logo_file:
-                    temp_logo_file.write(logo_file.read())
-                    temp_logo_path = temp_logo_file.name
+                archive.writestr(f'{name}{output_image.extension}', output_image.data)
+            yield stream.pop()
+    yield stream.pop()
 
-                # Use LogoAdder to add the logo to the car image (with or without background)
-                logo_adder = LogoAdder(temp_output_path, temp_logo_path, temp_output_path)
-                logo_adder.add_logo(location=logo_position)
 
-                # Clean up temporary logo file after processing
-                if os.path.exists(temp_logo_path):
-                    os.remove(temp_logo_path)
+def released(chunks, admission):
+    """Yield the chunks, then close `admission` (an ExitStack), also when the client goes away."""
+    with admission:
+        yield from chunks
 
-            # Read the final processed image and send it as a response
-            with open(temp_output_path, 'rb') as f:
-                output_image = f.read()
 
-            # Send the processed image as a downloadable file
-            return send_file(BytesIO(output_image), as_attachment=True, download_name='final_image.png',
-                             mimetype='image/png')
+@api.route('/process-car-images')
+class ProcessCarImages(Resource):
+    @api.doc(description='Upload all photos of a vehicle plus one optional logo and background. '
+                         'Returns a ZIP that is streamed as each photo finishes.')
+    @api.expect(bulk_upload_parser)
+    def post(self):
+        """Handle the upload of a whole photo set that shares a logo and background"""
+        request_params = bulk_upload_parser.parse_args()  # Parse the incoming request arguments
 
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-
-        finally:
-            # Clean up temporary files after all operations are done
-            if os.path.exists(temp_car_path):
-                os.remove(temp_car_path)
-            if os.path.exists(temp_removed_bg_path):
-                os.remove(temp_removed_bg_path)
-            if os.path.exists(temp_output_path):
-                os.remove(temp_output_path)
\ No newline at end of file
+        car_image_files = [f for f in request_params['car_image'] or [] if f]
+        logo_file = request_params['logo']
+        background_file = request_params['background']
+        if not car_image_files:
+            return {"error": "At least one car image is required"}, 400
+        try:
+            output = output_params(request_params)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        # Every photo is paid for up front, while at most max_parallel of them are processed at once
+        max_parallel = current_app.config.get('bulk', {}).get('max_parallel', 4)
+        costs = [admission_control.cost(image_pixels(f.stream)) for f in car_image_files]
+        admission = ExitStack()
+        try:
+            admission.enter_context(admit(sum(costs), hold=sum(sorted(costs)[-max_parallel:])))
+        except Overloaded as e:
+            return overloaded(e)
+
+        # Photos are only read when their turn comes, so the whole set is never held in memory
+        car_images = [
+            (f"{index:03d}_{os.path.splitext(os.path.basename(f.filename or 'car'))[0]}",
+             partial(image_ingestion.read, f))
+            for index, f in enumerate(car_image_files, start=1)
+        ]
+        results = workflows.process_car_images(
+            car_images,
+            logo_data=image_ingestion.read(logo_file),
+            background_data=image_ingestion.read(background_file),
+            logo_position=request_params['logo_position'],
+            max_parallel=max_parallel,
+            logo_id=request_params['logo_id'],
+            background_id=request_params['background_id'],
+            output=output)
+
+        # The shared logo and background are decoded before the first result,
+        # so a bad one can still be answered with a status code
+        with admission:
+            try:
+                first_result = next(results)
+            except UnidentifiedImageError as e:
+                return {"error": str(e)}, 400
+            except UploadRejected as e:
+                return {"error": str(e)}, e.status
+            except AssetNotFound as e:
+                return {"error": str(e)}, 404
+            # The capacity is held until the last photo is streamed
+            admission = admission.pop_all()
+
+        archive = stream_zip(itertools.chain([first_result], results))
+        return Response(stream_with_context(released(archive, admission)),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=final_images.zip'})
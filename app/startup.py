@@ -0,0 +1,106 @@
+"""
+Startup phases of a gunicorn deployment (see gunicorn_config.py).
+
+The app itself imports its inference backends lazily (see backends.py).
+The master imports them and preloads the model file before forking, so
+every worker starts with those pages shared copy-on-write. Each worker
+then builds its own onnxruntime session and runs a warm-up inference
+before it accepts requests. Both phases log their duration and the
+process memory.
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Set by preload() in the master and inherited by the workers
+_master = {"started_at": None, "preload_seconds": None}
+_worker = {"pid": None, "ready_seconds": None, "warmup": None}
+
+
+def inference_workers(cores, intra_op_threads):
+    """
+    Number of gunicorn workers for `cores` inference cores.
+
+    Background removal is CPU bound and every worker's onnxruntime session
+    runs `intra_op_threads` threads (0: one per core), so one worker per
+    `intra_op_threads` cores keeps each core busy with a single inference
+    thread instead of oversubscribing it.
+    """
+    return max(1, cores // max(1, intra_op_threads or cores))
+
+
+def inference_cores():
+    """Cores this process may run on (its CPU affinity, which honours container cpusets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def process_memory():
+    """
+    Memory of this process in MB: rss, pss (shared pages divided among the processes
+    sharing them) and shared, read from /proc. Empty on platforms without it.
+    """
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Shared_Clean": "shared_mb", "Shared_Dirty": "shared_mb"}
+    memory = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    # Values are in kB
+                    memory[fields[name]] = memory.get(fields[name], 0) + int(value.split()[0]) / 1024
+    except OSError:
+        return {}
+    return {key: round(value, 1) for key, value in memory.items()}
+
+
+def preload(app, started_at=None):
+    """
+    Master phase, before the workers are forked: import the inference backends
+    and load the model file, so the workers share them.
+
+    :param app: The Flask app
+    :param started_at: time.time() when the server started, for the reported startup time
+    """
+    from app.image_processing.backends import BACKENDS, backends
+    from app.image_processing.session_pool import session_pool
+    from app.metrics import metrics
+
+    _master["started_at"] = started_at or time.time()
+    # Snapshots of the workers of a previous run
+    metrics.clear_directory()
+    for name in BACKENDS:
+        backends.get(name)
+    if app.config.get("rembg", {}).get("preload"):
+        try:
+            session_pool.preload()
+        except Exception as e:
+            # Workers fall back to loading the model themselves
+            logger.error("Model preload failed: %s", e)
+    _master["preload_seconds"] = round(time.time() - _master["started_at"], 3)
+    logger.info("Master %s ready in %ss, memory %s", os.getpid(), _master["preload_seconds"], process_memory())
+
+
+def warm_up_worker(app):
+    """Worker phase, before the worker accepts requests: build its session and run one inference."""
+    from app.image_processing.session_pool import session_pool
+
+    _worker["pid"] = os.getpid()
+    if app.config.get("rembg", {}).get("warm_up"):
+        _worker["warmup"] = session_pool.warm_up()
+    _worker["ready_seconds"] = round(time.time() - (_master["started_at"] or time.time()), 3)
+    logger.info("Worker %s ready %ss after server start, memory %s",
+                os.getpid(), _worker["ready_seconds"], process_memory())
+
+
+def stats():
+    """Startup times of the master and this worker and the current process memory, for JSON responses."""
+    return {
+        "master_preload_seconds": _master["preload_seconds"],
+        "worker_ready_seconds": _worker["ready_seconds"] if _worker["pid"] == os.getpid() else None,
+        "memory": process_memory(),
+    }
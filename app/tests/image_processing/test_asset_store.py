@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from app.image_processing.asset_store import AssetForbidden, AssetNotFound, AssetStore
+
+
+class TestAssetStore(unittest.TestCase):
+    def setUp(self):
+        self.store = AssetStore(directory=tempfile.mkdtemp())
+        logo_path = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'logo', 'logo1.png')
+        with open(logo_path, 'rb') as f:
+            self.logo_data = f.read()
+
+    def test_register_is_idempotent(self):
+        """Registering the same file twice returns the same id."""
+        first = self.store.register('logo', self.logo_data, 'dealer-1')
+        second = self.store.register('logo', self.logo_data, 'dealer-1')
+        self.assertEqual(first['asset_id'], second['asset_id'])
+        self.assertEqual(self.store.info(first['asset_id']), first)
+
+    def test_assets_are_owned_by_the_registering_key(self):
+        """The same file registered by two customers gets two ids, each deleted only by its owner."""
+        own = self.store.register('logo', self.logo_data, 'dealer-1')['asset_id']
+        other = self.store.register('logo', self.logo_data, 'dealer-2')['asset_id']
+        unowned = self.store.register('logo', self.logo_data)['asset_id']
+        self.assertEqual(len({own, other, unowned}), 3)
+
+        with self.assertRaises(AssetForbidden):
+            self.store.delete(own, 'dealer-2')
+        with self.assertRaises(AssetForbidden):
+            self.store.delete(unowned, 'dealer-1')
+        self.store.delete(own, 'dealer-1')
+        with self.assertRaises(AssetNotFound):
+            self.store.get(own)
+        # The other customer's copy is untouched
+        self.assertEqual(self.store.get(other).size, self.store.get(unowned).size)
+
+    def test_fitted_variants_are_cached_per_size(self):
+        """A variant is computed once per target size and survives a restart through the shared directory."""
+        asset_id = self.store.register('logo', self.logo_data)['asset_id']
+        variant = self.store.fitted(asset_id, (1400, 900))
+        self.assertLessEqual(variant.width, 1400 // 7)
+        self.assertIs(self.store.fitted(asset_id, (1400, 900)), variant)
+
+        other_worker = AssetStore(directory=self.store.directory)
+        self.assertEqual(other_worker.fitted(asset_id, (1400, 900)).size, variant.size)
+
+    def test_unknown_and_deleted_assets(self):
+        asset_id = self.store.register('background', self.logo_data, 'dealer-1')['asset_id']
+        self.store.delete(asset_id, 'dealer-1')
+        with self.assertRaises(AssetNotFound):
+            self.store.get(asset_id)
+        with self.assertRaises(AssetNotFound):
+            self.store.info('../etc/passwd')
+
+    def test_delete_through_another_worker(self):
+        """A worker stops serving an asset from memory once another worker deleted it."""
+        logo_id = self.store.register('logo', self.logo_data, 'dealer-1')['asset_id']
+        background_id = self.store.register('background', self.logo_data, 'dealer-1')['asset_id']
+        self.store.fitted(logo_id, (1400, 900))
+        self.store.fitted(background_id, (1400, 900))
+
+        AssetStore(directory=self.store.directory).delete(logo_id, 'dealer-1')
+        with self.assertRaises(AssetNotFound):
+            self.store.fitted(logo_id, (1400, 900))
+        with self.assertRaises(AssetNotFound):
+            self.store.get(logo_id)
+        # Only the deleted asset's entries are dropped
+        self.assertEqual(len(self.store.cache), 2)
+        hits = self.store.cache.hits
+        self.store.fitted(background_id, (1400, 900))
+        self.assertEqual(self.store.cache.hits, hits + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+
+from app.image_processing.backends import BackendRegistry
+
+
+class TestBackendRegistry(unittest.TestCase):
+    def test_imported_on_first_use(self):
+        registry = BackendRegistry({'json': 'json'})
+        self.assertEqual(registry.status(), {'json': None})
+        self.assertEqual(registry.get('json').dumps([]), '[]')
+        self.assertIsNotNone(registry.status()['json'])
+        self.assertIs(registry.get('json'), registry.get('json'))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(KeyError):
+            BackendRegistry({}).get('openvino')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.batching import BatchingInferenceEngine
+
+
+class _FakeInput:
+    name = "input.1"
+
+    def __init__(self, batch_dim):
+        self.shape = [batch_dim, 3, 320, 320]
+
+
+class _FakeInnerSession:
+    """Stands in for onnxruntime.InferenceSession, recording each run's batch size."""
+
+    def __init__(self, batch_dim):
+        self.batch_dim = batch_dim
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def get_inputs(self):
+        return [_FakeInput(self.batch_dim)]
+
+    def run(self, output_names, feed):
+        tensors = feed["input.1"]
+        with self.lock:
+            self.batch_sizes.append(len(tensors))
+        # Mask = mean of the normalized channels, shaped like a u2net output
+        return [tensors.mean(axis=1, keepdims=True)]
+
+
+class _FakeSession:
+    model_name = "u2net"
+
+    def __init__(self, batch_dim="batch_size"):
+        self.inner_session = _FakeInnerSession(batch_dim)
+
+
+class TestBatchingInferenceEngine(unittest.TestCase):
+    def test_concurrent_requests_share_a_batch(self):
+        """Requests arriving within max_wait_ms run as one batched call."""
+        session = _FakeSession()
+        engine = BatchingInferenceEngine(
+            session_provider=lambda: session, enabled=True, max_batch_size=4, max_wait_ms=200)
+        images = [Image.new("RGB", (64 + i, 48), (i * 40, 0, 0)) for i in range(4)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            masks = list(executor.map(engine.predict_mask, images))
+
+        self.assertEqual(session.inner_session.batch_sizes, [4])
+        for image, mask in zip(images, masks):
+            self.assertEqual(mask.mode, "L")
+            self.assertEqual(mask.size, image.size)
+
+        stats = engine.stats()
+        self.assertEqual(stats["batches"], 1)
+        self.assertEqual(stats["images"], 4)
+        self.assertEqual(stats["fill_rate"], 1.0)
+
+    def test_fixed_batch_dimension(self):
+        """Models exported with batch size 1 run image by image inside one dispatch."""
+        session = _FakeSession(batch_dim=1)
+        engine = BatchingInferenceEngine(
+            session_provider=lambda: session, enabled=True, max_batch_size=2, max_wait_ms=200)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(engine.predict_mask, [Image.new("RGB", (32, 32))] * 2))
+
+        self.assertEqual(session.inner_session.batch_sizes, [1, 1])
+        self.assertEqual(engine.stats()["batches"], 1)
+
+    def test_errors_reach_the_caller(self):
+        """An inference failure is raised in the waiting request thread."""
+        def broken_session():
+            raise RuntimeError("model missing")
+
+        engine = BatchingInferenceEngine(session_provider=broken_session, enabled=True, max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            engine.predict_mask(Image.fromarray(np.zeros((8, 8, 3), dtype=np.uint8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,12 @@
 import os
 import unittest
+from unittest import mock
+
+from PIL import Image
+
 from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.mask_cache import MaskCache
+from app.image_processing.session_pool import session_pool
 
 
 class TestBackgroundRemover(unittest.TestCase):
@@ -15,6 +21,17 @@ class TestBackgroundRemover(unittest.TestCase):
         # Ensure the output directory exists
         os.makedirs(cls.output_dir, exist_ok=True)
 
+    def test_cache_key_covers_the_session_settings(self):
+        """Masks cached with another precision or graph optimization are not served."""
+        cache = MaskCache(enabled=True)
+        cache.put(BackgroundRemover.cache_key('digest'), Image.new('L', (8, 8), 255))
+        self.assertIsNotNone(cache.get(BackgroundRemover.cache_key('digest')))
+        other = 'int8' if session_pool.precision == 'fp32' else 'fp32'
+        with mock.patch.object(session_pool, 'precision', other):
+            self.assertIsNone(cache.get(BackgroundRemover.cache_key('digest')))
+        with mock.patch.object(session_pool, 'graph_optimization', 'disabled'):
+            self.assertIsNone(cache.get(BackgroundRemover.cache_key('digest')))
+
     def test_remove_background_batch_jpeg(self):
         """Test background removal for multiple jpeg images."""
         # Get all .jpg/ .jpeg files in the input directory
@@ -0,0 +1,174 @@
+import unittest
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.compositor import (MaskEdges, blend_over, composite_image, cutout_in_place, feather_mask,
+                                             mask_edges, refine_mask)
+from app.image_processing.mask_cache import mask_cache
+from app.image_processing.logo_adder import LogoAdder
+
+
+def random_pixels(shape, seed):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def pil_paste(dst, src, offset):
+    """Reference result: PIL paste with the source as its own mask."""
+    reference = Image.fromarray(dst)
+    overlay = Image.fromarray(src)
+    reference.paste(overlay, offset, overlay)
+    return np.asarray(reference)
+
+
+class TestBlendOver(unittest.TestCase):
+    def test_matches_pil_paste_on_rgb(self):
+        """Opaque RGB destinations match PIL paste exactly."""
+        dst = random_pixels((100, 160, 3), 0)
+        src = random_pixels((90, 130, 4), 1)
+        expected = pil_paste(dst, src, (5, 7))
+
+        blend_over(dst, src, (5, 7), band_rows=16)
+        np.testing.assert_array_equal(dst, expected)
+
+    def test_matches_pil_paste_on_opaque_rgba(self):
+        """Opaque RGBA destinations match PIL paste in colour and stay opaque."""
+        dst = random_pixels((100, 160, 4), 2)
+        dst[..., 3] = 255
+        src = random_pixels((90, 130, 4), 3)
+        expected = pil_paste(dst, src, (30, -20))
+
+        blend_over(dst, src, (30, -20), band_rows=16)
+        np.testing.assert_array_equal(dst[..., :3], expected[..., :3])
+        self.assertTrue((dst[..., 3] == 255).all())
+
+    def test_matches_alpha_composite_on_transparent_rgba(self):
+        """Transparent destinations are blended like Image.alpha_composite, within rounding."""
+        dst = random_pixels((60, 80, 4), 4)
+        src = random_pixels((40, 50, 4), 5)
+        expected = Image.fromarray(dst)
+        expected.alpha_composite(Image.fromarray(src), (10, 12))
+
+        blend_over(dst, src, (10, 12))
+        difference = np.abs(dst.astype(int) - np.asarray(expected).astype(int))
+        self.assertLessEqual(difference.max(), 1)
+
+    def test_only_the_covered_region_is_written(self):
+        """Pixels outside the source rectangle, or under fully transparent source pixels, are untouched."""
+        dst = random_pixels((50, 50, 3), 6)
+        original = dst.copy()
+        src = np.zeros((10, 10, 4), dtype=np.uint8)
+        src[2:4, 2:4] = 255
+
+        blend_over(dst, src, (20, 30))
+        changed = np.argwhere((dst != original).any(axis=2))
+        self.assertTrue(((changed >= (32, 22)) & (changed < (34, 24))).all())
+
+    def test_source_outside_destination(self):
+        """Offsets that place the source completely outside the destination are a no-op."""
+        dst = random_pixels((20, 20, 3), 7)
+        original = dst.copy()
+        blend_over(dst, random_pixels((10, 10, 4), 8), (-15, 30))
+        np.testing.assert_array_equal(dst, original)
+
+
+class TestCompositeImage(unittest.TestCase):
+    def test_rgb_base_stays_rgb(self):
+        """Compositing onto an RGB image keeps its mode and matches PIL paste."""
+        base = Image.fromarray(random_pixels((80, 120, 3), 9))
+        overlay = Image.fromarray(random_pixels((30, 40, 4), 10))
+        expected = pil_paste(np.asarray(base), np.asarray(overlay), (100, 60))
+
+        composite_image(base, overlay, (100, 60))
+        self.assertEqual(base.mode, 'RGB')
+        np.testing.assert_array_equal(np.asarray(base), expected)
+
+    def test_resized_rgb_base(self):
+        """RGB images whose padding byte is 0 (e.g. resized ones) are still blended as opaque."""
+        base = Image.fromarray(random_pixels((160, 240, 3), 12)).resize((120, 80))
+        overlay = Image.fromarray(random_pixels((30, 40, 4), 13))
+        expected = pil_paste(np.asarray(base), np.asarray(overlay), (10, 20))
+
+        composite_image(base, overlay, (10, 20))
+        np.testing.assert_array_equal(np.asarray(base), expected)
+
+    def test_opaque_background_gives_rgb_output(self):
+        """BackgroundApplier drops the alpha channel when the background is opaque."""
+        car = Image.fromarray(random_pixels((40, 60, 4), 11))
+        output = BackgroundApplier().apply(car, Image.new('RGB', (120, 80), (0, 128, 255)))
+        self.assertEqual(output.mode, 'RGB')
+        self.assertEqual(output.size, car.size)
+
+    def test_logo_on_rgba_image(self):
+        """LogoAdder keeps RGBA inputs RGBA and only changes the logo's box."""
+        image = Image.new('RGBA', (700, 300), (10, 20, 30, 255))
+        logo = Image.new('RGBA', (100, 50), (255, 0, 0, 255))
+        output = LogoAdder().add(image, logo, location='top-left')
+        self.assertEqual(output.mode, 'RGBA')
+        self.assertEqual(output.getpixel((10, 10)), (255, 0, 0, 255))
+        self.assertEqual(output.getpixel((200, 200)), (10, 20, 30, 255))
+
+    def test_logo_in_place(self):
+        """LogoAdder blends onto an array frame in place, with the same pixels as on a PIL image."""
+        image = random_pixels((300, 700, 4), 14)
+        image[..., 3] = 255
+        logo = Image.fromarray(random_pixels((50, 100, 4), 15))
+        expected = np.asarray(LogoAdder().add(Image.fromarray(image), logo, location='bottom-right'))
+
+        output = LogoAdder().add(image, logo, location='bottom-right', in_place=True)
+        self.assertIs(output, image)
+        np.testing.assert_array_equal(image, expected)
+
+
+class TestMaskRefinement(unittest.TestCase):
+    def test_cutout_in_place_matches_naive_cutout(self):
+        photo = random_pixels((150, 90, 3), 16)
+        mask = random_pixels((150, 90), 17)
+        expected = np.asarray(Image.composite(Image.fromarray(photo), Image.new('RGBA', (90, 150), 0),
+                                              Image.fromarray(mask)))
+        pixels = np.dstack([photo, np.full((150, 90), 255, dtype=np.uint8)])
+
+        self.assertIs(cutout_in_place(pixels, mask, band_rows=64), pixels)
+        np.testing.assert_array_equal(pixels, expected)
+
+    def test_refine_mask(self):
+        mask = np.array([[0, 10, 128, 245, 255]], dtype=np.uint8)
+        self.assertIs(refine_mask(mask), mask)
+        np.testing.assert_array_equal(mask, [[0, 0, 128, 255, 255]])
+
+    def test_feather_mask_matches_box_blur(self):
+        """feather_mask is a box blur with edge extension, computed in place."""
+        mask = np.zeros((40, 30), dtype=np.uint8)
+        mask[10:30, 5:25] = 255
+        expected = np.asarray(Image.fromarray(mask).filter(ImageFilter.BoxBlur(3)))
+
+        self.assertIs(feather_mask(mask, 3, band_lines=8), mask)
+        difference = np.abs(mask.astype(int) - expected.astype(int))
+        self.assertLessEqual(difference.max(), 1)
+
+    def test_mask_edges(self):
+        """Disabled by default; when enabled the mask is refined on a copy, never in place."""
+        mask = Image.fromarray(np.array([[0, 10, 128, 245, 255]], dtype=np.uint8))
+        self.assertIs(MaskEdges().apply(mask), mask)
+
+        edges = MaskEdges()
+        edges.configure({'refine': True})
+        self.assertEqual(np.asarray(edges.apply(mask)).ravel().tolist(), [0, 0, 128, 255, 255])
+        self.assertEqual(np.asarray(mask).ravel().tolist(), [0, 10, 128, 245, 255])
+
+    def test_background_remover_applies_mask_edges(self):
+        photo = Image.new('RGB', (5, 1), (200, 30, 30))
+        mask = Image.fromarray(np.array([[0, 10, 128, 245, 255]], dtype=np.uint8))
+        mask_cache.put(BackgroundRemover.cache_key('edges-test'), mask)
+        mask_edges.configure({'refine': True})
+        try:
+            cutout = BackgroundRemover().remove(photo, digest='edges-test')
+        finally:
+            mask_edges.configure()
+        self.assertEqual(np.asarray(cutout.getchannel('A')).ravel().tolist(), [0, 0, 128, 255, 255])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import unittest
+
+from PIL import Image
+
+from app.image_processing.encoders import OutputEncoder, has_alpha
+
+
+def cutout(size=(64, 48)):
+    """A car cutout: opaque in the middle, transparent around it."""
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    image.paste((200, 30, 30, 255), (16, 12, 48, 36))
+    return image
+
+
+class TestOutputEncoder(unittest.TestCase):
+    def setUp(self):
+        self.encoder = OutputEncoder()
+        self.encoder.configure({'variants': {'thumbnail': 400}})
+
+    def test_png_by_default(self):
+        """Without a format or image types in Accept, the output stays PNG."""
+        encoded = self.encoder.encode(cutout())
+        self.assertEqual((encoded.format, encoded.mimetype, encoded.extension), ('png', 'image/png', '.png'))
+        self.assertEqual(Image.open(io.BytesIO(encoded.data)).format, 'PNG')
+
+    def test_auto_picks_by_transparency(self):
+        self.assertEqual(self.encoder.choose_format(cutout(), 'auto'), 'webp')
+        self.assertEqual(self.encoder.choose_format(Image.new('RGB', (8, 8)), 'auto'), 'jpeg')
+        # An RGBA composite on an opaque background has no transparency left
+        self.assertEqual(self.encoder.choose_format(Image.new('RGBA', (8, 8), (1, 2, 3, 255)), 'auto'), 'jpeg')
+
+    def test_accept_negotiation(self):
+        """The first accepted type in preference order wins; JPEG is never negotiated for cutouts."""
+        self.assertEqual(self.encoder.choose_format(cutout(), accept=['image/jpeg', 'image/webp']), 'webp')
+        self.assertEqual(self.encoder.choose_format(cutout(), accept=['image/jpeg']), 'png')
+        self.assertEqual(self.encoder.choose_format(Image.new('RGB', (8, 8)), accept=['image/jpeg']), 'jpeg')
+
+    def test_explicit_format_wins(self):
+        self.assertEqual(self.encoder.choose_format(cutout(), 'png', accept=['image/webp']), 'png')
+        with self.assertRaises(ValueError):
+            self.encoder.choose_format(cutout(), 'gif')
+
+    def test_webp_keeps_alpha(self):
+        decoded = Image.open(io.BytesIO(self.encoder.encode(cutout(), 'webp').data))
+        self.assertEqual(decoded.mode, 'RGBA')
+        self.assertEqual(decoded.getpixel((0, 0))[3], 0)
+        self.assertEqual(decoded.getpixel((32, 24))[3], 255)
+
+    def test_jpeg_flattens_onto_white(self):
+        decoded = Image.open(io.BytesIO(self.encoder.encode(cutout(), 'jpeg', quality=95).data))
+        self.assertEqual(decoded.mode, 'RGB')
+        self.assertTrue(all(channel > 245 for channel in decoded.getpixel((0, 0))))
+
+    def test_quality_changes_lossy_size(self):
+        noisy = Image.effect_noise((256, 256), 64).convert('RGB')
+        self.assertLess(len(self.encoder.encode(noisy, 'webp', quality=20)),
+                        len(self.encoder.encode(noisy, 'webp', quality=95)))
+
+    def test_variants(self):
+        self.assertIsNone(self.encoder.max_size())
+        self.assertIsNone(self.encoder.max_size('full'))
+        self.assertEqual(self.encoder.max_size('thumbnail'), 400)
+        with self.assertRaises(ValueError):
+            self.encoder.check(variant='poster')
+
+    def test_has_alpha(self):
+        self.assertTrue(has_alpha(cutout()))
+        self.assertFalse(has_alpha(Image.new('RGBA', (8, 8), (0, 0, 0, 255))))
+        self.assertFalse(has_alpha(Image.new('RGB', (8, 8))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import io
+import os
+import pickle
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.frame_ring import FrameRing
+from app.image_processing.image_io import decode_image
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+
+
+def png_bytes(image):
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRing()
+        self.ring.configure({'frames': 2, 'frame_max_megapixels': 0.01})
+        self.ring.create()
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_decode_into_slot(self):
+        """Photos are decoded to RGBA in the slot, the handle sees the same pixels after pickling."""
+        photo = Image.new('RGB', (40, 30), (10, 20, 30))
+        with self.ring.decode(png_bytes(photo), digest='abc') as frame:
+            handle = pickle.loads(pickle.dumps(frame))
+            pixels = handle.pixels()
+            self.assertEqual(pixels.shape, (30, 40, 4))
+            self.assertEqual(pixels[0, 0].tolist(), [10, 20, 30, 255])
+            self.assertEqual(handle.digest, 'abc')
+            # Writable in place, as the worker processes do
+            pixels[0, 0, 3] = 0
+            self.assertEqual(frame.pixels()[0, 0, 3], 0)
+            del pixels
+
+    def test_jpeg_decoded_into_slot(self):
+        """An upright JPEG is decoded by PIL straight into the slot, opaque, with the pixels of a plain decode."""
+        with open(os.path.join(TEST_DATA, 'car', 'car2.jpg'), 'rb') as f:
+            data = f.read()
+        ring = FrameRing()
+        ring.configure({'frames': 1})
+        ring.create()
+        try:
+            decoded = np.asarray(decode_image(data))
+            # No image memory of the photo's size is allocated besides the slot
+            with mock.patch.object(Image.core, 'new', wraps=Image.core.new) as allocate, \
+                    ring.decode(data) as frame:
+                self.assertNotIn(frame.size, [call.args[1] for call in allocate.call_args_list])
+                pixels = frame.pixels()
+                np.testing.assert_array_equal(pixels[..., :3], decoded)
+                self.assertTrue((pixels[..., 3] == 255).all())
+                del pixels
+        finally:
+            ring.close()
+
+    def test_icc_profile_and_scaling(self):
+        with open(os.path.join(TEST_DATA, 'car', 'car2.jpg'), 'rb') as f:
+            data = f.read()
+        ring = FrameRing()
+        ring.configure({'frames': 1})
+        ring.create()
+        try:
+            with ring.decode(data, max_size=100) as frame:
+                self.assertEqual(max(frame.size), 100)
+                self.assertEqual(frame.info.get('icc_profile'),
+                                 Image.open(io.BytesIO(data)).info.get('icc_profile'))
+        finally:
+            ring.close()
+
+    def test_larger_than_a_slot(self):
+        with self.ring.decode(png_bytes(Image.new('RGB', (200, 200)))) as frame:
+            self.assertIsNone(frame)
+
+    def test_slots_are_reused_and_bounded(self):
+        """Every slot is returned, a request waits while all slots are held."""
+        data = png_bytes(Image.new('RGBA', (10, 10), (1, 2, 3, 4)))
+        with self.ring.decode(data) as first, self.ring.decode(data) as second:
+            self.assertNotEqual(first.slot, second.slot)
+            waiting = threading.Thread(target=lambda: self.ring.decode(data).__enter__())
+            waiting.start()
+            waiting.join(0.2)
+            self.assertTrue(waiting.is_alive())
+        waiting.join(1)
+        self.assertFalse(waiting.is_alive())
+        with self.ring.decode(data) as frame:
+            np.testing.assert_array_equal(frame.pixels()[5, 5], [1, 2, 3, 4])
+
+    def test_disabled_without_slots(self):
+        ring = FrameRing()
+        ring.configure({'frames': 0})
+        self.assertFalse(ring.create().enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
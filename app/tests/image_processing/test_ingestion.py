@@ -0,0 +1,74 @@
+import io
+import unittest
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from app.image_processing.image_io import decode_image
+from app.image_processing.ingestion import ImageIngestion, UploadRejected
+
+
+def encoded(size, format, **params):
+    output = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(output, format=format, **params)
+    return output.getvalue()
+
+
+def upload(data, filename='car.jpg'):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+class TestImageIngestion(unittest.TestCase):
+    def test_read_returns_the_uploaded_bytes(self):
+        data = encoded((64, 48), 'JPEG')
+        self.assertEqual(ImageIngestion().read(upload(data)), data)
+        self.assertIsNone(ImageIngestion().read(None))
+
+    def test_file_size_limit(self):
+        ingestion = ImageIngestion()
+        ingestion.configure(max_file_mb=0.001)
+        with self.assertRaises(UploadRejected) as context:
+            ingestion.read(upload(encoded((256, 256), 'PNG', compress_level=0)))
+        self.assertEqual(context.exception.status, 413)
+
+    def test_pixel_limit_from_header(self):
+        """Oversized images are rejected from their header."""
+        ingestion = ImageIngestion()
+        ingestion.configure({'max_pixels': 1000})
+        with self.assertRaises(UploadRejected) as context:
+            ingestion.read(upload(encoded((64, 48), 'PNG')))
+        self.assertEqual(context.exception.status, 413)
+
+    def test_format_allow_list(self):
+        ingestion = ImageIngestion()
+        ingestion.configure({'formats': ['png']})
+        with self.assertRaises(UploadRejected) as context:
+            ingestion.read(upload(encoded((64, 48), 'JPEG')))
+        self.assertEqual(context.exception.status, 415)
+
+    def test_not_an_image(self):
+        with self.assertRaises(UploadRejected) as context:
+            ImageIngestion().read(upload(b'not an image'))
+        self.assertEqual(context.exception.status, 400)
+
+
+class TestDraftDecoding(unittest.TestCase):
+    def test_jpeg_decoded_at_reduced_scale(self):
+        """A JPEG is decoded at the smallest 1/2^n scale that still covers the target size."""
+        data = encoded((1600, 1200), 'JPEG')
+        self.assertEqual(decode_image(data).size, (1600, 1200))
+        self.assertEqual(decode_image(data, (300, 300)).size, (400, 300))
+
+    def test_rotated_jpeg(self):
+        """The target size applies to the upright image of photos with an EXIF rotation."""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees clockwise
+        data = encoded((1600, 1200), 'JPEG', exif=exif)
+        self.assertEqual(decode_image(data, (300, 400)).size, (300, 400))
+
+    def test_png_is_decoded_at_full_size(self):
+        self.assertEqual(decode_image(encoded((160, 120), 'PNG'), (40, 30)).size, (160, 120))
+
+
+if __name__ == "__main__":
+    unittest.main()
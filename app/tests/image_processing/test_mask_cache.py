@@ -0,0 +1,81 @@
+import os
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+
+from app.image_processing.lru_cache import LRUCache
+from app.image_processing.mask_cache import MaskCache, digest_bytes
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used_by_bytes(self):
+        """Entries are evicted oldest-first once the byte budget is exceeded."""
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", "A", 4)
+        cache.put("b", "B", 4)
+        cache.get("a")
+        cache.put("c", "C", 4)
+
+        self.assertEqual(cache.get("a"), "A")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.current_bytes, 8)
+
+    def test_oversized_values_are_not_cached(self):
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", "A", 11)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestMaskCache(unittest.TestCase):
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp()
+        self.mask = Image.new("L", (40, 30), 200)
+
+    def _cache(self, **settings):
+        cache = MaskCache()
+        cache.configure({"enabled": True, "disk_dir": self.disk_dir, **settings})
+        return cache
+
+    def test_key_depends_on_model_and_params(self):
+        digest = digest_bytes(b"car")
+        self.assertNotEqual(MaskCache.key(digest, "u2net"), MaskCache.key(digest, "u2netp"))
+        self.assertNotEqual(MaskCache.key(digest, "u2net"), MaskCache.key(digest, "u2net", size=1024))
+        self.assertEqual(MaskCache.key(digest, "u2net"), MaskCache.key(digest, "u2net"))
+
+    def test_disk_tier_is_shared(self):
+        """A mask written by one worker's cache is a hit for another worker's cache."""
+        key = MaskCache.key(digest_bytes(b"car"), "u2net")
+        self._cache().put(key, self.mask)
+
+        other_worker = self._cache()
+        mask = other_worker.get(key)
+        self.assertEqual(mask.size, self.mask.size)
+        self.assertEqual(mask.getpixel((0, 0)), 200)
+        self.assertEqual(other_worker.stats()["disk"]["hits"], 1)
+
+    def test_disk_ttl(self):
+        """Expired disk entries are misses and get removed."""
+        key = MaskCache.key(digest_bytes(b"car"), "u2net")
+        self._cache().put(key, self.mask)
+        path = os.path.join(self.disk_dir, key[:2], f"{key}.png")
+        old = time.time() - 3600
+        os.utime(path, (old, old))
+
+        self.assertIsNone(self._cache(ttl_seconds=60).get(key))
+        self.assertFalse(os.path.exists(path))
+
+    def test_disk_size_eviction(self):
+        """The disk tier evicts the oldest masks once it outgrows disk_max_mb."""
+        cache = self._cache(disk_max_mb=0.005)  # ~5KB, about ten noisy masks
+        keys = [MaskCache.key(digest_bytes(bytes([i])), "u2net") for i in range(20)]
+        for key in keys:
+            cache.put(key, Image.effect_noise((20, 20), 64))
+        self.assertGreater(cache.disk.evictions, 0)
+        self.assertIsNotNone(cache.disk.get(keys[-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import io
+import json
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.ingestion import UploadRejected
+from app.image_processing.mask_codec import (bounding_box, decode_mask, decode_polygons, decode_rle,
+                                             encode_polygons, encode_rle)
+
+
+def car_mask():
+    """A 60x40 mask: an opaque body with a transparent window, soft pixels around it."""
+    mask = np.zeros((40, 60), dtype=np.uint8)
+    mask[10:30, 5:50] = 255
+    mask[14:20, 20:30] = 0
+    mask[9, 5:50] = 60
+    return Image.fromarray(mask)
+
+
+class TestMaskCodec(unittest.TestCase):
+    def test_bounding_box(self):
+        mask = car_mask()
+        self.assertEqual(bounding_box(mask), (5, 9, 50, 30))
+        cutout = np.zeros((40, 60, 4), dtype=np.uint8)
+        cutout[..., 3] = np.asarray(mask)
+        self.assertEqual(bounding_box(cutout), (5, 9, 50, 30))
+        self.assertEqual(bounding_box(Image.fromarray(cutout)), (5, 9, 50, 30))
+        self.assertIsNone(bounding_box(np.zeros((4, 4, 4), dtype=np.uint8)))
+
+    def test_rle_round_trip(self):
+        mask = car_mask()
+        rle = encode_rle(mask)
+        self.assertEqual(rle['size'], [60, 40])
+        # Thresholded at 50%: the soft row is transparent
+        expected = np.where(np.asarray(mask) >= 128, 255, 0)
+        np.testing.assert_array_equal(np.asarray(decode_rle(json.loads(json.dumps(rle)))), expected)
+
+        opaque = encode_rle(Image.new('L', (3, 2), 255))
+        self.assertEqual(opaque['counts'], [0, 6])
+
+    def test_polygon_round_trip(self):
+        mask = car_mask()
+        document = encode_polygons(mask)
+        self.assertEqual(len(document['polygons']), 1)
+        self.assertEqual(len(document['holes']), 1)
+        decoded = np.asarray(decode_polygons(document)) >= 128
+        expected = np.asarray(mask) >= 128
+        # Polygon outlines are drawn inclusively, so edges may differ by a pixel
+        self.assertLess((decoded != expected).mean(), 0.05)
+        self.assertFalse(decoded[16, 25])
+
+    def test_decode_mask(self):
+        mask = car_mask()
+        output = io.BytesIO()
+        mask.save(output, format='PNG')
+        self.assertEqual(np.asarray(decode_mask(output.getvalue(), (60, 40))).tolist(), np.asarray(mask).tolist())
+        # Made on a resized variant: scaled to the photo
+        self.assertEqual(decode_mask(json.dumps(encode_rle(mask)).encode(), (120, 80)).size, (120, 80))
+
+        # A cutout's alpha channel is its mask
+        cutout = Image.new('RGBA', (60, 40), (200, 10, 10, 0))
+        cutout.putalpha(mask)
+        output = io.BytesIO()
+        cutout.save(output, format='PNG')
+        self.assertEqual(np.asarray(decode_mask(output.getvalue(), (60, 40))).tolist(), np.asarray(mask).tolist())
+
+    def test_invalid_json_masks(self):
+        for document in (b'{"counts": [1]}', b'{"size": [2, 2], "counts": [1, 2]}', b'{"size": [2, 2],',
+                         b'{"size": [2, 2], "polygons": [[1, 2]]}'):
+            with self.assertRaises(UploadRejected) as raised:
+                decode_mask(document, (2, 2))
+            self.assertEqual(raised.exception.status, 400)
+        with self.assertRaises(UploadRejected) as raised:
+            decode_mask(b'{"size": [100000, 100000], "counts": []}', (2, 2))
+        self.assertEqual(raised.exception.status, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
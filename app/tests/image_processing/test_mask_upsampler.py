@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.mask_cache import MaskCache
+from app.image_processing.mask_upsampler import MaskUpsampler, _box_mean
+
+
+def disc_photo(size=(1600, 1200)):
+    """A photo of a disc that differs from the background in colour only, and its true mask."""
+    width, height = size
+    y, x = np.ogrid[:height, :width]
+    inside = (x - width / 2) ** 2 + (y - height / 2) ** 2 < (height / 3) ** 2
+    pixels = np.where(inside[..., None], np.uint8([200, 30, 30]), np.uint8([20, 120, 220])).astype(np.uint8)
+    return Image.fromarray(pixels), inside.astype(np.uint8) * 255
+
+
+def model_like_mask(truth, proxy):
+    """A mask as soft as the one u2net returns: the truth at 320x320, resized to the proxy."""
+    return Image.fromarray(truth).resize((320, 320), Image.Resampling.LANCZOS).resize(
+        proxy.size, Image.Resampling.LANCZOS)
+
+
+class TestMaskUpsampler(unittest.TestCase):
+    def test_proxy_size(self):
+        """Large photos are downsampled to inference_size, small ones and full mode are left alone."""
+        photo = Image.new('RGB', (4000, 3000))
+        self.assertEqual(MaskUpsampler(inference_size=1000).proxy(photo).size, (1000, 750))
+        self.assertIs(MaskUpsampler(mode='full').proxy(photo), photo)
+        small = Image.new('RGB', (800, 600))
+        self.assertIs(MaskUpsampler(inference_size=1000).proxy(small), small)
+
+    def test_params_only_in_downsampling_modes(self):
+        """Full mode keeps the mask cache keys of earlier releases."""
+        self.assertEqual(MaskUpsampler(mode='full').params(), {})
+        self.assertNotEqual(
+            MaskCache.key('digest', 'u2net', **MaskUpsampler(inference_size=512).params()),
+            MaskCache.key('digest', 'u2net', **MaskUpsampler(inference_size=1024).params()))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            MaskUpsampler(mode='bicubic')
+
+    def test_upsampled_mask_matches_photo_size(self):
+        photo, truth = disc_photo()
+        for mode in ('fast', 'guided'):
+            upsampler = MaskUpsampler(mode=mode, inference_size=400, band_rows=100)
+            proxy = upsampler.proxy(photo)
+            mask = upsampler.upsample(model_like_mask(truth, proxy), proxy, photo)
+            self.assertEqual(mask.mode, 'L')
+            self.assertEqual(mask.size, photo.size)
+
+    def test_guided_edges_follow_the_photo(self):
+        """The guided filter recovers the disc edge better than bilinear upsampling."""
+        photo, truth = disc_photo()
+        errors = {}
+        for mode in ('fast', 'guided'):
+            upsampler = MaskUpsampler(mode=mode, inference_size=400)
+            proxy = upsampler.proxy(photo)
+            mask = upsampler.upsample(model_like_mask(truth, proxy), proxy, photo)
+            errors[mode] = np.abs(np.asarray(mask, dtype=np.int32) - truth).mean()
+        self.assertLess(errors['guided'], errors['fast'])
+
+    def test_box_mean(self):
+        """Window means with replicated edges."""
+        x = np.random.default_rng(0).random((7, 9)).astype(np.float32)
+        padded = np.pad(x, 2, mode='edge')
+        expected = np.array([[padded[i:i + 5, j:j + 5].mean() for j in range(9)] for i in range(7)])
+        np.testing.assert_allclose(_box_mean(x, 2), expected, atol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
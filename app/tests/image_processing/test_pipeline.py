@@ -0,0 +1,52 @@
+import os
+import unittest
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.image_io import decode_image, encode_image
+from app.image_processing.logo_adder import LogoAdder
+from app.image_processing.pipeline import ImagePipeline
+
+
+class TestImagePipeline(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Load the test images once, in memory."""
+        test_data_dir = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+        with open(os.path.join(test_data_dir, 'bg_removed_car', 'car1.png'), 'rb') as f:
+            cls.car_bytes = f.read()
+        cls.background = Image.open(os.path.join(test_data_dir, 'background', 'bg2.jpg'))
+        cls.logo = Image.open(os.path.join(test_data_dir, 'logo', 'logo1.png'))
+
+    def test_background_and_logo_stages(self):
+        """Stages run in order on the decoded image and the result is encoded once."""
+        pipeline = ImagePipeline()
+        pipeline.add_stage('apply_background', partial(
+            BackgroundApplier().apply, background=self.background))
+        pipeline.add_stage('add_logo', partial(
+            LogoAdder().add, logo=self.logo, location='top-right'))
+
+        output = decode_image(pipeline.process(self.car_bytes))
+        car = decode_image(self.car_bytes)
+        self.assertEqual(output.size, car.size)
+        # The JPEG background is opaque, so no alpha channel is encoded
+        self.assertEqual(output.mode, 'RGB')
+
+    def test_numpy_in_numpy_out(self):
+        """numpy callers get numpy arrays back."""
+        car = np.asarray(decode_image(self.car_bytes))
+        output = LogoAdder().add(car, np.asarray(self.logo.convert('RGBA')))
+        self.assertIsInstance(output, np.ndarray)
+        self.assertEqual(output.shape[:2], car.shape[:2])
+
+    def test_encode_roundtrip(self):
+        """encode_image and decode_image are inverse for PNG."""
+        image = Image.new('RGBA', (8, 4), (1, 2, 3, 4))
+        self.assertEqual(decode_image(encode_image(image)).getpixel((0, 0)), (1, 2, 3, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from app.image_processing.encoders import EncodedImage
+from app.image_processing.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.cache.configure({'memory_max_mb': 1}, {'rembg': {'model': 'u2net'}})
+
+    def test_etag_from_inputs(self):
+        output = {'format': None, 'quality': None, 'variant': None, 'accept': ['image/webp']}
+        etag = self.cache.etag('add_logo', (b'car',), {'logo_data': b'logo', 'position': 'top-left'}, output)
+
+        self.assertEqual(etag, self.cache.etag('add_logo', (bytearray(b'car'),),
+                                               {'position': 'top-left', 'logo_data': b'logo'}, dict(output)))
+        self.assertNotEqual(etag, self.cache.etag('add_logo', (b'car',),
+                                                  {'logo_data': b'logo2', 'position': 'top-left'}, output))
+        self.assertNotEqual(etag, self.cache.etag('add_logo', (b'car',),
+                                                  {'logo_data': b'logo', 'position': 'top-left'},
+                                                  {**output, 'accept': []}))
+        # A model or encoder change makes new ETags
+        other_settings = ResponseCache()
+        other_settings.configure({}, {'rembg': {'model': 'isnet'}})
+        self.assertNotEqual(etag, other_settings.etag('add_logo', (b'car',),
+                                                      {'logo_data': b'logo', 'position': 'top-left'}, output))
+
+    def test_requested_format_ignores_accept(self):
+        output = {'format': 'png', 'quality': None, 'variant': None}
+        self.assertEqual(self.cache.etag('remove_background', (b'car',), {}, {**output, 'accept': ['image/webp']}),
+                         self.cache.etag('remove_background', (b'car',), {}, {**output, 'accept': []}))
+
+    def test_bounded(self):
+        self.cache.put('a', EncodedImage(b'x' * 600 * 1024, 'png'))
+        self.cache.put('b', {'size': [1, 1], 'counts': [0, 1]})
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+        self.cache.put('c', EncodedImage(b'x' * 600 * 1024, 'png'))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b')['counts'], [0, 1])
+
+    def test_disabled(self):
+        self.cache.configure({'enabled': False})
+        self.cache.put('a', EncodedImage(b'x', 'png'))
+        self.assertIsNone(self.cache.get('a'))
+
+
+if __name__ == "__main__":
+    unittest.main()
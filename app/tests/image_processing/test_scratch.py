@@ -0,0 +1,79 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.app import app
+from app.image_processing.scratch import ScratchBuffers, ScratchFull, ScratchRequest, scratch_buffers
+
+
+class TestScratchBuffers(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.buffers = ScratchBuffers()
+        self.buffers.configure({'directory': self.directory, 'memory_max_mb': 1, 'max_mb': 3})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_memory_first_then_directory(self):
+        with self.buffers.spooled() as small:
+            small.write(b'x' * 1000)
+            self.assertFalse(small._rolled)
+        with self.buffers.spooled() as large:
+            large.write(b'x' * (2 * 1024 * 1024))
+            self.assertTrue(large._rolled)
+            # Spilled to the scratch directory as an unlinked file
+            self.assertTrue(os.readlink(f'/proc/self/fd/{large.fileno()}').startswith(self.directory))
+            self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.buffers.in_use(), 0)
+
+    def test_size_cap(self):
+        first = self.buffers.spooled()
+        first.write(b'x' * (2 * 1024 * 1024))
+        with self.assertRaises(ScratchFull) as raised:
+            with self.buffers.spooled() as second:
+                second.write(b'x' * (2 * 1024 * 1024))
+        self.assertEqual(raised.exception.status, 503)
+        first.close()
+        self.assertEqual(self.buffers.in_use(), 0)
+
+    def test_path_removed_on_exit(self):
+        with self.assertRaises(RuntimeError):
+            with self.buffers.path(b'data', suffix='.png') as path:
+                self.assertEqual(open(path, 'rb').read(), b'data')
+                self.assertEqual(self.buffers.in_use(), 4)
+                raise RuntimeError('backend failed')
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.buffers.in_use(), 0)
+
+    def test_sweep_orphans(self):
+        orphan = os.path.join(self.directory, '999999999-abc.png')
+        stray = os.path.join(self.directory, 'unknown.tmp')
+        own = os.path.join(self.directory, f'{os.getpid()}-def.png')
+        for path in (orphan, stray, own):
+            open(path, 'wb').close()
+
+        self.assertEqual(self.buffers.sweep(), 2)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(own)])
+
+    def test_uploads_spooled_by_the_app(self):
+        self.assertIs(app.request_class, ScratchRequest)
+        test_data = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+        with open(os.path.join(test_data, 'car', 'car2.jpg'), 'rb') as f:
+            car = f.read()
+        with open(os.path.join(test_data, 'logo', 'logo1.png'), 'rb') as f:
+            logo = f.read()
+
+        response = app.test_client().post('/api/v1/add-logo', data={
+            'image': (io.BytesIO(car), 'car2.jpg'), 'logo': (io.BytesIO(logo), 'logo1.png'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        # Closed with the request
+        self.assertEqual(scratch_buffers.in_use(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
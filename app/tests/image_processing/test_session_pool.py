@@ -0,0 +1,151 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.image_processing.backends import backends
+from app.image_processing.session_pool import SessionPool, quantize_model, resolve_model_name
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _field(number, value):
+    """Protobuf field: varint for ints, length-delimited for bytes/str."""
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def identity_model():
+    """A float[1,3] -> float[1,3] ONNX model of one Identity node, without the onnx package."""
+    shape = _field(1, _field(1, 1)) + _field(1, _field(1, 3))
+    tensor_type = _field(1, _field(1, 1) + _field(2, shape))
+    node = _field(1, "x") + _field(2, "y") + _field(4, "Identity")
+    graph = (_field(1, node) + _field(2, "g") + _field(11, _field(1, "x") + _field(2, tensor_type)) +
+             _field(12, _field(1, "y") + _field(2, tensor_type)))
+    return _field(1, 8) + _field(7, graph) + _field(8, _field(1, "") + _field(2, 13))
+
+
+class TestSessionPool(unittest.TestCase):
+    def test_resolve_model_aliases(self):
+        """Friendly config names map to rembg session names."""
+        self.assertEqual(resolve_model_name("u2net"), "u2net")
+        self.assertEqual(resolve_model_name("isnet"), "isnet-general-use")
+
+    def test_unsupported_model(self):
+        """An unknown model is rejected when the pool is configured."""
+        pool = SessionPool()
+        with self.assertRaises(ValueError):
+            pool.configure({"model": "not-a-model"})
+
+    def test_thread_settings(self):
+        """Configured thread counts are applied to the onnxruntime options."""
+        pool = SessionPool()
+        pool.configure({"model": "u2netp", "intra_op_threads": 2, "inter_op_threads": 1})
+        sess_opts = pool.session_options()
+        self.assertEqual(sess_opts.intra_op_num_threads, 2)
+        self.assertEqual(sess_opts.inter_op_num_threads, 1)
+
+    def test_status_before_load(self):
+        """Status reports an unloaded model until the first session is built."""
+        status = SessionPool(model="silueta").status()
+        self.assertEqual(status["model"], "silueta")
+        self.assertFalse(status["loaded"])
+        self.assertFalse(status["warmed_up"])
+
+    def test_preload_reads_the_model_once(self):
+        """preload() keeps the model bytes, later sessions are built from them instead of the file."""
+        u2net_home = tempfile.mkdtemp()
+        with open(os.path.join(u2net_home, 'u2netp.onnx'), 'wb') as f:
+            f.write(b'not a real model')
+        pool = SessionPool()
+        pool.configure({"model": "u2netp"})
+        with mock.patch.dict(os.environ, {'U2NET_HOME': u2net_home, 'MODEL_CHECKSUM_DISABLED': '1'}):
+            self.assertEqual(pool.preload(), 16)
+        os.remove(os.path.join(u2net_home, 'u2netp.onnx'))
+
+        # onnxruntime gets the preloaded bytes, the file is gone
+        with self.assertRaisesRegex(Exception, 'protobuf|INVALID'):
+            pool.get_session()
+        self.assertIsNotNone(pool.status()["error"])
+
+    def test_graph_optimization_level(self):
+        ort = backends.get("onnxruntime")
+        pool = SessionPool()
+        pool.configure({"graph_optimization": "basic"})
+        self.assertEqual(pool.session_options().graph_optimization_level,
+                         ort.GraphOptimizationLevel.ORT_ENABLE_BASIC)
+        # A saved optimized graph is loaded without optimizing it again
+        self.assertEqual(pool.session_options(optimized=True).graph_optimization_level,
+                         ort.GraphOptimizationLevel.ORT_DISABLE_ALL)
+        with self.assertRaises(ValueError):
+            pool.configure({"graph_optimization": "max"})
+        with self.assertRaises(ValueError):
+            SessionPool().configure({"precision": "fp16"})
+
+    def test_uninstalled_providers_skipped(self):
+        pool = SessionPool()
+        pool.configure({"providers": ["NotInstalledExecutionProvider", "CPUExecutionProvider"]})
+        self.assertEqual(pool.providers_in_use(), ["CPUExecutionProvider"])
+        pool.configure({"providers": ["NotInstalledExecutionProvider"]})
+        self.assertEqual(pool.providers_in_use(), ["CPUExecutionProvider"])
+
+    def test_optimized_graph_saved_and_reused(self):
+        """The first session saves the optimized graph, later ones are built from it."""
+        directory = tempfile.mkdtemp()
+        model_path = os.path.join(directory, "u2netp.onnx")
+        with open(model_path, "wb") as f:
+            f.write(identity_model())
+        pool = SessionPool()
+        pool.configure({"model": "u2netp", "optimized_model_dir": directory})
+
+        with mock.patch.object(pool, "model_path", return_value=model_path):
+            session = pool.get_session()
+            optimized_path = pool.optimized_model_path("u2netp")
+            self.assertTrue(os.path.exists(optimized_path))
+            self.assertEqual(session.inner_session.run(None, {"x": np.ones((1, 3), np.float32)})[0].shape, (1, 3))
+
+            os.remove(model_path)
+            pool.reset()
+            _model_bytes, optimized = pool.read_model("u2netp")
+            self.assertTrue(optimized)
+            self.assertIsNotNone(pool.get_session().inner_session)
+        self.assertEqual(pool.status()["precision"], "fp32")
+
+    def test_int8_model_path(self):
+        """int8 models are quantized once next to the fp32 file and reused afterwards."""
+        directory = tempfile.mkdtemp()
+        pool = SessionPool()
+        pool.configure({"model": "u2netp", "precision": "int8", "optimized_model_dir": directory})
+        session_class = mock.Mock(download_models=mock.Mock(return_value=os.path.join(directory, "u2netp.onnx")))
+        with mock.patch("app.image_processing.session_pool._session_class", return_value=session_class), \
+                mock.patch("app.image_processing.session_pool.quantize_model") as quantize:
+            path = pool.model_path("u2netp")
+            quantize.assert_called_once_with(os.path.join(directory, "u2netp.onnx"), path)
+            with open(path, "wb") as f:
+                f.write(b"quantized")
+            self.assertEqual(pool.model_path("u2netp"), path)
+            quantize.assert_called_once()
+
+    def test_quantization_without_onnx(self):
+        if importlib.util.find_spec("onnx") is not None:
+            self.skipTest("onnx is installed")
+        with self.assertRaisesRegex(RuntimeError, "onnx"):
+            quantize_model("u2net.onnx", os.path.join(tempfile.mkdtemp(), "u2net.int8.onnx"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from app.app import app
+from app.image_processing import workflows
+from app.image_processing.bg_applier import BackgroundApplier
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.mask_cache import digest_bytes, mask_cache
+from app.image_processing.tiling import PngWriter, tiled_compositor
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+
+
+def read(*path):
+    with open(os.path.join(TEST_DATA, *path), 'rb') as f:
+        return f.read()
+
+
+def pixels(encoded):
+    return premultiplied(np.asarray(Image.open(io.BytesIO(encoded.data))))
+
+
+def premultiplied(pixels):
+    """Colours weighted by alpha: un-premultiplying amplifies rounding where alpha is low."""
+    pixels = pixels.astype(float)
+    if pixels.shape[2] == 4:
+        pixels[..., :3] *= pixels[..., 3:] / 255
+    return np.round(pixels)
+
+
+def seed_mask(data):
+    # A cached mask stands in for the model
+    mask = Image.new('L', (64, 48))
+    mask.paste(255, (16, 12, 48, 40))
+    mask_cache.put(BackgroundRemover.cache_key(digest_bytes(data)), mask)
+
+
+class TestPngWriter(unittest.TestCase):
+    def test_decodes_to_the_rows_written(self):
+        rng = np.random.default_rng(0)
+        # Noise and flat areas, so every filter type gets chosen
+        image = rng.integers(0, 256, (50, 37, 4), dtype=np.uint8)
+        image[20:40] = image[20, 5]
+        for mode in ('RGB', 'RGBA'):
+            writer = PngWriter((37, 50), mode, compress_level=6, icc_profile=b'not really a profile')
+            for top in range(0, 50, 16):
+                writer.write(image[top:top + 16])
+            decoded = Image.open(io.BytesIO(writer.close()))
+            self.assertEqual(decoded.mode, mode)
+            self.assertEqual(decoded.info.get('icc_profile'), b'not really a profile')
+            np.testing.assert_array_equal(np.asarray(decoded), image[..., :len(mode)])
+
+    def test_missing_rows(self):
+        writer = PngWriter((8, 8))
+        writer.write(np.zeros((4, 8, 4), dtype=np.uint8))
+        with self.assertRaises(ValueError):
+            writer.close()
+
+
+class TestFitBackgroundRows(unittest.TestCase):
+    def test_bands_match_the_whole_fitted_background(self):
+        background = Image.open(io.BytesIO(read('background', 'bg2.jpg')))
+        translucent = background.convert('RGBA')
+        translucent.putalpha(Image.linear_gradient('L').resize(background.size))
+        for source in (background, translucent):
+            source = BackgroundApplier.background_source(source)
+            # Scaled up and down
+            for size in ((1000, 700), (300, 170)):
+                whole = premultiplied(np.asarray(BackgroundApplier.fit_background(source, size)))
+                bands = premultiplied(np.concatenate([
+                    np.asarray(BackgroundApplier.fit_background_rows(source, size, top, min(top + 64, size[1])))
+                    for top in range(0, size[1], 64)]))
+                self.assertLessEqual(np.abs(whole - bands).max(), 1)
+
+
+class TestTiledWorkflows(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(tiled_compositor.configure, app.config.get('tiling'))
+        self.car = read('car', 'car2.jpg')
+        seed_mask(self.car)
+
+    def run_both(self, workflow, *args, **kwargs):
+        """Results of `workflow` composited whole, then in bands of 16 rows."""
+        tiled_compositor.configure({'min_megapixels': 0})
+        whole = workflow(*args, **kwargs)
+        tiled_compositor.configure({'min_megapixels': 0.1, 'band_rows': 16})
+        return whole, workflow(*args, **kwargs)
+
+    def test_same_result_as_whole_images(self):
+        background = Image.open(io.BytesIO(read('background', 'bg2.jpg'))).convert('RGBA')
+        background.putalpha(Image.linear_gradient('L').resize(background.size))
+        translucent = io.BytesIO()
+        background.save(translucent, format='PNG')
+        for background_data in (read('background', 'bg2.jpg'), translucent.getvalue()):
+            for format in ('png', 'webp'):
+                whole, tiled = self.run_both(workflows.process_car_image, self.car, read('logo', 'logo1.png'),
+                                             background_data, logo_position='bottom-left',
+                                             output={'format': format})
+                self.assertEqual(tiled.format, format)
+                whole, tiled = pixels(whole), pixels(tiled)
+                self.assertEqual(whole.shape, tiled.shape)
+                # Bands of the background are resampled on their own, +-1 of rounding
+                self.assertLessEqual(np.abs(whole - tiled).max(), 1)
+
+    def test_apply_background_with_mask(self):
+        mask = Image.new('L', Image.open(io.BytesIO(self.car)).size)
+        mask.paste(255, (100, 100, 900, 500))
+        mask_data = io.BytesIO()
+        mask.save(mask_data, format='PNG')
+        whole, tiled = self.run_both(workflows.apply_background, self.car, read('background', 'bg2.jpg'),
+                                     output={'format': 'png'}, mask_data=mask_data.getvalue())
+        self.assertLessEqual(np.abs(pixels(whole) - pixels(tiled)).max(), 1)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'reads the resident set size from /proc')
+class TestMemoryCeiling(unittest.TestCase):
+    """Peak memory of a 24MP photo composited onto a background, measured in a fresh process."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        car = Image.open(io.BytesIO(read('car', 'car2.jpg'))).convert('RGB').resize((6000, 4000))
+        self.pixels = car.width * car.height
+        car.save(os.path.join(self.directory, 'car.jpg'), quality=90)
+        background = Image.open(io.BytesIO(read('background', 'bg2.jpg'))).resize((3000, 2000))
+        background.save(os.path.join(self.directory, 'background.jpg'), quality=90)
+
+    def peak_bytes(self, min_megapixels):
+        """Peak RSS of process_car_image above the RSS before it, in a fresh process."""
+        child = textwrap.dedent('''
+            import os, sys
+            from app.app import app
+            from app.image_processing import workflows
+            from app.image_processing.tiling import tiled_compositor
+            from app.tests.image_processing.test_tiling import seed_mask
+
+            directory, min_megapixels = sys.argv[1], float(sys.argv[2])
+            tiled_compositor.configure({'min_megapixels': min_megapixels})
+            with open(os.path.join(directory, 'car.jpg'), 'rb') as f:
+                car = f.read()
+            with open(os.path.join(directory, 'background.jpg'), 'rb') as f:
+                background = f.read()
+            with open(os.path.join('app', 'tests', 'test_data', 'logo', 'logo1.png'), 'rb') as f:
+                logo = f.read()
+            seed_mask(car)
+
+            def memory(field):
+                # ru_maxrss would include the parent's peak, kept across exec
+                with open('/proc/self/status') as f:
+                    return next(int(line.split()[1]) * 1024 for line in f if line.startswith(field))
+
+            before = memory('VmRSS:')
+            result = workflows.process_car_image(car, logo, background, output={'format': 'png'})
+            print(memory('VmHWM:') - before, len(result.data))
+        ''')
+        completed = subprocess.run([sys.executable, '-c', child, self.directory, str(min_megapixels)],
+                                   cwd=ROOT, capture_output=True, text=True, timeout=300)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        peak, size = map(int, completed.stdout.split()[-2:])
+        self.assertGreater(size, 0)
+        return peak
+
+    def test_peak_memory_is_bounded(self):
+        peak = self.peak_bytes(16)
+        # The decoded photo (PIL keeps RGB in 4 bytes per pixel), its mask, the decoded background and
+        # the encoded PNG; a cutout, fitted background and composite of the whole photo would add 12
+        self.assertLess(peak, 8 * self.pixels + 64 * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
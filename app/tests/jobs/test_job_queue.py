@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from app.image_processing.encoders import EncodedImage
+from app.jobs.job_queue import FAILED, QUEUED, SUCCEEDED, CallbackRejected, JobManager, JobQueueFull
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3')
+
+    def _manager(self, **settings):
+        manager = JobManager()
+        manager.configure({'db_path': self.db_path, 'poll_interval_seconds': 0.05, **settings})
+        manager.register('upper', lambda text_data, suffix='': text_data.upper() + suffix.encode(), 'upper.txt',
+                         mimetype='text/plain')
+        manager.register('broken', lambda: 1 / 0, 'broken.txt')
+        return manager
+
+    def _wait_for(self, manager, job_id, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = manager.get(job_id)
+            if job['status'] not in (QUEUED, 'running'):
+                return job
+            time.sleep(0.02)
+        self.fail(f"Job {job_id} did not finish")
+
+    def test_job_runs_and_result_is_stored(self):
+        manager = self._manager()
+        job_id = manager.submit('upper', {'text_data': b'car'}, {'suffix': '!'})
+
+        self.assertEqual(self._wait_for(manager, job_id)['status'], SUCCEEDED)
+        self.assertEqual(manager.result(job_id), (b'CAR!', 'text/plain', 'upper.txt'))
+
+    def test_encoded_result_keeps_its_format(self):
+        """Handlers that return an encoded image set the mimetype and extension of the download."""
+        manager = self._manager()
+        manager.register('webp', lambda: EncodedImage(b'RIFF', 'webp'), 'final_image.png')
+        job_id = manager.submit('webp', {})
+
+        self.assertEqual(self._wait_for(manager, job_id)['status'], SUCCEEDED)
+        self.assertEqual(manager.result(job_id), (b'RIFF', 'image/webp', 'final_image.webp'))
+
+    def test_columns_are_added_to_existing_databases(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+                     " priority INTEGER NOT NULL, params TEXT NOT NULL, callback_url TEXT, result_url TEXT,"
+                     " result BLOB, error TEXT, worker_pid INTEGER, created_at REAL NOT NULL,"
+                     " started_at REAL, finished_at REAL)")
+        conn.close()
+
+        manager = self._manager()
+        job_id = manager.submit('upper', {'text_data': b'old'})
+        self.assertEqual(self._wait_for(manager, job_id)['status'], SUCCEEDED)
+        self.assertEqual(manager.result(job_id), (b'OLD', 'text/plain', 'upper.txt'))
+
+    def test_callback_url_check(self):
+        manager = self._manager(callback_allowed_hosts=['10.0.0.7'])
+        manager.check_callback_url('https://93.184.216.34/hooks/job')
+        manager.check_callback_url('http://10.0.0.7:8080/internal-hook')
+        for url in ('http://169.254.169.254/latest/meta-data/', 'http://127.0.0.1/', 'http://192.168.1.1/',
+                    'http://[::1]/', 'ftp://93.184.216.34/'):
+            with self.assertRaises(CallbackRejected, msg=url):
+                manager.check_callback_url(url)
+
+    def test_failed_job_reports_error(self):
+        manager = self._manager()
+        job = self._wait_for(manager, manager.submit('broken', {}))
+        self.assertEqual(job['status'], FAILED)
+        self.assertIn('division by zero', job['error'])
+        self.assertIsNone(manager.result(job['job_id']))
+
+    def test_queue_depth_and_priority(self):
+        """Submissions beyond max_queue_depth are refused; lower priority numbers are ahead in the queue."""
+        manager = self._manager(max_queue_depth=2, worker_threads=0)
+        slow = manager.submit('upper', {'text_data': b'a'}, priority=9)
+        urgent = manager.submit('upper', {'text_data': b'b'}, priority=0)
+
+        with self.assertRaises(JobQueueFull) as raised:
+            manager.submit('upper', {'text_data': b'c'})
+        self.assertEqual(raised.exception.retry_after, manager.retry_after_seconds)
+
+        self.assertEqual(manager.get(urgent)['queue_position'], 0)
+        self.assertEqual(manager.get(slow)['queue_position'], 1)
+        self.assertEqual(manager.stats()[QUEUED], 2)
+
+    def test_jobs_are_shared_between_processes(self):
+        """A job queued through one manager is executed by another one using the same database."""
+        submitting_worker = self._manager(worker_threads=0)
+        job_id = submitting_worker.submit('upper', {'text_data': b'shared'})
+
+        executing_worker = self._manager()
+        executing_worker.start()
+        self.assertEqual(self._wait_for(submitting_worker, job_id)['status'], SUCCEEDED)
+
+
+if __name__ == "__main__":
+    unittest.main()
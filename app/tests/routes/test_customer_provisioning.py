@@ -0,0 +1,71 @@
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from app.app import app
+from app.image_processing.asset_store import asset_store
+
+DEALER = {'X-API-Key': 'dealer-1'}
+
+
+class TestCustomerProvisioningRoutes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Point the asset store at a throwaway directory and set up the test client."""
+        asset_store.configure({'directory': tempfile.mkdtemp()})
+        cls.client = app.test_client()
+        cls.test_data_dir = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+
+    def _upload(self, *parts):
+        with open(os.path.join(self.test_data_dir, *parts), 'rb') as f:
+            return io.BytesIO(f.read()), parts[-1]
+
+    def _register(self, kind, name, headers=None):
+        return self.client.post(f'/api/v1/assets?kind={kind}', data={'image': self._upload(kind, name)},
+                                content_type='multipart/form-data', headers=DEALER if headers is None else headers)
+
+    def test_registered_assets_replace_uploads(self):
+        """Registered logo and background ids can be used instead of uploading the files."""
+        logo = self._register('logo', 'logo1.png')
+        background = self._register('background', 'bg2.jpg')
+        self.assertEqual(logo.status_code, 201)
+        self.assertEqual(background.status_code, 201)
+        logo_id = logo.get_json()['asset_id']
+        background_id = background.get_json()['asset_id']
+        self.assertEqual(self.client.get(f'/api/v1/assets/{logo_id}').get_json()['kind'], 'logo')
+
+        response = self.client.post(f'/api/v1/add-logo?logo_id={logo_id}', data={
+            'image': self._upload('car', 'car1.jpg'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        Image.open(io.BytesIO(response.data)).verify()
+
+        response = self.client.post(f'/api/v1/apply-background?background_id={background_id}', data={
+            'image': self._upload('bg_removed_car', 'car1.png'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.delete(f'/api/v1/assets/{logo_id}', headers=DEALER).status_code, 204)
+        self.assertEqual(self.client.get(f'/api/v1/assets/{logo_id}').status_code, 404)
+
+    def test_only_the_owner_deletes(self):
+        self.assertEqual(self._register('logo', 'logo1.png', headers={}).status_code, 401)
+        logo_id = self._register('logo', 'logo1.png').get_json()['asset_id']
+        self.assertEqual(self.client.delete(f'/api/v1/assets/{logo_id}').status_code, 401)
+        self.assertEqual(self.client.delete(f'/api/v1/assets/{logo_id}',
+                                            headers={'X-API-Key': 'dealer-2'}).status_code, 403)
+        self.assertEqual(self.client.get(f'/api/v1/assets/{logo_id}').status_code, 200)
+        self.assertEqual(self.client.delete(f'/api/v1/assets/{logo_id}', headers=DEALER).status_code, 204)
+
+    def test_unknown_asset_id(self):
+        response = self.client.post('/api/v1/add-logo?logo_id=logo-missing', data={
+            'image': self._upload('car', 'car1.jpg'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+
+from app.app import app
+from app.jobs.job_queue import job_manager
+
+
+class TestJobRoutes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Point the job queue at a throwaway database and set up the test client."""
+        job_manager.configure({'db_path': os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3'),
+                               'poll_interval_seconds': 0.05})
+        cls.client = app.test_client()
+        cls.test_data_dir = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+
+    def _upload(self, *parts):
+        with open(os.path.join(self.test_data_dir, *parts), 'rb') as f:
+            return io.BytesIO(f.read()), parts[-1]
+
+    def test_submit_poll_and_download(self):
+        """A logo job is accepted with 202, runs in the background and its PNG can be downloaded."""
+        response = self.client.post('/api/v1/jobs/add-logo?position=top-left&priority=1', data={
+            'image': self._upload('bg_removed_car', 'car1.png'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+
+        deadline = time.time() + 10
+        status = None
+        while time.time() < deadline:
+            status = self.client.get(f"/api/v1/jobs/{job['job_id']}").get_json()['status']
+            if status not in ('queued', 'running'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(status, 'succeeded')
+
+        result = self.client.get(f"/api/v1/jobs/{job['job_id']}/result")
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'image/png')
+        Image.open(io.BytesIO(result.data)).verify()
+
+    def test_missing_logo(self):
+        """Jobs without a logo file or logo_id are rejected before they are queued, like the synchronous route."""
+        response = self.client.post('/api/v1/jobs/add-logo', data={
+            'image': self._upload('bg_removed_car', 'car1.png'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+
+    def test_internal_callback_url(self):
+        """Callbacks to the instance metadata service or loopback are rejected."""
+        for callback_url in ('http://169.254.169.254/latest/meta-data/', 'http://127.0.0.1:5000/'):
+            response = self.client.post(f'/api/v1/jobs/remove-background?callback_url={callback_url}', data={
+                'image': self._upload('car', 'car1.jpg'),
+            }, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/api/v1/jobs/does-not-exist').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/jobs/does-not-exist/result').status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
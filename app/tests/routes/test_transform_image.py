@@ -0,0 +1,225 @@
+import io
+import os
+import unittest
+import zipfile
+from unittest import mock
+
+from PIL import Image
+
+from app.app import app
+from app.image_processing.encoders import output_encoder
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.mask_cache import digest_bytes, mask_cache
+from app.image_processing.mask_upsampler import mask_upsampler
+from app.image_processing.offload import process_offload
+
+
+class TestTransformImageRoutes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Set up the Flask test client and the test data directory."""
+        cls.client = app.test_client()
+        cls.test_data_dir = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+
+    def _upload(self, *parts):
+        with open(os.path.join(self.test_data_dir, *parts), 'rb') as f:
+            return io.BytesIO(f.read()), parts[-1]
+
+    def test_add_logo(self):
+        """The logo route returns a PNG of the same size as the input."""
+        response = self.client.post('/api/v1/add-logo?position=bottom-left', data={
+            'image': self._upload('car', 'car2.jpg'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        output = Image.open(io.BytesIO(response.data))
+        self.assertEqual(output.size, Image.open(os.path.join(self.test_data_dir, 'car', 'car2.jpg')).size)
+
+    def test_apply_background(self):
+        """The background route returns a PNG."""
+        response = self.client.post('/api/v1/apply-background', data={
+            'image': self._upload('bg_removed_car', 'car2.png'),
+            'background': self._upload('background', 'bg2.jpg'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+
+    def test_output_format(self):
+        """format=jpeg sends a JPEG named after it."""
+        response = self.client.post('/api/v1/apply-background?format=jpeg&quality=70', data={
+            'image': self._upload('bg_removed_car', 'car2.png'),
+            'background': self._upload('background', 'bg2.jpg'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertIn('car_with_background.jpg', response.headers['Content-Disposition'])
+        self.assertEqual(Image.open(io.BytesIO(response.data)).format, 'JPEG')
+
+    def test_accept_negotiation(self):
+        """Clients that accept WebP get WebP, the response varies on Accept."""
+        response = self.client.post('/api/v1/add-logo', data={
+            'image': self._upload('car', 'car2.jpg'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data', headers={'Accept': 'image/avif;q=0,image/webp,*/*;q=0.8'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertIn('Accept', response.vary)
+
+    def test_variant(self):
+        """Resized delivery variants scale the long side down to the configured size."""
+        response = self.client.post('/api/v1/add-logo?variant=thumbnail', data={
+            'image': self._upload('car', 'car2.jpg'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(max(Image.open(io.BytesIO(response.data)).size), output_encoder.variants['thumbnail'])
+
+    def test_unknown_variant(self):
+        response = self.client.post('/api/v1/add-logo?variant=poster', data={
+            'image': self._upload('car', 'car2.jpg'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_image(self):
+        """Uploads that are not images are rejected with 400."""
+        response = self.client.post('/api/v1/add-logo', data={
+            'image': (io.BytesIO(b'not an image'), 'car.jpg'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.get_json())
+
+    def test_decompression_bomb(self):
+        """Images with too many pixels are rejected with 413 before they are decoded."""
+        bomb = io.BytesIO()
+        # A few KB of PNG that would decode to 400MB of pixels
+        Image.new('L', (20000, 20000)).save(bomb, format='PNG')
+        bomb.seek(0)
+        response = self.client.post('/api/v1/add-logo', data={
+            'image': (bomb, 'car.png'),
+            'logo': self._upload('logo', 'logo1.png'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('error', response.get_json())
+
+    def test_unsupported_format(self):
+        """Formats outside the ingestion allow-list are rejected with 415."""
+        gif = io.BytesIO()
+        Image.new('RGB', (64, 48)).save(gif, format='GIF')
+        gif.seek(0)
+        response = self.client.post('/api/v1/remove-background', data={
+            'image': (gif, 'car.gif'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 415)
+
+    def test_process_car_images_zip(self):
+        """The bulk route streams one PNG per uploaded photo in a ZIP."""
+        car_files = ['car1.jpg', 'car2.jpg']
+        # Seed the mask cache so the photos skip inference
+        for car_file in car_files:
+            data, _name = self._upload('car', car_file)
+            proxy = mask_upsampler.proxy(Image.open(data))
+            mask_cache.put(BackgroundRemover.cache_key(digest_bytes(data.getvalue())),
+                           Image.new('L', proxy.size, 255))
+
+        response = self.client.post('/api/v1/process-car-images?logo_position=bottom-right', data={
+            'car_image': [self._upload('car', car_file) for car_file in car_files],
+            'logo': self._upload('logo', 'logo1.png'),
+            'background': self._upload('background', 'bg2.jpg'),
+        }, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['001_car1.png', '002_car2.png'])
+            for name in archive.namelist():
+                Image.open(io.BytesIO(archive.read(name))).verify()
+
+    def test_mask_results_and_resubmission(self):
+        """result= returns only the mask with the bounding box; uploading it back skips inference."""
+        data, _name = self._upload('car', 'car1.webp')
+        proxy = mask_upsampler.proxy(Image.open(data))
+        mask = Image.new('L', proxy.size, 0)
+        mask.paste(255, (proxy.width // 4, proxy.height // 4, proxy.width // 2, proxy.height // 2))
+        mask_cache.put(BackgroundRemover.cache_key(digest_bytes(data.getvalue())), mask)
+        cutout = self.client.post('/api/v1/remove-background', data={'image': self._upload('car', 'car1.webp')},
+                                  content_type='multipart/form-data')
+        expected = self.client.post('/api/v1/process-car-image', data={
+            'car_image': self._upload('car', 'car1.webp'),
+            'background': self._upload('background', 'bg2.jpg'),
+        }, content_type='multipart/form-data')
+        bbox = [int(side) for side in cutout.headers['X-Bounding-Box'].split(',')]
+
+        for result in ('mask', 'rle', 'polygon'):
+            response = self.client.post(f'/api/v1/remove-background?result={result}', data={
+                'image': self._upload('car', 'car1.webp')}, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            if result == 'mask':
+                self.assertEqual(response.mimetype, 'image/png')
+                self.assertEqual(Image.open(io.BytesIO(response.data)).mode, 'L')
+                self.assertEqual(response.headers['X-Bounding-Box'], cutout.headers['X-Bounding-Box'])
+                self.assertLess(len(response.data), len(cutout.data) / 4)
+            else:
+                self.assertEqual(response.json['bbox'], bbox)
+
+            # The mask has hard edges, so every encoding gives the same composite
+            composite = self.client.post('/api/v1/process-car-image', data={
+                'car_image': self._upload('car', 'car1.webp'),
+                'background': self._upload('background', 'bg2.jpg'),
+                'mask': (io.BytesIO(response.data), f'mask.{result}'),
+            }, content_type='multipart/form-data')
+            self.assertEqual(composite.status_code, 200)
+            self.assertEqual(composite.data, expected.data)
+
+    def test_invalid_mask(self):
+        response = self.client.post('/api/v1/apply-background', data={
+            'image': self._upload('car', 'car2.jpg'),
+            'background': self._upload('background', 'bg2.jpg'),
+            'mask': (io.BytesIO(b'{"size": [10, 10], "counts": [3]}'), 'mask.json'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('counts', response.json['error'])
+
+    def test_etag_and_response_cache(self):
+        """Identical requests get the same ETag and are answered from the cache, or with 304 when revalidated."""
+        def add_logo(query='position=top-left', **headers):
+            return self.client.post(f'/api/v1/add-logo?{query}', data={
+                'image': self._upload('car', 'car1.jpg'),
+                'logo': self._upload('logo', 'logo1.jpg'),
+            }, content_type='multipart/form-data', headers=headers)
+
+        first = add_logo()
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.headers['ETag'].startswith('W/"'))
+        self.assertEqual(first.headers['Cache-Control'], 'public, max-age=86400')
+        self.assertIn('Accept', first.headers['Vary'])
+
+        # Decoding, compositing and encoding are skipped
+        with mock.patch.object(process_offload, 'run', side_effect=AssertionError('not cached')):
+            repeated = add_logo()
+            revalidated = add_logo(**{'If-None-Match': first.headers['ETag']})
+        self.assertEqual((repeated.headers['ETag'], repeated.data), (first.headers['ETag'], first.data))
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.data, b'')
+        self.assertEqual(revalidated.headers['ETag'], first.headers['ETag'])
+
+        self.assertNotEqual(add_logo('position=bottom-right').headers['ETag'], first.headers['ETag'])
+        # The Accept header only counts when the format is negotiated
+        self.assertNotEqual(add_logo(Accept='image/webp').headers['ETag'], first.headers['ETag'])
+        self.assertEqual(add_logo('position=top-left&format=png', Accept='image/webp').headers['ETag'],
+                         add_logo('position=top-left&format=png').headers['ETag'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.admission import AdmissionControl, Overloaded, admission_control, image_pixels
+from app.app import app
+from app.metrics import metrics
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.admission = AdmissionControl()
+
+    def test_over_capacity(self):
+        self.admission.configure({'capacity': 2})
+        with self.admission.admit(1.5, 'a', '/r'):
+            with self.assertRaises(Overloaded) as refused:
+                with self.admission.admit(1, 'b', '/r'):
+                    pass
+            self.assertEqual(refused.exception.reason, 'over_capacity')
+            self.assertGreaterEqual(refused.exception.retry_after, 1)
+            self.assertEqual(self.admission.in_flight(), 1.5)
+        # Alone, a request larger than the capacity still runs
+        with self.admission.admit(3, 'b', '/r'):
+            self.assertEqual(self.admission.in_flight(), 3)
+        self.assertEqual(self.admission.in_flight(), 0)
+
+    def test_token_buckets(self):
+        self.admission.configure({'rate': 0.5, 'burst': 2, 'db_path': os.path.join(self.directory, 'rate.sqlite3')})
+        with self.admission.admit(2, 'a', '/r'):
+            pass
+        with self.assertRaises(Overloaded) as refused:
+            with self.admission.admit(1, 'a', '/r'):
+                pass
+        self.assertEqual(refused.exception.reason, 'rate_limited')
+        self.assertEqual(refused.exception.retry_after, 2)
+        # Refused requests hold no capacity, other clients have their own bucket
+        self.assertEqual(self.admission.in_flight(), 0)
+        with self.admission.admit(1, 'b', '/r'):
+            pass
+        # Shared by every worker on the host
+        other_worker = AdmissionControl()
+        other_worker.configure({'rate': 0.5, 'burst': 2, 'db_path': os.path.join(self.directory, 'rate.sqlite3')})
+        with self.assertRaises(Overloaded):
+            with other_worker.admit(1, 'a', '/r'):
+                pass
+
+    def test_cost(self):
+        with open(os.path.join(TEST_DATA, 'car', 'car2.jpg'), 'rb') as f:
+            data = f.read()
+        pixels = image_pixels(data)
+        self.assertGreater(pixels, 0)
+        self.assertEqual(image_pixels(io.BytesIO(data)), pixels)
+        self.assertEqual(image_pixels(b'not an image'), 0)
+        self.admission.configure({'inference_cost': 1, 'megapixel_cost': 0.5})
+        self.assertEqual(self.admission.cost(2_000_000), 2)
+        self.assertEqual(self.admission.cost(2_000_000, inference=False), 1)
+
+
+class TestAdmissionRoutes(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.addCleanup(admission_control.configure, app.config.get('admission'))
+
+    def post_add_logo(self, **headers):
+        with open(os.path.join(TEST_DATA, 'car', 'car2.jpg'), 'rb') as car, \
+                open(os.path.join(TEST_DATA, 'logo', 'logo1.png'), 'rb') as logo:
+            # Processed every time instead of answered from the response cache
+            return self.client.post('/api/v1/add-logo', data={'image': car, 'logo': logo},
+                                    content_type='multipart/form-data',
+                                    headers={'Cache-Control': 'no-cache', **headers})
+
+    def test_busy_worker_sheds_load(self):
+        admission_control.configure({'capacity': 1, 'rate': 0})
+        with admission_control.admit(1, 'other', '/api/v1/process-car-image'):
+            response = self.post_add_logo()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        self.assertIn('error', response.get_json())
+
+        self.assertEqual(self.post_add_logo().status_code, 200)
+        text = metrics.collect()
+        self.assertIn('pixel_admission_decisions_total{decision="over_capacity",route="/api/v1/add-logo"}', text)
+        self.assertIn('pixel_admission_decisions_total{decision="admitted",route="/api/v1/add-logo"}', text)
+
+    def test_rate_limited_per_api_key(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        admission_control.configure({'rate': 0.01, 'burst': 1, 'megapixel_cost': 10,
+                                     'db_path': os.path.join(directory, 'rate.sqlite3')})
+        self.assertEqual(self.post_add_logo(**{'X-API-Key': 'dealer-1'}).status_code, 200)
+        response = self.post_add_logo(**{'X-API-Key': 'dealer-1'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(self.post_add_logo(**{'X-API-Key': 'dealer-2'}).status_code, 200)
+
+    def test_rate_limited_per_forwarded_client(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        admission_control.configure({'rate': 0.01, 'burst': 1, 'megapixel_cost': 10,
+                                     'db_path': os.path.join(directory, 'rate.sqlite3')})
+        # Every request comes from the load balancer's address, the clients are told apart by X-Forwarded-For
+        self.client.environ_base['REMOTE_ADDR'] = '10.0.0.2'
+        self.assertEqual(self.post_add_logo(**{'X-Forwarded-For': '203.0.113.7'}).status_code, 200)
+        self.assertEqual(self.post_add_logo(**{'X-Forwarded-For': '203.0.113.7'}).status_code, 429)
+        self.assertEqual(self.post_add_logo(**{'X-Forwarded-For': '198.51.100.4'}).status_code, 200)
+        # Entries before the trusted proxy's are set by the client, they cannot move it to another bucket
+        self.assertEqual(self.post_add_logo(**{'X-Forwarded-For': '192.0.2.1, 203.0.113.7'}).status_code, 429)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import io
+import os
+import pickle
+import unittest
+
+from PIL import Image, UnidentifiedImageError
+
+from app.app import app as flask_app
+from app.asgi import app as asgi_app
+from app.image_processing import workflows
+from app.image_processing.ingestion import UploadRejected
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.mask_cache import digest_bytes, mask_cache
+from app.image_processing.offload import ProcessOffload
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+def _read(*parts):
+    with open(os.path.join(TEST_DATA, *parts), 'rb') as f:
+        return f.read()
+
+
+def _multipart(files, boundary='pixelboundary'):
+    body = b''
+    for name, (filename, data) in files.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def call(method, path, body=b'', content_type=None, chunk_size=64 * 1024):
+    """Run one request through the ASGI app, the body arriving in chunks; returns (status, headers, body)."""
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    headers = [(b'content-length', str(len(body)).encode())]
+    if content_type:
+        headers.append((b'content-type', content_type.encode()))
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': headers,
+             'http_version': '1.1', 'root_path': ''}
+    sent = []
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    start = sent[0]
+    return (start['status'], dict(start['headers']),
+            b''.join(message.get('body', b'') for message in sent[1:]))
+
+
+class TestAsgi(unittest.TestCase):
+    def test_route_through_asgi(self):
+        """The Flask routes and parsers answer through the ASGI front end."""
+        body, content_type = _multipart({'image': ('car2.jpg', _read('car', 'car2.jpg')),
+                                         'logo': ('logo1.png', _read('logo', 'logo1.png'))})
+        status, headers, data = call('POST', '/api/v1/add-logo', body, content_type)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'image/png')
+        self.assertEqual(Image.open(io.BytesIO(data)).size, Image.open(io.BytesIO(_read('car', 'car2.jpg'))).size)
+
+    def test_oversized_request_refused_before_reading(self):
+        limit = flask_app.config['MAX_CONTENT_LENGTH']
+        flask_app.config['MAX_CONTENT_LENGTH'] = 5
+        try:
+            status, _headers, data = call('POST', '/api/v1/add-logo', b'x' * 10, 'multipart/form-data; boundary=x')
+        finally:
+            flask_app.config['MAX_CONTENT_LENGTH'] = limit
+        self.assertEqual(status, 413)
+        self.assertIn(b'error', data)
+
+
+class TestProcessOffload(unittest.TestCase):
+    def test_upload_rejected_keeps_status(self):
+        error = pickle.loads(pickle.dumps(UploadRejected('too large', 413)))
+        self.assertEqual((str(error), error.status), ('too large', 413))
+
+    def test_workflow_in_worker_process(self):
+        """Same result as in process, uploads and results moving through shared memory."""
+        offload = ProcessOffload()
+        offload.configure({'enabled': True, 'processes': 1, 'warm_up': False, 'shared_memory_min_kb': 1})
+        car, logo = _read('car', 'car2.jpg'), _read('logo', 'logo1.png')
+        try:
+            result = offload.run(workflows.add_logo, car, logo_data=logo)
+            with self.assertRaises(UnidentifiedImageError):
+                offload.run(workflows.add_logo, b'not an image', logo_data=logo)
+        finally:
+            offload.shutdown()
+
+        expected = workflows.add_logo(car, logo_data=logo)
+        self.assertEqual(result.format, expected.format)
+        self.assertEqual(result.data, expected.data)
+
+    def test_cutout_in_shared_frame(self):
+        """The worker cuts out and composites the photo in its frame slot, same result as in process."""
+        car, background = _read('car', 'car2.jpg'), _read('background', 'bg2.jpg')
+        # A cached mask (its disk tier is shared with the worker process) stands in for the model
+        mask = Image.new('L', (64, 48))
+        mask.paste(255, (16, 12, 48, 40))
+        mask_cache.put(BackgroundRemover.cache_key(digest_bytes(car)), mask)
+        offload = ProcessOffload()
+        offload.configure({'enabled': True, 'processes': 1, 'warm_up': False, 'frames': 1})
+        try:
+            cutout = offload.run(workflows.remove_background, car)
+            composite = offload.run(workflows.process_car_image, car, background_data=background)
+            mask_data = offload.run(workflows.background_mask, car).data
+            masked = offload.run(workflows.apply_background, car, background_data=background, mask_data=mask_data)
+            self.assertTrue(offload.frames.enabled)
+        finally:
+            offload.shutdown()
+
+        self.assertEqual(cutout.data, workflows.remove_background(car).data)
+        self.assertEqual(cutout.bbox, workflows.remove_background(car).bbox)
+        self.assertEqual(masked.data, composite.data)
+        self.assertEqual(composite.data, workflows.process_car_image(car, background_data=background).data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from app import batch
+from app.app import app as flask_app
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.mask_cache import digest_bytes, mask_cache
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.input = os.path.join(self.directory, 'input')
+        self.output = os.path.join(self.directory, 'output')
+        os.makedirs(os.path.join(self.input, 'lot'))
+        for name, target in (('car1.jpg', 'car1.jpg'), ('car1.webp', 'car1.webp'), ('car2.jpg', 'lot/car2.jpg')):
+            shutil.copy(os.path.join(TEST_DATA, 'car', name), os.path.join(self.input, target))
+            with open(os.path.join(self.input, target), 'rb') as f:
+                data = f.read()
+            # A cached mask (its disk tier is shared with the worker processes) stands in for the model
+            mask = Image.new('L', (64, 48))
+            mask.paste(255, (16, 12, 48, 40))
+            mask_cache.put(BackgroundRemover.cache_key(digest_bytes(data)), mask)
+
+    def test_list_photos(self):
+        with open(os.path.join(self.input, 'notes.txt'), 'w') as f:
+            f.write('not a photo')
+        photos = batch.list_photos(self.input)
+
+        # Names differing only by their extension keep it, so every photo has its own output
+        self.assertEqual([name for _path, name in photos], ['car1.jpg', 'car1.webp', os.path.join('lot', 'car2')])
+        self.assertTrue(all(os.path.isfile(path) for path, _name in photos))
+
+        manifest = os.path.join(self.input, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('# lot photos\nlot/car2.jpg\n\ncar1.jpg  # front\n')
+        self.assertEqual(batch.list_photos(manifest),
+                         [(os.path.join(self.input, 'car1.jpg'), 'car1'),
+                          (os.path.join(self.input, 'lot', 'car2.jpg'), os.path.join('lot', 'car2'))])
+
+    def test_run_and_resume(self):
+        with open(os.path.join(self.input, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+        photos = batch.list_photos(self.input)
+        background = os.path.join(TEST_DATA, 'background', 'bg2.jpg')
+        settings = {**(flask_app.config.get('offload') or {}), 'warm_up': False}
+        with mock.patch.dict(flask_app.config, {'offload': settings}):
+            report = batch.run(photos, self.output, 'apply-background', background=background, format='webp',
+                               processes=1, prefetch=1)
+            resumed = batch.run(photos, self.output, 'apply-background', background=background, format='webp',
+                                processes=1, prefetch=1)
+
+        self.assertEqual((report['processed'], report['skipped'], report['failed']), (3, 0, 1))
+        self.assertGreater(report['images_per_second'], 0)
+        for name in ('car1.jpg.webp', 'car1.webp.webp', os.path.join('lot', 'car2.webp')):
+            with Image.open(os.path.join(self.output, name)) as image:
+                self.assertEqual(image.format, 'WEBP')
+        self.assertFalse([name for name in os.listdir(self.output) if name.endswith('.part')])
+        # Finished photos are skipped, the failed one is retried
+        self.assertEqual((resumed['processed'], resumed['skipped'], resumed['failed']), (0, 3, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
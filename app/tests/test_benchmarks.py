@@ -0,0 +1,75 @@
+import io
+import threading
+import unittest
+
+from PIL import Image
+from werkzeug.serving import make_server
+
+from app.app import app
+from app.benchmarks import corpus, load_bench, mask_quality, micro_bench, results
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_corpus(self):
+        photos = corpus.build_corpus(['800x600'])
+        self.assertEqual([photo['format'] for photo in photos], list(corpus.FORMATS))
+        for photo in photos:
+            image = Image.open(io.BytesIO(photo['data']))
+            self.assertEqual(image.format.lower(), photo['format'])
+            self.assertEqual(image.size, (800, 600))
+
+    def test_compare_with_baseline(self):
+        baseline = {'results': [{'id': 'a', 'p50_ms': 10, 'p99_ms': 20, 'throughput_per_s': 100},
+                                {'id': 'b', 'p50_ms': 10, 'p99_ms': 20}]}
+        report = [{'id': 'a', 'p50_ms': 11, 'p99_ms': 30, 'throughput_per_s': 80},
+                  # Faster than the baseline
+                  {'id': 'b', 'p50_ms': 5, 'p99_ms': 10},
+                  # Not in the baseline
+                  {'id': 'c', 'p50_ms': 1000}]
+
+        regressions = results.compare(report, baseline, tolerance=0.15)
+
+        self.assertEqual([(r['id'], r['metric']) for r in regressions],
+                         [('a', 'p99_ms'), ('a', 'throughput_per_s')])
+        self.assertEqual(results.report([]), 0)
+
+    def test_mask_iou(self):
+        mask = Image.new('L', (10, 10))
+        mask.paste(255, (0, 0, 10, 5))
+        reference = Image.new('L', (10, 10))
+        reference.paste(200, (0, 0, 10, 4))
+        self.assertAlmostEqual(mask_quality.mask_iou(mask, reference), 0.8)
+        self.assertEqual(mask_quality.mask_iou(Image.new('L', (4, 4)), Image.new('L', (4, 4))), 1.0)
+        self.assertEqual(mask_quality.parse_candidate('precision=int8,providers=A+B'),
+                         {'precision': 'int8', 'providers': ['A', 'B']})
+
+    def test_micro_bench(self):
+        # Background removal needs the model, which is downloaded on first use
+        report = micro_bench.run(['800x600'], ['jpeg'], repeat=2,
+                                 cases=('decode', 'apply_background', 'add_logo', 'encode'))
+        cases = {result['id']: result for result in report}
+
+        self.assertIn('decode/800x600/jpeg', cases)
+        self.assertEqual(cases['add_logo/800x600']['n'], 2)
+        self.assertLessEqual(cases['apply_background/800x600']['p50_ms'],
+                             cases['apply_background/800x600']['p99_ms'])
+        self.assertIn('encode/800x600/png', cases)
+
+    def test_load_bench(self):
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            uploads = load_bench.route_uploads('800x600')
+            result = load_bench.load(f'http://127.0.0.1:{server.server_port}', 'add-logo',
+                                     uploads['add-logo'], concurrency=2, total_requests=4)
+        finally:
+            server.shutdown()
+
+        self.assertEqual(result['statuses'], {'200': 4})
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['throughput_per_s'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
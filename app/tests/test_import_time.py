@@ -0,0 +1,19 @@
+import unittest
+
+from app.benchmarks.import_bench import heavy_imports, import_times
+
+
+class TestImportTime(unittest.TestCase):
+    def test_app_import_does_not_load_the_ml_stack(self):
+        """rembg, onnxruntime and friends are only imported through the backends registry."""
+        times = import_times('app.app')
+        self.assertIn('app.app', times)
+        self.assertEqual(heavy_imports(times), [])
+
+    def test_app_import_time(self):
+        # Around 0.5s locally, the ML stack alone adds more than a second
+        self.assertLess(import_times('app.app')['app.app'], 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.app import app
+from app.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metrics = Metrics()
+        self.metrics.configure({'directory': self.directory, 'buckets': [0.1, 1]})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_exposition_format(self):
+        self.metrics.inc('pixel_requests_total', route='/a', status='200')
+        self.metrics.observe('pixel_stage_duration_seconds', 0.05, stage='decode', route='/a')
+        self.metrics.observe('pixel_stage_duration_seconds', 0.5, stage='decode', route='/a')
+        text = self.metrics.collect()
+
+        self.assertIn('# TYPE pixel_requests_total counter', text)
+        self.assertIn('pixel_requests_total{route="/a",status="200"} 1', text)
+        self.assertIn('pixel_stage_duration_seconds_bucket{route="/a",stage="decode",le="0.1"} 1', text)
+        self.assertIn('pixel_stage_duration_seconds_bucket{route="/a",stage="decode",le="+Inf"} 2', text)
+        self.assertIn('pixel_stage_duration_seconds_count{route="/a",stage="decode"} 2', text)
+
+    def test_workers_merged(self):
+        """Snapshots of live workers are summed, those of exited workers dropped."""
+        self.metrics.inc('pixel_model_session_uses_total', 2, model='u2net')
+        self.metrics.add('pixel_requests_in_flight', 1)
+        other_worker = self.metrics.snapshot()
+        # The test runner's parent stands in for another live worker
+        other_worker['pid'] = os.getppid()
+        with open(os.path.join(self.directory, f'{os.getppid()}.json'), 'w') as f:
+            json.dump(other_worker, f)
+        with open(os.path.join(self.directory, '999999999.json'), 'w') as f:
+            json.dump(other_worker, f)
+
+        text = self.metrics.collect()
+
+        self.assertIn('pixel_model_session_uses_total{model="u2net"} 4', text)
+        self.assertIn('pixel_requests_in_flight 2', text)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '999999999.json')))
+
+    def test_stage_outside_request(self):
+        with self.metrics.stage('encode'):
+            pass
+        self.assertIn('stage="encode"', self.metrics.collect())
+
+
+class TestMetricsRoute(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = app.test_client()
+        cls.test_data_dir = os.path.join(os.path.dirname(__file__), 'test_data')
+
+    def _upload(self, *parts):
+        with open(os.path.join(self.test_data_dir, *parts), 'rb') as f:
+            return io.BytesIO(f.read()), parts[-1]
+
+    def test_route_and_stage_metrics(self):
+        response = self.client.post('/api/v1/apply-background', data={
+            'image': self._upload('bg_removed_car', 'car2.png'),
+            'background': self._upload('background', 'bg2.jpg'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['X-Request-ID'])
+        self.assertNotIn('Server-Timing', response.headers)
+
+        response = self.client.get('/api/v1/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        text = response.get_data(as_text=True)
+        self.assertIn('pixel_request_duration_seconds_count{route="/api/v1/apply-background"}', text)
+        for stage in ('decode', 'composite', 'encode'):
+            self.assertIn(f'route="/api/v1/apply-background",stage="{stage}"', text)
+        self.assertIn('pixel_jobs{status="queued"}', text)
+
+    def test_trace_on_demand(self):
+        """X-Trace: 1 logs the stage timings with the request id and returns them as Server-Timing."""
+        with self.assertLogs('app.trace', level='INFO') as logs:
+            response = self.client.post('/api/v1/apply-background', data={
+                'image': self._upload('bg_removed_car', 'car2.png'),
+                'background': self._upload('background', 'bg2.jpg'),
+            }, content_type='multipart/form-data',
+                # Not answered from the response cache, which has no stages to trace
+                headers={'X-Trace': '1', 'X-Request-ID': 'abc123', 'Cache-Control': 'no-cache'})
+
+        self.assertEqual(response.headers['X-Request-ID'], 'abc123')
+        self.assertIn('decode;dur=', response.headers['Server-Timing'])
+        self.assertIn('request_id=abc123', logs.output[0])
+        self.assertIn('encode_ms=', logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
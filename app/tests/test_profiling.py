@@ -0,0 +1,157 @@
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.app import app
+from app.profiling import Profiler, ProfilerBusy, profiler
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def spin_until(event):
+    while not event.is_set():
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    def test_sample_collapsed_stacks(self):
+        profiler = Profiler()
+        profiler.configure({'enabled': True, 'admin_token': 'secret'})
+        done = threading.Event()
+        busy = threading.Thread(target=spin_until, args=(done,), name='busy')
+        busy.start()
+        self.addCleanup(busy.join)
+        self.addCleanup(done.set)
+
+        stacks, samples = profiler.sample(0.3, 0.005)
+        self.assertGreater(samples, 10)
+        lines = stacks.splitlines()
+        busy_lines = [line for line in lines if line.startswith('busy;')]
+        self.assertTrue(busy_lines)
+        stack, count = busy_lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        # Outermost frame first, the spinning function last
+        self.assertTrue(stack.split(';')[-1].startswith('spin_until (app/tests/test_profiling.py:'), stack)
+
+    def test_one_sampling_at_a_time(self):
+        profiler = Profiler()
+        sampling = threading.Thread(target=profiler.sample, args=(0.3,))
+        sampling.start()
+        self.addCleanup(sampling.join)
+        time.sleep(0.05)
+        with self.assertRaises(ProfilerBusy):
+            profiler.sample(0.1)
+
+    def test_tracemalloc(self):
+        profiler = Profiler()
+        self.assertIsNone(profiler.top_allocations())
+        self.addCleanup(profiler.stop_tracemalloc)
+        self.assertTrue(profiler.start_tracemalloc(1)['tracing'])
+        profiler.top_allocations()
+        allocated = [bytearray(1024) for _ in range(1000)]
+        top = profiler.top_allocations(limit=5)
+        self.assertTrue(allocated)
+        # Compared with the previous snapshot: the list above is the largest growth
+        self.assertEqual(top['top'][0]['file'], os.path.join('app', 'tests', 'test_profiling.py'))
+        self.assertGreaterEqual(top['top'][0]['size_diff_kb'], 1000)
+
+
+class TestAdminRoutes(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(profiler.configure, app.config.get('profiling'))
+        profiler.configure({'enabled': True, 'admin_token': 'secret', 'directory': self.directory,
+                            'max_profiles': 2})
+
+    def post_add_logo(self, **headers):
+        with open(os.path.join(TEST_DATA, 'car', 'car2.jpg'), 'rb') as car, \
+                open(os.path.join(TEST_DATA, 'logo', 'logo1.png'), 'rb') as logo:
+            return self.client.post('/api/v1/add-logo', data={'image': car, 'logo': logo},
+                                    content_type='multipart/form-data',
+                                    headers={'Cache-Control': 'no-cache', **headers})
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get('/api/v1/admin/profiles').status_code, 403)
+        self.assertEqual(self.client.get('/api/v1/admin/profiles', headers={'X-Admin-Token': 'guess'}).status_code,
+                         403)
+        self.assertEqual(self.client.get('/api/v1/admin/profiles', headers=ADMIN).status_code, 200)
+        # Without an admin, profiling headers are ignored
+        self.assertNotIn('X-Profile-ID', self.post_add_logo(**{'X-Profile': '1'}).headers)
+
+        profiler.configure({'admin_token': 'secret'})
+        self.assertEqual(self.client.get('/api/v1/admin/profiles', headers=ADMIN).status_code, 404)
+        self.assertNotIn('X-Profile-ID', self.post_add_logo(**{'X-Profile': '1'}, **ADMIN).headers)
+
+    def test_request_profiles(self):
+        response = self.post_add_logo(**{'X-Profile': '1'}, **ADMIN)
+        self.assertEqual(response.status_code, 200)
+        profile_id = response.headers['X-Profile-ID']
+
+        profiles = self.client.get('/api/v1/admin/profiles', headers=ADMIN).get_json()['profiles']
+        self.assertEqual(profiles[0]['profile_id'], profile_id)
+        self.assertEqual(profiles[0]['route'], '/api/v1/add-logo')
+
+        report = self.client.get(f'/api/v1/admin/profiles/{profile_id}?sort=tottime&limit=10', headers=ADMIN)
+        self.assertEqual(report.status_code, 200)
+        self.assertIn('add_logo', self.client.get(f'/api/v1/admin/profiles/{profile_id}', headers=ADMIN).text)
+
+        raw = self.client.get(f'/api/v1/admin/profiles/{profile_id}?format=pstats', headers=ADMIN)
+        path = os.path.join(self.directory, 'downloaded.prof')
+        with open(path, 'wb') as f:
+            f.write(raw.data)
+        self.assertGreater(pstats.Stats(path, stream=io.StringIO()).total_calls, 0)
+
+        self.assertEqual(self.client.get('/api/v1/admin/profiles/..%2Fsecret', headers=ADMIN).status_code, 404)
+
+    def test_one_request_profile_at_a_time(self):
+        """Requests arriving while another is profiled, or while another profiler is active, run unprofiled."""
+        with profiler._profiling:
+            response = self.post_add_logo(**{'X-Profile': '1'}, **ADMIN)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-ID', response.headers)
+
+        with mock.patch('cProfile.Profile') as profile:
+            profile.return_value.enable.side_effect = ValueError('Another profiling tool is already active')
+            response = self.post_add_logo(**{'X-Profile': '1'}, **ADMIN)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-ID', response.headers)
+        # The lock was released both times
+        self.assertIn('X-Profile-ID', self.post_add_logo(**{'X-Profile': '1'}, **ADMIN).headers)
+
+    def test_sample_rate(self):
+        profiler.sample_rate = 1
+        for _ in range(3):
+            self.assertIn('X-Profile-ID', self.post_add_logo().headers)
+        # Only the newest max_profiles are kept
+        self.assertEqual(len(self.client.get('/api/v1/admin/profiles', headers=ADMIN).get_json()['profiles']), 2)
+
+    def test_sample_route(self):
+        response = self.client.get('/api/v1/admin/profile/sample?seconds=0.2&interval_ms=5&idle=true',
+                                   headers=ADMIN)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Worker-PID'], str(os.getpid()))
+        self.assertGreater(int(response.headers['X-Samples']), 0)
+        self.assertEqual(response.mimetype, 'text/plain')
+
+    def test_tracemalloc_routes(self):
+        self.addCleanup(profiler.stop_tracemalloc)
+        self.assertEqual(self.client.get('/api/v1/admin/tracemalloc', headers=ADMIN).status_code, 409)
+        self.assertTrue(self.client.post('/api/v1/admin/tracemalloc?frames=5', headers=ADMIN).get_json()['tracing'])
+        top = self.client.get('/api/v1/admin/tracemalloc?group_by=traceback&limit=3', headers=ADMIN).get_json()
+        self.assertLessEqual(len(top['top']), 3)
+        self.assertIn('traceback', top['top'][0])
+        self.assertEqual(self.client.delete('/api/v1/admin/tracemalloc', headers=ADMIN).status_code, 204)
+        self.assertEqual(self.client.get('/api/v1/admin/tracemalloc', headers=ADMIN).status_code, 409)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# The bulk workflow imports rembg on one of its worker threads, then the interpreter has to exit
+BULK_SCRIPT = """
+import io
+from PIL import Image
+from app.app import app
+from app.image_processing import workflows
+from app.image_processing.bg_remover import BackgroundRemover
+from app.image_processing.mask_cache import digest_bytes, mask_cache
+
+buffer = io.BytesIO()
+Image.new('RGB', (64, 48), (200, 30, 30)).save(buffer, format='JPEG')
+data = buffer.getvalue()
+mask_cache.put(BackgroundRemover.cache_key(digest_bytes(data)), Image.new('L', (64, 48), 255))
+results = list(workflows.process_car_images([('car', lambda: data)], max_parallel=2))
+assert results[0][2] is None, results[0][2]
+print('done')
+"""
+
+
+class TestShutdown(unittest.TestCase):
+    def test_process_exits_after_bulk_workflow(self):
+        """A process that first imported the inference backends off the main thread still exits."""
+        root = os.path.join(os.path.dirname(__file__), '..', '..')
+        completed = subprocess.run([sys.executable, '-c', BULK_SCRIPT], cwd=root,
+                                   capture_output=True, text=True, timeout=120)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertIn('done', completed.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
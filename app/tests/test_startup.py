@@ -0,0 +1,29 @@
+import unittest
+
+from app import startup
+from app.app import app
+
+
+class TestStartup(unittest.TestCase):
+    def test_inference_workers(self):
+        """One worker per intra_op_threads cores, never fewer than one."""
+        self.assertEqual(startup.inference_workers(8, 2), 4)
+        self.assertEqual(startup.inference_workers(8, 3), 2)
+        self.assertEqual(startup.inference_workers(1, 2), 1)
+        # 0 threads: every session uses all cores, one worker is enough
+        self.assertEqual(startup.inference_workers(8, 0), 1)
+
+    def test_process_memory(self):
+        memory = startup.process_memory()
+        if memory:
+            self.assertGreater(memory['rss_mb'], 0)
+            self.assertLessEqual(memory['pss_mb'], memory['rss_mb'])
+
+    def test_startup_stats_reported(self):
+        response = app.test_client().get('/api/v1/test')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('memory', response.get_json()['startup'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,12 +23,7 @@ source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt || { echo "Failed to install requirements"; exit 1; }
 
-# Navigate to the directory containing app.py
-cd app || { echo "App directory not found"; exit 1; }
-
-# Determine the number of CPU cores for optimal worker count
-CPU_CORES=$(nproc)
-WORKERS=$((CPU_CORES * 2 + 1))
-
-# Run the Flask app using Gunicorn
-nohup gunicorn --workers "$WORKERS" --threads 2 --bind 0.0.0.0:80 --timeout 240 --chdir /pixel-showroom-api app.app:app > /tmp/gunicorn.log 2>&1 &
+# Run the Flask app using Gunicorn. gunicorn_config.py sets the worker count (one per
+# rembg.intra_op_threads inference cores), preloads the model in the master, warms up
+# each worker and starts its job executor
+nohup gunicorn -c gunicorn_config.py --bind 0.0.0.0:80 app.app:app > /tmp/gunicorn.log 2>&1 &
@@ -1,10 +1,45 @@
-import multiprocessing
+import os
+import time
 
-# Use all available CPU cores
-workers = multiprocessing.cpu_count() * 2 + 1
-threads = 4  # Threads per worker
+import yaml
+
+from app.startup import inference_cores, inference_workers
+
+started_at = time.time()
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'app-base.yml')) as f:
+    rembg_settings = yaml.safe_load(f).get('rembg') or {}
+
+# One worker per `intra_op_threads` inference cores: 2N+1 CPU bound onnxruntime workers
+# oversubscribe the machine. WEB_CONCURRENCY overrides it.
+workers = int(os.environ.get('WEB_CONCURRENCY') or
+              inference_workers(inference_cores(), int(rembg_settings.get('intra_op_threads') or 0)))
+# Threads per worker: more than the admission capacity (app/admission.py), so requests beyond it
+# are refused with 429 at once instead of waiting in the listen backlog into the timeout
+threads = 8
 bind = "0.0.0.0:5000"
 timeout = 120  # Timeout in seconds
-worker_connections = 10  # Max simultaneous connections
 loglevel = "info"  # Log level
-preload_app = True  # Preload application for faster worker start
+preload_app = True  # Import the app once, in the master (the inference stack is imported by on_starting)
+
+
+def on_starting(server):
+    """Import the inference backends and load the model file in the master, the forked workers share them."""
+    from app.app import app
+    from app.startup import preload
+
+    preload(app, started_at)
+
+
+def post_worker_init(worker):
+    """Sweep orphaned scratch files, warm up the model and start the job executor before the worker accepts requests."""
+    from app.app import app
+    from app.image_processing.scratch import scratch_buffers
+    from app.jobs.job_queue import job_manager
+    from app.startup import warm_up_worker
+
+    # Named scratch files left behind by killed workers
+    scratch_buffers.sweep()
+    warm_up_worker(app)
+    # Every worker executes queued jobs, whichever worker accepted them
+    job_manager.start()